@@ -1,7 +1,8 @@
 from abc import ABCMeta, abstractmethod
-from copy import deepcopy
+from copy import copy
 from typing import Any
-from jsonpickle import loads, dumps
+
+import serializers
 
 
 class NamedSingleton(type):
@@ -42,36 +43,107 @@ class NamedSingleton(type):
 
 class PrototypeMixin:
     """
-    The mixin for Prototype pattern
+    The mixin for Prototype pattern. The clone is a shallow copy of
+    the object: its attributes refer to the same objects as the
+    original's, except for the ones the class declares in
+
+    * clone_copied - the containers copied for the clone, so that
+      changing them doesn't affect the original (their items are still
+      shared);
+    * clone_reset - the attributes the clone starts over with, mapped
+      to the factories of their initial values.
     """
+    __slots__ = ()
+    clone_copied = ()
+    clone_reset = {}
 
     def clone(self):
         """
-        The method that utilizes the deepcopy function to create a
-        copy of the class-object fed into it.
+        Creates a copy of the object according to the clone_copied
+        and clone_reset declarations. The cost doesn't depend on the
+        size of the object graph the object refers to.
         :return: a copy of the class-object
         """
-        return deepcopy(self)
+        new_object = copy(self)
+        for attribute in self.clone_copied:
+            setattr(new_object, attribute, copy(getattr(self, attribute)))
+        for attribute, factory in self.clone_reset.items():
+            setattr(new_object, attribute, factory())
+        return new_object
+
+
+class Event:
+     """
+     Base class of the events emitted by the subjects. The subclasses
+     define the types of the events the observers can subscribe to.
+     """
+
+     def __init__(self, subject):
+         """
+         :param subject: emitter of the event
+         """
+         self.subject = subject
+
+     def __repr__(self):
+         return f'<{type(self).__name__} of {self.subject!r}>'
 
 
 class Subject:
      """
      Abstract subject (emitter) class for the Observer pattern.
+
+     The events are delivered to the observers right away, unless the
+     dispatcher is set (see events.EventDispatcher): then the events
+     are only queued and the observers get them in a background thread.
+
+     The observers are kept in a tuple, replaced on every change: the
+     subjects without observers share the empty one and the clones
+     share the observers of the original until either of them changes.
      """
+     __slots__ = ('observers',)
+     dispatcher = None
 
      def __init__(self):
          """
-         Initializes the class object, prepares the list of all
-         know observers.
+         Initializes the class object, no observers yet.
          """
-         self.observers = []
+         self.observers = ()
 
-     def notify(self):
+     def attach(self, observer):
          """
-         Notifies all the observers of the changes.
+         Subscribes the observer to the events of the subject.
+
+         :param observer: an instance of Observer
+         """
+         if observer not in self.observers:
+             self.observers = (*self.observers, observer)
+
+     def detach(self, observer):
          """
+         Unsubscribes the observer from the events of the subject.
+
+         :param observer: an instance of Observer
+         """
+         self.observers = tuple(item for item in self.observers
+                                if item is not observer)
+
+     def notify(self, event=None):
+         """
+         Notifies all the observers subscribed to the event of the
+         changes.
+
+         :param event: an instance of Event, a plain Event of the subject
+         if omitted
+         """
+         if event is None:
+             event = Event(self)
          for observer in self.observers:
-             observer.update(self)
+             if not observer.accepts(event):
+                 continue
+             if self.dispatcher is None:
+                 observer.deliver([event])
+             else:
+                 self.dispatcher.publish(observer, event)
 
 
 class Observer:
@@ -79,6 +151,25 @@ class Observer:
     Abstract observer that updates the data once it receives the
     signal from the Subject. Part of the Observer pattern.
     """
+    # types of the events the observer is subscribed to, all if empty
+    events = ()
+
+    def accepts(self, event):
+        """
+        :param event: an instance of Event
+        :return: whether the observer is subscribed to the event
+        """
+        return not self.events or isinstance(event, self.events)
+
+    def deliver(self, events):
+        """
+        Handles a batch of events at once, e.g. sends them in one
+        outbound call. Calls update for every event by default.
+
+        :param events: list of Event instances
+        """
+        for event in events:
+            self.update(event.subject)
 
     def update(self, subject):
         """
@@ -91,6 +182,8 @@ class User(metaclass=ABCMeta):
     """
     Base metaclass for a user. Main functionality TBD
     """
+    __slots__ = ('name',)
+
     def __init__(self, name):
         """
         :param name: username
@@ -115,29 +208,54 @@ class Factory(metaclass=ABCMeta):
 
 class BaseSerializer:
      """
-     Basic serializer for use in the framework. Utilizes the jsonpickle lib.
+     Basic serializer for use in the framework. Serializes the models
+     registered with serializers.serializable by their declared fields,
+     the references to other models are written as their ids. Supports
+     JSON and a compact binary format.
      """
+     formats = {
+         'json': (serializers.dump_json, serializers.load_json),
+         'binary': (serializers.dump_binary, serializers.load_binary),
+     }
 
-     def __init__(self, obj):
+     def __init__(self, obj, format='json', many=False):
          """
          Initializes the serializer object.
 
-         :param obj: object to serialize
+         :param obj: model object to serialize
+         :param format: 'json' or 'binary'
+         :param many: whether obj is a list of model objects
          """
          self.object = obj
+         self.format = format
+         self.many = many
 
      def save(self):
          """
-         Serializes the data utilizing the jsonpickle lib.
+         Serializes the object (or the list of objects).
+
+         :return: str for JSON, bytes for the binary format
          """
-         return dumps(self.object)
+         dump = self.formats[self.format][0]
+         return dump(list(self.object) if self.many else [self.object])
 
-     @staticmethod
-     def load(data):
+     @classmethod
+     def load(cls, data, many=False, resolver=None):
          """
-         Deserializes the data using the jsonpickle lib.
+         Deserializes the data, the format is detected by the type of
+         the data.
+
+         :param data: str (JSON) or bytes (binary format)
+         :param many: whether a list of objects was serialized
+         :param resolver: callable (kind, id) -> object resolving the
+         references to the objects which weren't serialized
+         :return: the restored object or the list of them
          """
-         return loads(data)
+         format = 'json' if isinstance(data, str) else 'binary'
+         objects = cls.formats[format][1](data, resolver)
+         if many:
+             return objects
+         return objects[0] if objects else None
 
 
 class LoggerStrategy(metaclass=ABCMeta):
@@ -0,0 +1,152 @@
+"""
+Benchmark of the same routes served by `gunicorn main:app` (WSGI) and
+by `uvicorn main:asgi_app` (ASGI, skipped if uvicorn isn't installed).
+Every server is started as a subprocess, the load comes from many
+concurrent connections opened with asyncio. Run from the project root:
+
+`python -m bench.asgi_bench [concurrency] [seconds per route]`
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+from importlib.util import find_spec
+from time import monotonic, perf_counter, sleep
+
+from instrumentation import Histogram
+
+ROUTES = ('/', '/all_courses/', '/api/')
+CONCURRENCY = 50
+DURATION = 5.0
+WORKERS = 2
+
+
+def free_port():
+    """
+    :return: number of an unused TCP port
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_commands(port):
+    """
+    :param port: port to listen on
+    :return: dict of the commands starting the servers by their names
+    """
+    bind = f'127.0.0.1:{port}'
+    commands = {
+        'gunicorn (wsgi)': [sys.executable, '-m', 'gunicorn', 'main:app',
+                            '-b', bind, '-w', str(WORKERS), '--threads', '4',
+                            '--log-level', 'warning'],
+    }
+    if find_spec('uvicorn') is not None:
+        commands['uvicorn (asgi)'] = [
+            sys.executable, '-m', 'uvicorn', 'main:asgi_app', '--host',
+            '127.0.0.1', '--port', str(port), '--workers', str(WORKERS),
+            '--log-level', 'warning', '--no-access-log']
+    return commands
+
+
+def wait_for_port(port, timeout=30):
+    """
+    Waits until the server accepts the connections.
+
+    :param port: port of the server
+    :param timeout: maximum waiting time in seconds
+    """
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError(f'The server on port {port} did not start')
+
+
+async def fetch(port, path):
+    """
+    Makes one GET request over a new connection.
+
+    :param port: port of the server
+    :param path: requested path
+    :return: status code of the response, None if the server closed
+    the connection without responding
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n'
+                 f'Connection: close\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    if not response:
+        return None
+    return int(response.split(b' ', 2)[1])
+
+
+async def load(port, path, concurrency, duration):
+    """
+    Sends the requests from concurrent clients for the given time.
+
+    :param port: port of the server
+    :param path: requested path
+    :param concurrency: number of the concurrent clients
+    :param duration: time in seconds
+    :return: tuple of the latency Histogram and the number of errors
+    """
+    histogram = Histogram()
+    errors = 0
+    deadline = monotonic() + duration
+
+    async def client():
+        nonlocal errors
+        while monotonic() < deadline:
+            start = perf_counter()
+            try:
+                status = await fetch(port, path)
+            except OSError:
+                status = None
+            if status != 200:
+                errors += 1
+            histogram.record(perf_counter() - start)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return histogram, errors
+
+
+def run(concurrency=CONCURRENCY, duration=DURATION):
+    """
+    Prints the throughput and the latency of every server and route.
+
+    :param concurrency: number of the concurrent clients
+    :param duration: time in seconds per route
+    """
+    environment = dict(os.environ, DEBUG='0')
+    print(f'{"server":<16} {"route":<14} {"rps":>8} {"p50 ms":>8} '
+          f'{"p99 ms":>8} {"errors":>7}')
+    for name in server_commands(0):
+        port = free_port()
+        server = subprocess.Popen(server_commands(port)[name],
+                                  env=environment,
+                                  stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            for path in ROUTES:
+                histogram, errors = asyncio.run(
+                    load(port, path, concurrency, duration))
+                print(f'{name:<16} {path:<14} '
+                      f'{histogram.count / duration:>8.0f} '
+                      f'{histogram.percentile(50) * 1000:>8.2f} '
+                      f'{histogram.percentile(99) * 1000:>8.2f} '
+                      f'{errors:>7}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    run(*(int(argument) for argument in sys.argv[1:2]),
+        *(float(argument) for argument in sys.argv[2:3]))
@@ -0,0 +1,86 @@
+"""
+Benchmark of the category aggregates on a 10k-node category tree:
+reading the course counts of every category (what the categories page
+does) with the maintained aggregates against the recursive walk over
+the parent chain count_courses used to do, the cost of adding a course
+and of the full consistency check. Run from the project root:
+
+`python -m bench.category_bench [number of categories]`
+"""
+import sys
+from time import perf_counter
+
+from models import OnlineUniversity
+
+CATEGORIES = 10_000
+COURSES_PER_CATEGORY = 2
+SHAPES = {'bushy (4 children)': 4, 'chain (1 child)': 1}
+
+
+def legacy_count_courses(category):
+    """
+    The former CourseCategory.count_courses: the courses of the category
+    plus, recursively, the ones of all its ancestors.
+    """
+    res = len(category.existing_courses)
+    if category.category:
+        res += legacy_count_courses(category.category)
+    return res
+
+
+def build_site(categories, branching):
+    """
+    :param categories: number of categories
+    :param branching: number of children of every category
+    :return: an instance of OnlineUniversity with the tree
+    """
+    site = OnlineUniversity()
+    for number in range(categories):
+        parent = site.course_categories[(number - 1) // branching] \
+            if number else None
+        category = site.add_category(site.create_category(
+            f'Category {number}', parent))
+        for course_number in range(COURSES_PER_CATEGORY):
+            site.add_course(site.create_course(
+                'online', f'Course {number}.{course_number}', category))
+    return site
+
+
+def timed(function):
+    """
+    :param function: callable without arguments
+    :return: time of the call in milliseconds, or the error's name
+    """
+    start = perf_counter()
+    try:
+        function()
+    except RecursionError:
+        return 'RecursionError'
+    return f'{(perf_counter() - start) * 1000:.2f}ms'
+
+
+def run(categories=CATEGORIES):
+    """
+    Prints the timings for every shape of the tree.
+
+    :param categories: number of categories
+    """
+    print(f'{categories} categories, {COURSES_PER_CATEGORY} courses each')
+    print(f'{"tree":<20} {"read all":>12} {"read legacy":>15} '
+          f'{"add course":>12} {"check":>12}')
+    for name, branching in SHAPES.items():
+        site = build_site(categories, branching)
+        all_categories = site.course_categories
+        leaf = all_categories[-1]
+        read = timed(lambda: [category.count_courses()
+                              for category in all_categories])
+        legacy = timed(lambda: [legacy_count_courses(category)
+                                for category in all_categories])
+        add = timed(lambda: site.add_course(
+            site.create_course('online', 'New course', leaf)))
+        check = timed(site.recompute_category_counts)
+        print(f'{name:<20} {read:>12} {legacy:>15} {add:>12} {check:>12}')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else CATEGORIES)
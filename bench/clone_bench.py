@@ -0,0 +1,92 @@
+"""
+Benchmark of the course cloning: the shallow clone of PrototypeMixin
+against the deepcopy it used to do, for catalogs of different sizes.
+The cost of the shallow clone shouldn't grow with the catalog. Run from
+the project root:
+
+`python -m bench.clone_bench`
+"""
+import sys
+import tracemalloc
+from copy import deepcopy
+from time import perf_counter
+
+from models import CourseCategory, CourseFactory, Student, EmailNotifier, \
+    EnrollmentRegistry
+
+CATALOG_SIZES = (100, 1_000, 10_000)
+STUDENTS_PER_COURSE = 5
+CLONES = 1_000
+DEEP_CLONES = 1
+# tracing the deepcopy of the larger catalogs takes minutes
+DEEP_COPY_MAX_SIZE = 1_000
+
+
+def build_catalog(size):
+    """
+    Generates the courses of one category with enrolled students.
+
+    :param size: number of courses
+    :return: the course in the middle of the catalog
+    """
+    category = CourseCategory('Category', None)
+    students = [Student(f'Student {i}') for i in range(size)]
+    notifier = EmailNotifier()
+    courses = []
+    for i in range(size):
+        course = CourseFactory.create('online', f'Course {i}', category)
+        course.attach(notifier)
+        for j in range(STUDENTS_PER_COURSE):
+            student = students[(i + j) % size]
+            EnrollmentRegistry.enroll(course, student)
+        courses.append(course)
+    return courses[size // 2]
+
+
+def measure(clone, course, number):
+    """
+    Measures the time first and the memory in a separate pass, since
+    tracemalloc slows the cloning down.
+
+    :param clone: callable cloning the course
+    :param course: course to clone
+    :param number: number of clones
+    :return: tuple of the time and the allocated memory per clone
+    """
+    start = perf_counter()
+    clones = [clone(course) for _ in range(number)]
+    elapsed = perf_counter() - start
+    del clones
+    tracemalloc.start()
+    clones = [clone(course) for _ in range(number)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del clones
+    return elapsed / number, size / number
+
+
+def run():
+    """
+    Prints the time and the memory per clone for every catalog size.
+    """
+    # deepcopy recurses through the whole linked catalog
+    sys.setrecursionlimit(1_000_000)
+    print(f'{"courses":>8} {"clone":>10} {"clone mem":>11} '
+          f'{"deepcopy":>11} {"deepcopy mem":>14}')
+    for size in CATALOG_SIZES:
+        course = build_catalog(size)
+        # the clones are added to the category, start from the same state
+        existing_courses = list(course.category.existing_courses)
+        clone_time, clone_memory = measure(
+            lambda obj: obj.clone(), course, CLONES)
+        course.category.existing_courses[:] = existing_courses
+        line = f'{size:>8} {clone_time * 1e6:>8.1f}us ' \
+               f'{clone_memory / 1024:>9.1f}KB'
+        if size <= DEEP_COPY_MAX_SIZE:
+            deep_time, deep_memory = measure(deepcopy, course, DEEP_CLONES)
+            line += f' {deep_time * 1e3:>9.1f}ms {deep_memory / 1024:>12.1f}KB'
+        print(line)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,113 @@
+"""
+Benchmark of the response compression on the /all_courses/ page: the
+CPU time the compression adds to a request against the bytes it saves,
+for gzip and deflate at different levels. The page itself comes from
+the response cache, so the difference is the cost of the compression.
+The last row wraps the page into a lazy application, which calls
+start_response on the first iteration of its body (like the generator
+applications do), and checks it decompresses to the same page.
+Run from the project root:
+
+`python -m bench.compression_bench [number of courses] [requests]`
+"""
+import sys
+import zlib
+from io import BytesIO
+from time import process_time
+
+from bench.fixtures import populate
+from compression import CompressionMiddleware, WBITS
+from main import app, site
+
+COURSES = 2_000
+REQUESTS = 200
+LEVELS = (1, 6, 9)
+CODINGS = ('gzip', 'deflate')
+PATH = '/all_courses/'
+
+
+def request(application, accept_encoding):
+    """
+    :param application: WSGI application
+    :param accept_encoding: value of the Accept-Encoding header
+    :return: the response's body
+    """
+    environment = {'REQUEST_METHOD': 'GET', 'PATH_INFO': PATH,
+                   'QUERY_STRING': '', 'wsgi.input': BytesIO(),
+                   'HTTP_ACCEPT_ENCODING': accept_encoding}
+    body = application(environment, lambda status, headers, exc_info=None:
+                       None)
+    data = b''.join(body)
+    close = getattr(body, 'close', None)
+    if close is not None:
+        close()
+    return data
+
+
+def lazy(application):
+    """
+    :param application: WSGI application
+    :return: WSGI application calling the given one (and so
+    start_response) on the first iteration of its body
+    """
+    def lazy_application(environment, start_response):
+        yield from application(environment, start_response)
+
+    return lazy_application
+
+
+def measure(application, accept_encoding, requests):
+    """
+    :param application: WSGI application
+    :param accept_encoding: value of the Accept-Encoding header
+    :param requests: number of requests
+    :return: tuple of the CPU time per request in seconds and the size
+    of the response
+    """
+    size = len(request(application, accept_encoding))
+    start = process_time()
+    for _ in range(requests):
+        request(application, accept_encoding)
+    return (process_time() - start) / requests, size
+
+
+def run(courses=COURSES, requests=REQUESTS):
+    """
+    Prints the cost and the savings of every coding and level.
+
+    :param courses: number of courses on the page
+    :param requests: number of requests per measurement
+    """
+    populate(site, categories=max(courses // 10, 1), courses=courses,
+             students=courses, enrollments_per_student=2)
+    # the middleware stack of main.app without the compression
+    uncompressed = app.app
+    base_time, base_size = measure(uncompressed, '', requests)
+    print(f'{PATH} with {courses} courses, {requests} requests each')
+    print(f'{"coding":<12} {"level":>5} {"bytes":>10} {"ratio":>7} '
+          f'{"cpu/request":>13} {"added cpu":>11} {"cpu per MB saved":>18}')
+    print(f'{"identity":<12} {"-":>5} {base_size:>10} {1:>7.2f} '
+          f'{base_time * 1000:>11.3f}ms {"-":>11} {"-":>18}')
+    for coding in CODINGS:
+        for level in LEVELS:
+            compressed = CompressionMiddleware(uncompressed, level=level,
+                                               deflate=True)
+            time, size = measure(compressed, coding, requests)
+            added = time - base_time
+            saved = (base_size - size) / 1024 / 1024
+            print(f'{coding:<12} {level:>5} {size:>10} '
+                  f'{base_size / size:>7.2f} {time * 1000:>11.3f}ms '
+                  f'{added * 1000:>9.3f}ms '
+                  f'{added * 1000 / saved if saved else 0:>16.2f}ms')
+    compressed = CompressionMiddleware(lazy(uncompressed))
+    time, size = measure(compressed, 'gzip', requests)
+    same = zlib.decompress(request(compressed, 'gzip'), WBITS['gzip']) == \
+        request(uncompressed, '')
+    print(f'{"gzip, lazy":<12} {compressed.level:>5} {size:>10} '
+          f'{base_size / size:>7.2f} {time * 1000:>11.3f}ms '
+          f'{(time - base_time) * 1000:>9.3f}ms '
+          f'{"same page" if same else "DIFFERENT PAGE":>18}')
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
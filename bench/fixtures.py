@@ -0,0 +1,60 @@
+"""
+Generators of the test data: fill an OnlineUniversity with nested
+categories, courses and students enrolled on them. The data goes through
+the site's methods, so it reaches the storage backend (e.g. SQLite) as
+well, but the courses' observers aren't notified of the enrollments.
+"""
+from random import Random
+
+from models import CourseFactory
+
+CATEGORIES = 200
+COURSES = 2_000
+STUDENTS = 5_000
+ENROLLMENTS_PER_STUDENT = 3
+BRANCHING = 4
+
+
+def populate(site, categories=CATEGORIES, courses=COURSES,
+             students=STUDENTS,
+             enrollments_per_student=ENROLLMENTS_PER_STUDENT,
+             branching=BRANCHING, seed=0):
+    """
+    Adds the generated data to the site. The categories form a tree:
+    every category has up to 'branching' subcategories, so the depth
+    grows as the logarithm of their number. The courses are spread
+    evenly over the categories, every student attends random courses.
+
+    :param site: an instance of OnlineUniversity
+    :param categories: number of categories
+    :param courses: number of courses
+    :param students: number of students
+    :param enrollments_per_student: number of courses of every student
+    :param branching: maximum number of subcategories of a category
+    :param seed: seed of the random choices
+    :return: dict with the numbers of the generated objects
+    """
+    random = Random(seed)
+    with site.storage.unit_of_work():
+        new_categories = []
+        for number in range(categories):
+            parent = new_categories[(number - 1) // branching] \
+                if number else None
+            new_categories.append(site.add_category(site.create_category(
+                f'Category {number}', parent)))
+        types = list(CourseFactory.course_types)
+        new_courses = [site.add_course(site.create_course(
+            types[number % len(types)], f'Course {number}',
+            new_categories[number % categories]))
+            for number in range(courses)]
+        enrollments = 0
+        for number in range(students):
+            student = site.add_student(site.create_user(
+                'student', f'Student {number}'))
+            for course in random.sample(
+                    new_courses, min(enrollments_per_student, courses)):
+                site.index_enrollment(course, student)
+                site.emit('student_enrolled', (course, student))
+                enrollments += 1
+    return {'categories': categories, 'courses': courses,
+            'students': students, 'enrollments': enrollments}
@@ -0,0 +1,98 @@
+"""
+Benchmark of the memory the model objects take: the bytes traced by
+tracemalloc per category, per course (with the two notifiers the app
+attaches to every course), per student and per enrollment, as the
+number of the students grows. Run from the project root:
+
+`python -m bench.memory_bench [largest number of students]`
+"""
+import gc
+import sys
+import tracemalloc
+
+from models import CourseCategory, CourseFactory, Student, EmailNotifier, \
+    EnrollmentRegistry, TextMessageNotifier
+
+STUDENT_COUNTS = (10_000, 100_000, 300_000)
+STUDENTS_PER_COURSE = 100
+COURSES_PER_CATEGORY = 10
+ENROLLMENTS_PER_STUDENT = 2
+
+
+def traced():
+    """
+    :return: number of the bytes currently traced
+    """
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure(students):
+    """
+    Creates the catalog and measures every kind of the objects.
+
+    :param students: number of the students
+    :return: dict of the bytes per object by the kinds of the objects
+    """
+    courses = students // STUDENTS_PER_COURSE
+    categories = courses // COURSES_PER_CATEGORY
+    notifiers = (EmailNotifier(), TextMessageNotifier())
+    kept = []
+    result = {}
+    tracemalloc.start()
+    try:
+        start = traced()
+        new_categories = [CourseCategory(f'Category {number}', None)
+                          for number in range(categories)]
+        kept.append(new_categories)
+        result['category'] = (traced() - start) / categories
+
+        start = traced()
+        new_courses = []
+        for number in range(courses):
+            course = CourseFactory.create(
+                'online', f'Course {number}',
+                new_categories[number % categories])
+            for notifier in notifiers:
+                course.attach(notifier)
+            new_courses.append(course)
+        kept.append(new_courses)
+        result['course'] = (traced() - start) / courses
+
+        start = traced()
+        new_students = [Student(f'Student {number}')
+                        for number in range(students)]
+        kept.append(new_students)
+        result['student'] = (traced() - start) / students
+
+        start = traced()
+        for number, student in enumerate(new_students):
+            for offset in range(ENROLLMENTS_PER_STUDENT):
+                EnrollmentRegistry.enroll(
+                    new_courses[(number + offset) % courses], student)
+        result['enrollment'] = (traced() - start) / (
+            students * ENROLLMENTS_PER_STUDENT)
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def run(max_students=max(STUDENT_COUNTS)):
+    """
+    Prints the bytes per object for every number of the students.
+
+    :param max_students: largest number of the students
+    """
+    print(f'{"students":>9} {"category":>9} {"course":>9} {"student":>9} '
+          f'{"enrollment":>11}   bytes per object')
+    for students in STUDENT_COUNTS:
+        if students > max_students:
+            break
+        result = measure(students)
+        print(f'{students:>9} {result["category"]:>9.0f} '
+              f'{result["course"]:>9.0f} {result["student"]:>9.0f} '
+              f'{result["enrollment"]:>11.0f}')
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,167 @@
+"""
+Benchmark of the enrollment reports: the aggregates computed by walking
+the object graph (the courses' and the students' rosters) against the
+columnar EnrollmentStore, in pure Python and with NumPy (if installed).
+The CSR indexes the store builds for the lookups of the students of
+a course (and the courses of a student) are timed apart. At the end,
+every query of the NumPy store is compared with the pure Python one,
+after a course and a student are removed as well.
+Run from the project root:
+
+`python -m bench.reports_bench [number of students]`
+"""
+import sys
+from collections import Counter
+from heapq import nlargest
+from time import perf_counter
+
+import enrollments
+from bench.fixtures import populate
+from enrollments import EnrollmentStore
+from models import OnlineUniversity
+
+STUDENTS = 100_000
+COURSES = 2_000
+CATEGORIES = 200
+ENROLLMENTS_PER_STUDENT = 3
+TOP_COURSES = 10
+REPEAT = 5
+
+
+def graph_reports(site):
+    """
+    Computes the reports by walking the objects.
+
+    :param site: OnlineUniversity
+    :return: dict of the reports
+    """
+    counts = {course.id: len(course.students) for course in site.courses}
+    categories = {}
+    for course in site.courses:
+        if course.category is not None:
+            courses, students = categories.get(course.category.id, (0, 0))
+            categories[course.category.id] = (courses + 1,
+                                              students + counts[course.id])
+    histogram = Counter(len(student.courses_in_attendance)
+                        for student in site.students
+                        if student.courses_in_attendance)
+    return {
+        'counts': counts,
+        'top': nlargest(TOP_COURSES, counts.items(),
+                        key=lambda item: item[1]),
+        'categories': categories,
+        'histogram': [histogram[count]
+                      for count in range(1, max(histogram, default=0) + 1)],
+    }
+
+
+def store_reports(store):
+    """
+    :param store: EnrollmentStore
+    :return: dict of the reports
+    """
+    return {
+        'counts': store.course_counts(),
+        'top': store.top_courses(TOP_COURSES),
+        'categories': store.category_counts(),
+        'histogram': store.courses_per_student(),
+    }
+
+
+def all_results(store, course_ids, student_ids):
+    """
+    :param store: EnrollmentStore
+    :param course_ids: ids of the courses to look up the students of
+    :param student_ids: ids of the students to look up the courses of
+    :return: dict of the results of every query of the store
+    """
+    return {
+        'course_counts': store.course_counts(),
+        'top_courses': store.top_courses(len(store.course_totals)),
+        'category_counts': store.category_counts(),
+        'courses_per_student': store.courses_per_student(),
+        'enrollments_per_period': store.enrollments_per_period(),
+        'students_of': [store.students_of(course_id)
+                        for course_id in course_ids],
+        'courses_of': [store.courses_of(student_id)
+                       for student_id in student_ids],
+    }
+
+
+def compare(site, stores):
+    """
+    Removes a course and a student, then compares the results of every
+    query of the stores with the pure Python one.
+
+    :param site: OnlineUniversity the stores listen to
+    :param stores: dict of the EnrollmentStores by name
+    :return: whether all the stores agree
+    """
+    site.remove_course(site.courses[len(site.courses) // 2])
+    site.remove_student(site.students[len(site.students) // 2])
+    course_ids = [course.id for course in site.courses[::97]] + [-1, 10 ** 9]
+    student_ids = [student.id for student in site.students[::997]] + [-1]
+    expected = all_results(stores['columns'], course_ids, student_ids)
+    consistent = True
+    for name, store in stores.items():
+        result = all_results(store, course_ids, student_ids)
+        differ = [query for query in expected
+                  if result[query] != expected[query]]
+        if differ:
+            consistent = False
+            print(f'{name}: {", ".join(differ)} differ from pure Python!')
+    return consistent
+
+
+def timed(function, *args):
+    """
+    :return: tuple of the best time of REPEAT calls in seconds and the
+    result
+    """
+    best = None
+    for _ in range(REPEAT):
+        start = perf_counter()
+        result = function(*args)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(students=STUDENTS):
+    """
+    Prints the time of the reports computed every way.
+
+    :param students: number of the students
+    """
+    site = OnlineUniversity()
+    stores = {'columns': EnrollmentStore(use_numpy=False)}
+    if enrollments.numpy is not None:
+        stores['columns + numpy'] = EnrollmentStore(use_numpy=True)
+    for store in stores.values():
+        site.listeners.append(store.handle)
+    populate(site, categories=CATEGORIES, courses=COURSES, students=students,
+             enrollments_per_student=ENROLLMENTS_PER_STUDENT)
+    print(f'{students} students, {COURSES} courses, '
+          f'{students * ENROLLMENTS_PER_STUDENT} enrollments')
+    print(f'{"":<16} {"indexes":>10} {"reports":>10}')
+    graph_time, expected = timed(graph_reports, site)
+    print(f'{"object graph":<16} {"-":>10} {graph_time * 1000:>8.1f}ms')
+    for name, store in stores.items():
+        start = perf_counter()
+        store.indexes()
+        index_time = perf_counter() - start
+        report_time, result = timed(store_reports, store)
+        consistent = result['counts'] == expected['counts'] and \
+            result['categories'] == expected['categories'] and \
+            result['histogram'] == expected['histogram'] and \
+            [count for _, count in result['top']] == \
+            [count for _, count in expected['top']]
+        print(f'{name:<16} {index_time * 1000:>8.1f}ms '
+              f'{report_time * 1000:>8.1f}ms'
+              f'{"" if consistent else "  (results differ!)"}')
+    if len(stores) > 1 and compare(site, stores):
+        print('numpy results match pure Python')
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:2]))
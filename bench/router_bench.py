@@ -0,0 +1,55 @@
+"""
+Microbenchmark of the URL dispatch: the compiled Router against the plain
+dict lookup the App used to do. Run from the project root:
+
+`python -m bench.router_bench`
+"""
+from timeit import timeit
+
+from router import Router
+
+ROUTE_COUNTS = (10, 100, 500)
+LOOKUPS = 200_000
+
+
+def build_routes(count):
+    """
+    Generates the static and the dynamic url patterns.
+
+    :param count: number of routes of each kind
+    :return: tuple of lists with static and dynamic patterns
+    """
+    static = [f'/section_{i}/page/' for i in range(count)]
+    dynamic = [f'/section_{i}/item/<int:id>/' for i in range(count)]
+    return static, dynamic
+
+
+def run():
+    """
+    Prints the average lookup time for every number of routes.
+    """
+    print(f'{"routes":>8} {"dict":>12} {"router static":>15} '
+          f'{"router dynamic":>16}')
+    for count in ROUTE_COUNTS:
+        static, dynamic = build_routes(count)
+        urls = {url: object() for url in static}
+        router = Router.from_dict(urls)
+        for pattern in dynamic:
+            router.add(pattern, object())
+        static_path = static[count // 2]
+        dynamic_path = f'/section_{count // 2}/item/42/'
+        router.resolve(dynamic_path)
+
+        dict_time = timeit(lambda: urls.get(static_path), number=LOOKUPS)
+        static_time = timeit(lambda: router.resolve(static_path),
+                             number=LOOKUPS)
+        dynamic_time = timeit(lambda: router.resolve(dynamic_path),
+                              number=LOOKUPS)
+        print(f'{count:>8} '
+              f'{dict_time / LOOKUPS * 1e9:>10.0f}ns '
+              f'{static_time / LOOKUPS * 1e9:>13.0f}ns '
+              f'{dynamic_time / LOOKUPS * 1e9:>14.0f}ns')
+
+
+if __name__ == '__main__':
+    run()
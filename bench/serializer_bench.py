@@ -0,0 +1,92 @@
+"""
+Benchmark of the model serialization: the schema-based JSON and binary
+formats against jsonpickle the BaseSerializer used to rely on (skipped
+if jsonpickle isn't installed). Run from the project root:
+
+`python -m bench.serializer_bench [number of courses]`
+"""
+import sys
+from time import perf_counter
+
+from bases import BaseSerializer
+from models import CourseCategory, CourseFactory, Student, \
+    EnrollmentRegistry
+
+COURSES = 100_000
+CATEGORIES = 100
+STUDENTS = 1_000
+STUDENTS_PER_COURSE = 5
+
+try:
+    import jsonpickle
+except ImportError:
+    jsonpickle = None
+
+
+def build_objects(count):
+    """
+    Generates the categories, the courses and the enrolled students.
+
+    :param count: number of courses
+    :return: list of all the objects
+    """
+    categories = [CourseCategory('Root', None)]
+    categories += [CourseCategory(f'Category {i}', categories[0])
+                   for i in range(1, CATEGORIES)]
+    students = [Student(f'Student {i}') for i in range(STUDENTS)]
+    types = list(CourseFactory.course_types)
+    courses = []
+    for i in range(count):
+        course = CourseFactory.create(types[i % len(types)], f'Course {i}',
+                                      categories[i % CATEGORIES])
+        for j in range(STUDENTS_PER_COURSE):
+            student = students[(i * STUDENTS_PER_COURSE + j) % STUDENTS]
+            EnrollmentRegistry.enroll(course, student)
+        courses.append(course)
+    return categories + courses + students
+
+
+def measure(dump, load):
+    """
+    :param dump: callable returning the serialized data
+    :param load: callable taking the serialized data
+    :return: tuple of the size, the dump and the load time in seconds
+    """
+    start = perf_counter()
+    data = dump()
+    dumped = perf_counter()
+    load(data)
+    loaded = perf_counter()
+    return len(data), dumped - start, loaded - dumped
+
+
+def run(count=COURSES):
+    """
+    Prints the size and the timings of every serializer.
+
+    :param count: number of courses
+    """
+    objects = build_objects(count)
+    print(f'{len(objects)} objects, {count} courses')
+    candidates = {
+        'json': lambda: measure(
+            BaseSerializer(objects, 'json', many=True).save,
+            lambda data: BaseSerializer.load(data, many=True)),
+        'binary': lambda: measure(
+            BaseSerializer(objects, 'binary', many=True).save,
+            lambda data: BaseSerializer.load(data, many=True)),
+    }
+    if jsonpickle is not None:
+        # the recursion of jsonpickle goes deep on the linked objects
+        sys.setrecursionlimit(100_000)
+        candidates['jsonpickle'] = lambda: measure(
+            lambda: jsonpickle.dumps(objects), jsonpickle.loads)
+    print(f'{"format":<12} {"size":>14} {"dump":>10} {"load":>10}')
+    for name, candidate in candidates.items():
+        size, dump_time, load_time = candidate()
+        print(f'{name:<12} {size:>12,}B {dump_time:>9.3f}s '
+              f'{load_time:>9.3f}s')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else COURSES)
@@ -0,0 +1,120 @@
+"""
+Benchmark of the shared log storage as the number of the worker
+processes grows: the throughput of the writes (one student per unit of
+work, like one request), of the refreshes when nothing has changed
+(the cost every request pays) and of a mix of one write to nine reads,
+plus the time a worker takes to catch up with the writes of the others.
+Run from the project root:
+
+`python -m bench.shared_log_bench [max workers] [seconds per phase]`
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from models import OnlineUniversity
+from storage import SharedLogStorage
+
+WORKER_COUNTS = (1, 2, 4, 8)
+DURATION = 2.0
+READS_PER_WRITE = 9
+
+
+def run_phase(site, duration, reads_per_write):
+    """
+    :param site: OnlineUniversity of the worker
+    :param duration: duration of the phase in seconds
+    :param reads_per_write: number of the refreshes per write, None for
+    the refreshes only
+    :return: number of the operations done
+    """
+    operations = 0
+    deadline = perf_counter() + duration
+    while perf_counter() < deadline:
+        if reads_per_write is not None and \
+                operations % (reads_per_write + 1) == 0:
+            with site.storage.unit_of_work():
+                site.add_student(site.create_user(
+                    'student', f'Student {os.getpid()}.{operations}'))
+        else:
+            site.refresh()
+        operations += 1
+    return operations
+
+
+def worker(path, duration, barrier, results):
+    """
+    Runs the phases in one worker process.
+
+    :param path: path to the log file
+    :param duration: duration of every phase in seconds
+    :param barrier: multiprocessing.Barrier of all the workers
+    :param results: multiprocessing.Queue receiving the results
+    """
+    site = OnlineUniversity(SharedLogStorage(path))
+    site.load()
+    barrier.wait()
+    writes = run_phase(site, duration, 0)
+    barrier.wait()
+    start = perf_counter()
+    site.refresh()
+    catch_up = perf_counter() - start
+    barrier.wait()
+    reads = run_phase(site, duration, None)
+    barrier.wait()
+    mixed = run_phase(site, duration, READS_PER_WRITE)
+    barrier.wait()
+    site.refresh()
+    results.put((writes, catch_up, reads, mixed,
+                 len(site.student_repository.objects)))
+
+
+def measure(workers, duration):
+    """
+    :param workers: number of the worker processes
+    :param duration: duration of every phase in seconds
+    :return: tuple of the writes per second, the longest catch-up time,
+    the reads per second, the mixed operations per second and whether
+    all the workers see the same number of students
+    """
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'university.log')
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [context.Process(target=worker, args=(
+            path, duration, barrier, results)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    writes, catch_ups, reads, mixed, students = zip(*collected)
+    return (sum(writes) / duration, max(catch_ups), sum(reads) / duration,
+            sum(mixed) / duration, len(set(students)) == 1)
+
+
+def run(max_workers=max(WORKER_COUNTS), duration=DURATION):
+    """
+    Prints the throughput for every number of the workers.
+
+    :param max_workers: maximum number of the worker processes
+    :param duration: duration of every phase in seconds
+    """
+    print(f'{duration}s per phase, {os.cpu_count()} CPUs')
+    print(f'{"workers":>7} {"writes/s":>10} {"catch-up":>10} '
+          f'{"reads/s":>12} {"mixed ops/s":>12} {"consistent":>10}')
+    for workers in WORKER_COUNTS:
+        if workers > max_workers:
+            break
+        writes, catch_up, reads, mixed, consistent = measure(workers,
+                                                             duration)
+        print(f'{workers:>7} {writes:>10.0f} {catch_up * 1000:>8.1f}ms '
+              f'{reads:>12.0f} {mixed:>12.0f} {str(consistent):>10}')
+
+
+if __name__ == '__main__':
+    run(*(int(arg) if index == 0 else float(arg)
+          for index, arg in enumerate(sys.argv[1:3])))
@@ -0,0 +1,312 @@
+"""
+Load-testing suite of the framework. Fills the site with the generated
+data (see bench.fixtures), then requests every route of UrlPaths.URLS
+and reports the requests per second, the latency percentiles and the
+peak RSS:
+
+* in-process - the WSGI app of main.py is called directly with fake
+  WSGI environments, one request after another;
+* gunicorn - `gunicorn main:app` is spawned with the data in a temporary
+  SQLite database and loaded by concurrent connections.
+
+The results are saved as JSON (bench/results/<commit>.json by default),
+pass the file of another commit with --compare to see the difference.
+A route answering with errors (an exception or a status other than 2xx
+and 3xx) fails the run and nothing is saved, unless --allow-errors is
+given: the timings of an error page say nothing about the route.
+Run from the project root:
+
+`python -m bench.suite [--courses 2000] [--no-gunicorn] [--compare old.json]`
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+from bench.asgi_bench import free_port, load, wait_for_port
+from bench.fixtures import populate, CATEGORIES, COURSES, STUDENTS, \
+    ENROLLMENTS_PER_STUDENT
+from instrumentation import Histogram
+
+# routes left out: with path parameters, changing the data on GET
+# or reporting on the server itself
+EXCLUDED_ROUTES = ('/copy_course/', '/debug/timings/', '/metrics/')
+RESULTS_DIR = 'bench/results'
+
+
+def get_commit():
+    """
+    :return: hash of the current git commit, 'unknown' outside git
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def get_routes(urls):
+    """
+    :param urls: dict of the url patterns, UrlPaths.URLS
+    :return: list of the benchmarked paths
+    """
+    return [url for url in urls
+            if '<' not in url and url not in EXCLUDED_ROUTES]
+
+
+def peak_rss_kb():
+    """
+    :return: peak resident set size of this process in kilobytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def worker_peak_rss_kb(parent_pid):
+    """
+    Reads the peak RSS of the gunicorn workers from /proc (Linux only).
+
+    :param parent_pid: pid of the gunicorn master
+    :return: largest peak RSS of the workers in kilobytes or None
+    """
+    peaks = []
+    for pid in filter(str.isdigit, os.listdir('/proc')
+                      if os.path.isdir('/proc') else ()):
+        try:
+            with open(f'/proc/{pid}/stat') as stat:
+                if int(stat.read().rsplit(')', 1)[1].split()[1]) \
+                        != parent_pid:
+                    continue
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        peaks.append(int(line.split()[1]))
+        except (OSError, ValueError, IndexError):
+            continue
+    return max(peaks) if peaks else None
+
+
+def summarize(histogram, elapsed, errors, peak_rss):
+    """
+    :param histogram: Histogram of the latencies
+    :param elapsed: total time in seconds
+    :param errors: number of the failed requests
+    :param peak_rss: peak RSS in kilobytes
+    :return: dict with the results of the route
+    """
+    return {
+        'requests': histogram.count,
+        'rps': round(histogram.count / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(histogram.percentile(50) * 1000, 3),
+        'p95_ms': round(histogram.percentile(95) * 1000, 3),
+        'p99_ms': round(histogram.percentile(99) * 1000, 3),
+        'max_ms': round(histogram.max * 1000, 3),
+        'errors': errors,
+        'peak_rss_kb': peak_rss,
+    }
+
+
+def make_environment(path):
+    """
+    :param path: requested path
+    :return: fake WSGI environment of a GET request
+    """
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+    }
+
+
+def run_in_process(fixtures, requests):
+    """
+    Calls the WSGI app directly.
+
+    :param fixtures: sizes of the generated data, see bench.fixtures
+    :param requests: number of requests per route
+    :return: dict of the results by the routes
+    """
+    from main import app, routes, site
+
+    populate(site, **fixtures)
+    results = {}
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(status)
+
+    for path in get_routes(routes.URLS):
+        histogram = Histogram()
+        errors = 0
+        started = perf_counter()
+        for _ in range(requests):
+            statuses.clear()
+            start = perf_counter()
+            try:
+                body = app(make_environment(path), start_response)
+                for _ in body:
+                    pass
+                if hasattr(body, 'close'):
+                    body.close()
+                if not statuses or statuses[0][0] not in '23':
+                    errors += 1
+            except Exception:
+                errors += 1
+            histogram.record(perf_counter() - start)
+        results[path] = summarize(histogram, perf_counter() - started,
+                                  errors, peak_rss_kb())
+    return results
+
+
+def run_gunicorn(fixtures, concurrency, duration, workers):
+    """
+    Spawns gunicorn on a temporary SQLite database with the generated
+    data and loads it with concurrent connections.
+
+    :param fixtures: sizes of the generated data, see bench.fixtures
+    :param concurrency: number of the concurrent clients
+    :param duration: time in seconds per route
+    :param workers: number of the gunicorn workers
+    :return: dict of the results by the routes
+    """
+    from decos import UrlPaths
+    from models import OnlineUniversity
+    from storage import SqliteStorage
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite3')
+        populate(OnlineUniversity(SqliteStorage(path)), **fixtures)
+        port = free_port()
+        environment = dict(os.environ, DEBUG='0', STORAGE='sqlite',
+                           SQLITE_PATH=path)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'main:app',
+             '-b', f'127.0.0.1:{port}', '-w', str(workers),
+             '--log-level', 'warning'],
+            env=environment, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            for route in get_routes(UrlPaths.URLS):
+                histogram, errors = asyncio.run(
+                    load(port, route, concurrency, duration))
+                results[route] = summarize(histogram, duration, errors,
+                                           worker_peak_rss_kb(server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def compare(results, previous):
+    """
+    Prints the change of the throughput and the p99 latency against
+    the results of another commit.
+
+    :param results: dict with the current results
+    :param previous: dict with the previous results
+    """
+    print(f'\nCompared with {previous.get("commit")}:')
+    for mode in ('in_process', 'gunicorn'):
+        for route, item in results.get(mode, {}).items():
+            old = previous.get(mode, {}).get(route)
+            if not old or not old['rps'] or not old['p99_ms']:
+                continue
+            print(f'{mode:<11} {route:<18} '
+                  f'rps {(item["rps"] / old["rps"] - 1) * 100:>+7.1f}% '
+                  f'p99 {(item["p99_ms"] / old["p99_ms"] - 1) * 100:>+7.1f}%')
+
+
+def print_results(mode, results):
+    """
+    :param mode: name of the benchmark
+    :param results: dict of the results by the routes
+    """
+    print(f'\n{mode}')
+    print(f'{"route":<18} {"rps":>9} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"errors":>7} {"peak RSS":>10}')
+    for route, item in results.items():
+        rss = f'{item["peak_rss_kb"] / 1024:.1f}MB' \
+            if item['peak_rss_kb'] else '-'
+        print(f'{route:<18} {item["rps"]:>9.1f} {item["p50_ms"]:>8.2f} '
+              f'{item["p95_ms"]:>8.2f} {item["p99_ms"]:>8.2f} '
+              f'{item["errors"]:>7} {rss:>10}')
+
+
+def failed_routes(results):
+    """
+    :param results: results of the run
+    :return: list of the mode and the route of every route with errors
+    """
+    return [f'{mode} {route}' for mode in ('in_process', 'gunicorn')
+            for route, item in results.get(mode, {}).items()
+            if item['errors']]
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--categories', type=int, default=CATEGORIES)
+    parser.add_argument('--courses', type=int, default=COURSES)
+    parser.add_argument('--students', type=int, default=STUDENTS)
+    parser.add_argument('--enrollments', type=int,
+                        default=ENROLLMENTS_PER_STUDENT,
+                        help='courses per student')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='in-process requests per route')
+    parser.add_argument('--no-gunicorn', action='store_true')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='gunicorn load time per route in seconds')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--output', help='path of the JSON results')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    parser.add_argument('--allow-errors', action='store_true',
+                        help='save the results of the failing routes too')
+    options = parser.parse_args(arguments)
+
+    os.environ.setdefault('DEBUG', '0')
+    fixtures = {'categories': options.categories,
+                'courses': options.courses,
+                'students': options.students,
+                'enrollments_per_student': options.enrollments}
+    commit = get_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'fixtures': fixtures,
+        'in_process': run_in_process(fixtures, options.requests),
+    }
+    print_results('in-process', results['in_process'])
+    if not options.no_gunicorn:
+        results['gunicorn'] = run_gunicorn(
+            fixtures, options.concurrency, options.duration, options.workers)
+        print_results('gunicorn', results['gunicorn'])
+
+    failed = failed_routes(results)
+    if failed:
+        print(f'\nERRORS in {", ".join(failed)}: these timings are of '
+              f'the error responses!', file=sys.stderr)
+        if not options.allow_errors:
+            sys.exit('Nothing saved, fix the routes or pass --allow-errors.')
+    output = options.output or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'\nResults saved to {output}')
+    if options.compare:
+        with open(options.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
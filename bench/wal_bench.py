@@ -0,0 +1,166 @@
+"""
+Benchmark of the write-ahead log of the shared log storage: the time
+a worker takes to load the site as the log grows, replaying the whole
+log against loading the snapshot (with a tail of the log written after
+it), the time taking the snapshot holds the log locked, and the commit throughput with the fsync as the number of the
+threads committing at once grows, where the group commit shares one
+sync among the waiting threads. Run from the project root, the log is
+written next to the current directory to measure the real disk:
+
+`python -m bench.wal_bench [largest number of records] [seconds]`
+"""
+import os
+import sys
+import tempfile
+from threading import Barrier, Thread
+from time import perf_counter
+
+import storage as storage_module
+from models import OnlineUniversity
+from storage import SharedLogStorage
+
+SIZES = (1_000, 10_000, 100_000)
+TAIL = 0.1
+THREAD_COUNTS = (1, 4, 16)
+DURATION = 2.0
+
+
+def populate(site, records):
+    """
+    Writes about the given number of records: students, courses and
+    enrollments, in units of work of ten.
+
+    :param site: OnlineUniversity to write into
+    :param records: number of the records
+    """
+    courses = []
+    for index in range(records // 10):
+        with site.storage.unit_of_work():
+            if index % 10 == 0:
+                courses.append(site.add_course(site.create_course(
+                    'online', f'Course {index}', None)))
+            for number in range(4):
+                student = site.add_student(site.create_user(
+                    'student', f'Student {index}.{number}'))
+                site.enroll(courses[-1], student)
+                if len(courses) > 1:
+                    site.enroll(courses[-2], student)
+
+
+def load_time(path):
+    """
+    :param path: path to the log file
+    :return: tuple of the time of loading the site in seconds and the
+    number of students loaded
+    """
+    start = perf_counter()
+    site = OnlineUniversity(SharedLogStorage(path, fsync=False,
+                                             snapshot_size=0))
+    site.load()
+    return perf_counter() - start, len(site.students)
+
+
+def measure_recovery(directory, records):
+    """
+    :param directory: directory of the log files
+    :param records: number of the records in the log
+    :return: tuple of the size of the log in bytes, the load times
+    of the whole log, the time taking the snapshot, the load times of
+    the snapshot and of the snapshot followed by a tail of records
+    """
+    path = os.path.join(directory, f'recovery-{records}.log')
+    site = OnlineUniversity(SharedLogStorage(path, fsync=False,
+                                             snapshot_size=0))
+    site.load()
+    populate(site, records)
+    size = site.storage.committed_length()
+    replay, students = load_time(path)
+    start = perf_counter()
+    site.storage.take_snapshot(site)
+    taking = perf_counter() - start
+    snapshot, snapshot_students = load_time(path)
+    populate(site, int(records * TAIL))
+    tail, _ = load_time(path)
+    assert students == snapshot_students
+    return size, replay, taking, snapshot, tail
+
+
+def measure_commits(directory, threads, duration, fsync):
+    """
+    :param directory: directory of the log file
+    :param threads: number of the threads committing at once
+    :param duration: duration of the measurement in seconds
+    :param fsync: whether the commits are synced to disk
+    :return: tuple of the commits per second and the syncs per second
+    """
+    path = os.path.join(directory, f'commits-{threads}-{fsync}.log')
+    site = OnlineUniversity(SharedLogStorage(path, fsync=fsync,
+                                             snapshot_size=0))
+    site.load()
+    storage = site.storage
+    syncs = [0]
+    fdatasync = storage_module.fdatasync
+
+    def counted_fdatasync(file_descriptor):
+        syncs[0] += 1
+        fdatasync(file_descriptor)
+
+    storage_module.fdatasync = counted_fdatasync
+    barrier = Barrier(threads + 1)
+    counts = []
+
+    def commit():
+        count = 0
+        barrier.wait()
+        deadline = perf_counter() + duration
+        while perf_counter() < deadline:
+            with storage.unit_of_work():
+                site.add_student(site.create_user('student', 'Student'))
+            count += 1
+        counts.append(count)
+
+    workers = [Thread(target=commit) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    for worker in workers:
+        worker.join()
+    storage_module.fdatasync = fdatasync
+    return sum(counts) / duration, syncs[0] / duration
+
+
+def run(max_records=max(SIZES), duration=DURATION):
+    """
+    Prints the recovery times and the commit throughput.
+
+    :param max_records: largest number of the records in the log
+    :param duration: duration of every commit measurement in seconds
+    """
+    with tempfile.TemporaryDirectory(dir='.') as directory:
+        print(f'recovery, the tail is {TAIL:.0%} of the log')
+        print(f'{"records":>8} {"log size":>10} {"full replay":>12} '
+              f'{"taking":>10} {"snapshot":>10} {"snap + tail":>12}')
+        for records in SIZES:
+            if records > max_records:
+                break
+            size, replay, taking, snapshot, tail = measure_recovery(
+                directory, records)
+            print(f'{records:>8} {size / 1024:>8.0f}kB '
+                  f'{replay * 1000:>10.1f}ms {taking * 1000:>8.1f}ms '
+                  f'{snapshot * 1000:>8.1f}ms '
+                  f'{tail * 1000:>10.1f}ms')
+        print(f'\ncommits, {duration}s each')
+        print(f'{"threads":>7} {"no fsync/s":>11} {"fsync/s":>9} '
+              f'{"syncs/s":>9}')
+        for threads in THREAD_COUNTS:
+            unsynced, _ = measure_commits(directory, threads, duration,
+                                          False)
+            synced, syncs = measure_commits(directory, threads, duration,
+                                            True)
+            print(f'{threads:>7} {unsynced:>11.0f} {synced:>9.0f} '
+                  f'{syncs:>9.0f}')
+
+
+if __name__ == '__main__':
+    run(*(int(arg) if index == 0 else float(arg)
+          for index, arg in enumerate(sys.argv[1:3])))
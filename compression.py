@@ -0,0 +1,237 @@
+import zlib
+
+import settings
+from static import COMPRESSIBLE_TYPES, parse_accept_encoding
+
+# wbits of zlib.compressobj by the content codings: 'gzip' has the gzip
+# header, the HTTP 'deflate' is the zlib format
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+NOT_COMPRESSED_STATUSES = ('1', '204', '206', '304')
+
+
+class CompressionMiddleware:
+    """
+    WSGI middleware compressing the responses with gzip (or deflate)
+    when the client accepts it.
+
+    The responses smaller than min_size, the ones with a Content-Encoding
+    already (e.g. the precompressed static files), the ranges and the
+    types that don't compress well are sent as they are. The list bodies
+    are compressed at once and get the new Content-Length, the rest of
+    the bodies (generators, e.g. the streamed API pages) are compressed
+    chunk by chunk: the first chunks are buffered until they reach
+    min_size, every next chunk is flushed right away, so the client
+    still gets the data as it's produced. The files sent with the
+    server's wsgi.file_wrapper are left alone to keep the sendfile.
+
+    The compressible responses always get 'Vary: Accept-Encoding', the
+    strong ETag of a compressed response becomes a weak one.
+    """
+
+    def __init__(self, app, min_size=settings.COMPRESSION_MIN_SIZE,
+                 level=settings.COMPRESSION_LEVEL,
+                 deflate=settings.COMPRESSION_DEFLATE):
+        """
+        :param app: WSGI application
+        :param min_size: smaller responses are sent uncompressed
+        :param level: compression level from 1 (fastest) to 9 (smallest)
+        :param deflate: whether the deflate coding is offered as well
+        """
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.codings = ('gzip', 'deflate') if deflate else ('gzip',)
+
+    def __call__(self, environment, start_response):
+        accepted = parse_accept_encoding(
+            environment.get('HTTP_ACCEPT_ENCODING', ''))
+        coding = next((coding for coding in self.codings
+                       if coding in accepted), None)
+        response = {}
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            response.update(status=status, headers=headers,
+                            exc_info=exc_info)
+            return written.append
+
+        body = self.app(environment, capture)
+        if not response:
+            # the application may call start_response on the first
+            # iteration of the body (e.g. a generator), see PEP 3333
+            chunks = iter(body)
+            for chunk in chunks:
+                written.append(chunk)
+                break
+            if not response:
+                self.close(body)
+                raise Exception('The application returned the body '
+                                'without calling start_response')
+            if chunks is not body:
+                body = self.prepend([], chunks, body)
+        status, headers = response['status'], response['headers']
+        if not self.is_compressible(environment, status, headers, body):
+            if status.startswith('304') and self.has_compressible_type(
+                    headers):
+                # the cached copy may be the compressed one
+                headers = self.add_vary(headers)
+            start_response(status, headers, response['exc_info'])
+            return self.prepend(written, body) if written else body
+
+        headers = self.add_vary(headers)
+        if coding is None:
+            start_response(status, headers, response['exc_info'])
+            return self.prepend(written, body) if written else body
+
+        if isinstance(body, (list, tuple)):
+            chunks = None
+            buffered, exhausted = written + list(body), True
+            size = sum(len(chunk) for chunk in buffered)
+        else:
+            chunks = iter(self.prepend(written, body))
+            buffered, size, exhausted = [], 0, False
+            while size < self.min_size:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                buffered.append(chunk)
+                size += len(chunk)
+
+        if size < self.min_size:
+            start_response(status, headers, response['exc_info'])
+            if exhausted:
+                self.close(body)
+                return buffered
+            return self.prepend(buffered, chunks, body)
+
+        headers = self.compressed_headers(headers, coding)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[coding])
+        if exhausted:
+            self.close(body)
+            data = compressor.compress(b''.join(buffered)) + compressor.flush()
+            headers.append(('Content-Length', str(len(data))))
+            start_response(status, headers, response['exc_info'])
+            return [data]
+        start_response(status, headers, response['exc_info'])
+        return self.stream(compressor, buffered, chunks, body)
+
+    def is_compressible(self, environment, status, headers, body):
+        """
+        :param environment: WSGI environment of the request
+        :param status: status of the response
+        :param headers: headers of the response
+        :param body: body of the response
+        :return: whether the response may be compressed
+        """
+        if environment['REQUEST_METHOD'] == 'HEAD' or \
+                status.startswith(NOT_COMPRESSED_STATUSES):
+            return False
+        file_wrapper = environment.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            return False
+        for name, value in headers:
+            name = name.lower()
+            if name in ('content-encoding', 'content-range'):
+                return False
+            if name == 'content-length' and value.isdigit() and \
+                    int(value) < self.min_size:
+                return False
+            if name == 'cache-control' and 'no-transform' in value.lower():
+                return False
+        return self.has_compressible_type(headers)
+
+    @staticmethod
+    def has_compressible_type(headers):
+        """
+        :param headers: headers of the response
+        :return: whether the Content-Type is worth compressing
+        """
+        for name, value in headers:
+            if name.lower() == 'content-type':
+                return value.lower().startswith(COMPRESSIBLE_TYPES)
+        return False
+
+    @staticmethod
+    def add_vary(headers):
+        """
+        :param headers: headers of the response
+        :return: the headers with Accept-Encoding in the Vary header
+        """
+        result = []
+        varied = False
+        for name, value in headers:
+            if name.lower() == 'vary':
+                varied = True
+                fields = [field.strip().lower() for field in value.split(',')]
+                if 'accept-encoding' not in fields and '*' not in fields:
+                    value = f'{value}, Accept-Encoding'
+            result.append((name, value))
+        if not varied:
+            result.append(('Vary', 'Accept-Encoding'))
+        return result
+
+    @staticmethod
+    def compressed_headers(headers, coding):
+        """
+        :param headers: headers of the uncompressed response
+        :param coding: content coding of the compressed response
+        :return: headers of the compressed response without the length
+        """
+        result = []
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered in ('content-length', 'accept-ranges'):
+                continue
+            if lowered == 'etag' and not value.startswith('W/'):
+                value = f'W/{value}'
+            result.append((name, value))
+        result.append(('Content-Encoding', coding))
+        return result
+
+    def stream(self, compressor, buffered, chunks, body):
+        """
+        Compresses the body chunk by chunk.
+
+        :param compressor: zlib compression object
+        :param buffered: chunks read from the body already
+        :param chunks: iterator of the rest of the chunks
+        :param body: the original body, closed at the end
+        :return: generator of the compressed chunks
+        """
+        try:
+            data = compressor.compress(b''.join(buffered))
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield data
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            self.close(body)
+
+    def prepend(self, chunks, rest, body=None):
+        """
+        :param chunks: list of the chunks sent first
+        :param rest: iterable of the rest of the chunks
+        :param body: the original body, closed at the end
+        :return: generator of all the chunks
+        """
+        try:
+            yield from chunks
+            yield from rest
+        finally:
+            self.close(rest if body is None else body)
+
+    @staticmethod
+    def close(body):
+        """
+        Closes the body the way the WSGI server would.
+        """
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
@@ -1,19 +1,218 @@
+from asyncio import get_running_loop
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from inspect import iscoroutinefunction
+from io import BytesIO
+from threading import Lock
+
+import settings
+from exceptions import HttpError, RequestEntityTooLarge
+from instrumentation import metrics, phase, no_trace
+from parsers import parse_body, parse_query_string
+from router import Router
+from template_renderer import engine
+
+
+class RequestStats:
+    """
+    Counters of the requests handled by the App, shared by all
+    the threads of the worker. Shows how many requests got away
+    without parsing their query string and body.
+    """
+    __slots__ = ('lock', 'counters')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {
+            'requests': 0,
+            'not_found': 0,
+            'parsed_query': 0,
+            'parsed_body': 0,
+            'skipped_parsing': 0,
+        }
+
+    def increment(self, name):
+        """
+        :param name: name of the counter
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+    def record(self, request):
+        """
+        Records which parts of the handled request were parsed.
+
+        :param request: an instance of Request
+        """
+        with self.lock:
+            self.counters['requests'] += 1
+            if request.query_parsed:
+                self.counters['parsed_query'] += 1
+            if request.body_parsed:
+                self.counters['parsed_body'] += 1
+            if not (request.query_parsed or request.body_parsed):
+                self.counters['skipped_parsing'] += 1
+
+    def as_dict(self):
+        """
+        :return: copy of the counters
+        """
+        with self.lock:
+            return dict(self.counters)
+
+
+class Request(MutableMapping):
+    """
+    HTTP-request built once per WSGI call. Holds the method, the path
+    and the headers. The query string and the body of the request are
+    parsed only once they are accessed, so the views that never look
+    at them don't pay for the parsing. Every request gets its own
+    object, so the app can be served by threaded workers.
+
+    For compatibility with the views and front controllers written for
+    the plain request dict, the object also behaves as a mapping:
+    request['data'], request['req_params'] and request['method'] return
+    the corresponding attributes, any other key is stored in 'extra'.
+    """
+    __slots__ = ('environment', 'method', 'path', 'query_string',
+                 'path_params', 'extra', '_headers', '_data', '_req_params')
+
+    # mapping keys served by the attributes of the request
+    attribute_keys = ('method', 'path', 'headers', 'data', 'req_params',
+                      'path_params')
+
+    def __init__(self, environment, path=None, path_params=None):
+        """
+        :param environment: WSGI environment of the request
+        :param path: normalized path, if it has already been computed
+        :param path_params: parameters parsed from the path by the router
+        """
+        self.environment = environment
+        self.method = environment['REQUEST_METHOD']
+        self.query_string = environment.get('QUERY_STRING', '')
+        self.path = path or self.normalize_path(environment['PATH_INFO'])
+        self.path_params = path_params or {}
+        self.extra = {}
+        self._headers = None
+        self._data = None
+        self._req_params = None
+
+    @staticmethod
+    def normalize_path(path):
+        """
+        :param path: PATH_INFO of the request
+        :return: the path ending with a slash
+        """
+        if not path.endswith('/'):
+            path = f'{path}/'
+        return path
+
+    @property
+    def req_params(self):
+        """
+        Parameters from the query string, parsed on the first access.
+        """
+        if self._req_params is None:
+            with phase('parse'):
+                self._req_params = parse_query_string(self.query_string)
+        return self._req_params
+
+    @req_params.setter
+    def req_params(self, value):
+        self._req_params = value
+
+    @property
+    def query_parsed(self):
+        return self._req_params is not None
+
+    @property
+    def body_parsed(self):
+        return self._data is not None
+
+    @property
+    def headers(self):
+        """
+        Headers of the request with lowercase names, e.g. 'user-agent'.
+        """
+        if self._headers is None:
+            headers = {}
+            for key, value in self.environment.items():
+                if key.startswith('HTTP_'):
+                    headers[key[5:].replace('_', '-').lower()] = value
+            for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                if self.environment.get(key):
+                    headers[key.replace('_', '-').lower()] = \
+                        self.environment[key]
+            self._headers = headers
+        return self._headers
+
+    @property
+    def data(self):
+        """
+        Data from the body of the request, read in chunks and parsed on
+        the first access. Raises RequestEntityTooLarge if the body is
+        larger than settings.MAX_BODY_SIZE.
+        """
+        if self._data is None:
+            with phase('parse'):
+                self._data = parse_body(self.environment)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def __getitem__(self, key):
+        if key in self.attribute_keys:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.attribute_keys:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.attribute_keys:
+            raise KeyError(f'Attribute {key} of a request can not be deleted')
+        del self.extra[key]
+
+    def __iter__(self):
+        yield from self.attribute_keys
+        yield from self.extra
+
+    def __len__(self):
+        return len(self.attribute_keys) + len(self.extra)
+
+
 class App:
     """
     The core class of the framework.
-    Takes in the dict with url-patterns and the list of
+    Takes in the router (or the dict with url-patterns) and the list of
     front-controllers and then checks for what HTML-page to show
     based on the path.
     """
 
-    def __init__(self, urls, controllers):
+    def __init__(self, urls, controllers,
+                 warm_up_templates=settings.TEMPLATES_WARM_UP,
+                 record_metrics=settings.METRICS):
         """
-        :param urls: url paths
+        :param urls: url paths, either a Router or a dict
         :param fronts: front controllers
+        :param warm_up_templates: precompile all the templates right away
+        :param record_metrics: record the request metrics (see
+        instrumentation.MetricsRegistry)
         """
         self.urls = urls
+        self.router = urls if isinstance(urls, Router) \
+            else Router.from_dict(urls)
         self.front_controllers = controllers
-        self.request = {}
+        self.stats = RequestStats()
+        self.record_metrics = record_metrics
+        metrics.add_collector('requests', self.stats.as_dict)
+        if warm_up_templates:
+            engine.warm_up()
 
     def __call__(self, environment, start_response):
         """
@@ -21,69 +220,331 @@ class App:
         :param start_response:
         :return:
         """
-        request_method = environment['REQUEST_METHOD']
-        query_string = environment['QUERY_STRING']
-        path = environment['PATH_INFO']
-        if not path.endswith('/'):
-            path = f'{path}/'
-        data = self.get_wsgi_input_data(environment)
-        data = self.parse_wsgi_input_data(data)
-        request_parameters = self.parse_input_data(query_string)
-        if path in self.urls:
-            view = self.urls[path]
-            self.request['method'] = request_method
-            self.request['data'] = data
-            self.request['req_params'] = request_parameters
-            for controller in self.front_controllers:
-                controller(self.request)
-            resp, body = view(self.request)
-            start_response(resp, [('Content-Type', 'text/html')])
+        if not self.record_metrics:
+            status, headers, body = self.handle(environment)
+            start_response(status, headers)
             return body
-        else:
-            start_response('404 NOT FOUND', [('Content-Type', 'text/html')])
-            return [b'PAGE NOT FOUND']
+        trace = metrics.start_trace(environment['REQUEST_METHOD'])
+        try:
+            status, headers, body = self.handle(environment, trace)
+        except Exception:
+            metrics.finish(trace, '500')
+            raise
+        finally:
+            metrics.deactivate()
+        start_response(status, headers)
+        return metrics.wrap_body(trace, status, body)
 
+    def handle(self, environment, trace=None):
+        """
+        Routes the request to the view.
+
+        :param environment: WSGI environment of the request
+        :param trace: RequestTrace of the request, if it's traced
+        :return: tuple of the status, the headers and the body
+        """
+        path = Request.normalize_path(environment['PATH_INFO'])
+        route = self.router.resolve(path)
+        if route is None:
+            # rejected before anything of the request is read or parsed
+            self.stats.increment('not_found')
+            return '404 NOT FOUND', [('Content-Type', 'text/html')], \
+                [b'PAGE NOT FOUND']
+        handlers, path_params = route
+        if trace is not None:
+            trace.route = handlers.pattern
+        request = Request(environment, path, path_params)
+        view = self.router.get_view(handlers, request.method)
+        if view is None:
+            allowed = ', '.join(sorted(handlers))
+            return '405 METHOD NOT ALLOWED', [
+                ('Content-Type', 'text/html'), ('Allow', allowed)], \
+                [b'METHOD NOT ALLOWED']
+        try:
+            with phase('controllers'):
+                for controller in self.front_controllers:
+                    controller(request)
+            with phase('view'):
+                response = view(request)
+        except HttpError as error:
+            return error.status, [('Content-Type', 'text/html')], \
+                [error.message.encode('utf-8')]
+        finally:
+            self.stats.record(request)
+        return response[0], self.get_headers(response), response[1]
 
     @staticmethod
-    def parse_input_data(data):
+    def get_headers(response):
         """
-        Receives data from a query string.
+        Views return either (status, body) or (status, body, headers).
+        Adds the default Content-Type to the headers given by the view.
 
-        :param data: raw query string
-        :return: query data as dict
+        :param response: tuple returned by the view
+        :return: list of the response headers
         """
-        result = {}
-        if data:
-            parameters = data.split('&') # i.e. ?12+2=14&18-3=15 -> ['12+2=14', '18-3=15']
-            for item in parameters:
-                key, value = item.split('=')
-                result[key] = value
-        return result # i.e {'12+2': '14', '18-3': '15'}
+        headers = list(response[2]) if len(response) > 2 else []
+        if not any(name.lower() == 'content-type' for name, _ in headers):
+            headers.insert(0, ('Content-Type', 'text/html'))
+        return headers
+
+
+class AsyncApp(App):
+    """
+    ASGI version of the App, runs under any ASGI server, e.g.
+    `uvicorn main:asgi_app`. Uses the same router and front controllers.
 
+    The views may be coroutine functions (or objects with an async
+    __call__), they are awaited right in the event loop, so many slow
+    IO-bound requests don't need a thread each. The regular synchronous
+    views run in the thread pool together with the front controllers,
+    their bodies are iterated in the pool as well.
+    """
+
+    def __init__(self, urls, controllers,
+                 warm_up_templates=settings.TEMPLATES_WARM_UP,
+                 executor=None, context=None):
+        """
+        :param urls: url paths, either a Router or a dict
+        :param controllers: front controllers
+        :param warm_up_templates: precompile all the templates right away
+        :param executor: executor of the synchronous views, a thread
+        pool of settings.ASYNC_VIEW_THREADS threads by default
+        :param context: callable returning the context manager every
+        synchronous view runs in, e.g. the storage's unit of work
+        """
+        super().__init__(urls, controllers, warm_up_templates)
+        self.executor = executor or ThreadPoolExecutor(
+            settings.ASYNC_VIEW_THREADS, thread_name_prefix='view')
+        self.context = context
+        self.async_views = {}
+
+    def is_async(self, view):
+        """
+        :param view: view callable
+        :return: whether the view has to be awaited
+        """
+        result = self.async_views.get(id(view))
+        if result is None:
+            result = iscoroutinefunction(view) or iscoroutinefunction(
+                getattr(view, '__call__', None))
+            self.async_views[id(view)] = result
+        return result
+
+    async def __call__(self, scope, receive, send):
+        """
+        :param scope: ASGI connection scope
+        :param receive: awaitable returning the client's messages
+        :param send: awaitable sending the messages to the client
+        """
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        trace = metrics.start_trace(scope['method'], activate=False) \
+            if self.record_metrics else None
+        status = '500'
+        try:
+            status = await self.handle_http(scope, receive, send, trace)
+        finally:
+            if trace is not None:
+                metrics.finish(trace, status.split(' ', 1)[0])
+
+    async def handle_http(self, scope, receive, send, trace=None):
+        """
+        Routes the request to the view and sends the response.
+
+        :param scope: ASGI connection scope
+        :param receive: awaitable returning the client's messages
+        :param send: awaitable sending the messages to the client
+        :param trace: RequestTrace of the request, if it's traced
+        :return: status line of the response
+        """
+        path = Request.normalize_path(
+            scope['path'].encode('utf-8').decode('latin-1'))
+        route = self.router.resolve(path)
+        if route is None:
+            self.stats.increment('not_found')
+            await self.send_response(send, '404 NOT FOUND', [
+                ('Content-Type', 'text/html')], [b'PAGE NOT FOUND'])
+            return '404 NOT FOUND'
+        handlers, path_params = route
+        if trace is not None:
+            trace.route = handlers.pattern
+        view = self.router.get_view(handlers, scope['method'])
+        if view is None:
+            allowed = ', '.join(sorted(handlers))
+            await self.send_response(send, '405 METHOD NOT ALLOWED', [
+                ('Content-Type', 'text/html'), ('Allow', allowed)],
+                [b'METHOD NOT ALLOWED'])
+            return '405 METHOD NOT ALLOWED'
+        try:
+            with trace.measure('read') if trace is not None else no_trace:
+                body = await self.read_body(scope, receive)
+        except HttpError as error:
+            await self.send_response(send, error.status, [
+                ('Content-Type', 'text/html')],
+                [error.message.encode('utf-8')])
+            return error.status
+        request = Request(self.get_environment(scope, body), path,
+                          path_params)
+        loop = get_running_loop()
+        try:
+            if self.is_async(view):
+                # the event loop's thread has no active trace, the
+                # coroutines of many requests run in it at once
+                with trace.measure('controllers') if trace is not None \
+                        else no_trace:
+                    for controller in self.front_controllers:
+                        controller(request)
+                with trace.measure('view') if trace is not None \
+                        else no_trace:
+                    response = await view(request)
+            else:
+                response = await loop.run_in_executor(
+                    self.executor, self.call_view, view, request, trace)
+        except HttpError as error:
+            response = (error.status, [error.message.encode('utf-8')])
+        finally:
+            self.stats.record(request)
+        await self.send_response(send, response[0],
+                                 self.get_headers(response), response[1],
+                                 loop)
+        return response[0]
+
+    def call_view(self, view, request, trace=None):
+        """
+        Runs the front controllers and the synchronous view in the
+        thread pool.
+
+        :param view: view callable
+        :param request: an instance of Request
+        :param trace: RequestTrace of the request, active in the thread
+        while the view runs
+        :return: response of the view
+        """
+        if trace is not None:
+            metrics.activate(trace)
+        try:
+            with self.context() if self.context is not None else no_trace:
+                with phase('controllers'):
+                    for controller in self.front_controllers:
+                        controller(request)
+                with phase('view'):
+                    return view(request)
+        finally:
+            if trace is not None:
+                metrics.deactivate()
 
     @staticmethod
-    def get_wsgi_input_data(environment):
+    async def read_body(scope, receive,
+                        max_body_size=settings.MAX_BODY_SIZE):
+        """
+        Reads the whole body of the request.
+
+        :param scope: ASGI connection scope
+        :param receive: awaitable returning the client's messages
+        :param max_body_size: maximum allowed size of the body
+        :return: the body in bytes
         """
-        Retrieves the data from the wsgi.input field of a POST-request.
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() \
+                    and int(value) > max_body_size:
+                raise RequestEntityTooLarge()
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > max_body_size:
+                raise RequestEntityTooLarge()
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
 
-        :param environment: dictionary with all the data
-        :return: data encoded in bytes
+    @staticmethod
+    def get_environment(scope, body):
         """
-        query_content_length = environment.get('CONTENT_LENGTH')
-        content_length = int(query_content_length) if query_content_length else 0
-        data = environment['wsgi.input'].read(content_length) \
-            if content_length > 0 else b''
-        return data
+        Builds the WSGI-like environment the Request and the parsers
+        work with.
 
+        :param scope: ASGI connection scope
+        :param body: the body of the request in bytes
+        :return: dict with the environment
+        """
+        environment = {
+            'REQUEST_METHOD': scope['method'],
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environment[name] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                if key in environment:
+                    value = f'{environment[key]},{value}'
+                environment[key] = value
+        return environment
 
-    def parse_wsgi_input_data(self, raw_data):
+    async def send_response(self, send, status, headers, body, loop=None):
         """
-        Converts the data from a POST-request to a dictionary.
+        Sends the response. The body is either a list of chunks, an
+        async iterator or any other iterable, which is then iterated in
+        the thread pool.
 
-        :param raw_data: raw input data
-        :return: dictionary with values
+        :param send: awaitable sending the messages to the client
+        :param status: status line, e.g. '200 OK'
+        :param headers: list of the headers
+        :param body: the body of the response
+        :param loop: the running event loop
         """
-        result = {}
-        if raw_data:
-            result = self.parse_input_data(raw_data.decode('utf-8'))
-        return result
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in headers],
+        })
+        if isinstance(body, (list, tuple)):
+            for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+        elif hasattr(body, '__aiter__'):
+            async for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+        else:
+            iterator = iter(body)
+            while (chunk := await loop.run_in_executor(
+                    self.executor, next, iterator, None)) is not None:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def lifespan(self, receive, send):
+        """
+        Handles the startup and the shutdown of the ASGI server.
+
+        :param receive: awaitable returning the server's messages
+        :param send: awaitable sending the messages to the server
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
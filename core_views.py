@@ -1,16 +1,199 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic
+
+import settings
 from decos import debug
+from instrumentation import metrics
 from template_renderer import render_template
 from logs.config import Logger
 
-logger = Logger('console', 'main')
+logger = Logger('main', 'console')
+
+
+class CacheEntry:
+    """
+    Cached rendered response (or any other piece of bytes) along with
+    its ETag, expiration time and the tags it is invalidated by.
+    """
+    __slots__ = ('body', 'etag', 'expires_at', 'tags')
+
+    def __init__(self, body, expires_at, tags):
+        """
+        :param body: content in bytes
+        :param expires_at: monotonic time after which the entry is stale
+        :param tags: names of the data the content depends on
+        """
+        self.body = body
+        self.etag = f'"{blake2b(body, digest_size=16).hexdigest()}"'
+        self.expires_at = expires_at
+        self.tags = tags
+
+
+class ResponseCache:
+    """
+    In-memory cache of the rendered pages and fragments. Evicts the least
+    recently used entries once the total size exceeds the byte budget,
+    every entry also expires after its time to live. The entries are
+    tagged with the names of the data they depend on (e.g. 'courses'),
+    invalidating a tag drops all of its entries.
+    """
+
+    def __init__(self, max_bytes=settings.RESPONSE_CACHE_MAX_BYTES):
+        """
+        :param max_bytes: byte budget of the cache
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.keys_by_tag = {}
+        # incremented on every invalidation, so that a page rendered
+        # before the data changed is not stored after that
+        self.generations = {}
+        self.size = 0
+        self.lock = Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'not_modified': 0,
+                         'evictions': 0, 'invalidations': 0}
+
+    def generation(self, tags):
+        """
+        :param tags: names of the data
+        :return: current generation of the tags
+        """
+        return tuple(self.generations.get(tag, 0) for tag in tags)
+
+    def get(self, key):
+        """
+        :param key: key of the entry
+        :return: CacheEntry or None if there's no fresh entry
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at < monotonic():
+                self.discard(key)
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry
+
+    def set(self, key, body, timeout, tags=(), generation=None):
+        """
+        Stores the content in the cache, evicting the least recently
+        used entries if needed.
+
+        :param key: key of the entry
+        :param body: content in bytes
+        :param timeout: time to live in seconds
+        :param tags: names of the data the content depends on
+        :param generation: generation of the tags taken before the content
+        was rendered; if any of them was invalidated since, the content
+        is not stored
+        :return: the new CacheEntry
+        """
+        entry = CacheEntry(body, monotonic() + timeout, tuple(tags))
+        if len(body) > self.max_bytes:
+            return entry
+        with self.lock:
+            if generation is not None and \
+                    generation != self.generation(entry.tags):
+                return entry
+            self.discard(key)
+            self.entries[key] = entry
+            self.size += len(body)
+            for tag in entry.tags:
+                self.keys_by_tag.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self.discard(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+        return entry
+
+    def get_or_render(self, key, render, timeout, tags=()):
+        """
+        Returns the cached content or renders and caches it. Suitable
+        both for the whole pages and for the fragments of them.
+
+        :param key: key of the entry
+        :param render: callable returning the content in bytes
+        :param timeout: time to live in seconds
+        :param tags: names of the data the content depends on
+        :return: CacheEntry
+        """
+        entry = self.get(key)
+        if entry is None:
+            generation = self.generation(tags)
+            entry = self.set(key, render(), timeout, tags, generation)
+        return entry
+
+    def discard(self, key):
+        """
+        Drops the entry. Must be called with the lock held.
+
+        :param key: key of the entry
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry.body)
+        for tag in entry.tags:
+            keys = self.keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+
+    def invalidate(self, *tags):
+        """
+        Drops all the entries depending on the given data.
+
+        :param tags: names of the changed data
+        """
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+                for key in list(self.keys_by_tag.pop(tag, ())):
+                    self.discard(key)
+            self.counters['invalidations'] += 1
+
+    def count(self, name):
+        """
+        :param name: name of the counter to increment
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_tag.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        :return: dict with the hit/miss counters and the current size
+        """
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries),
+                        bytes=self.size)
+
+
+response_cache = ResponseCache()
+metrics.add_collector('response_cache', response_cache.stats)
 
 
 class TemplateView:
     """
     Base template view. It simply renders the template with the given name
     using the 'render_template' function from the framework's templator.
+
+    If cache_timeout is set, the rendered page is kept in the response
+    cache for that many seconds, separately for every set of query
+    parameters. cache_tags name the data the page depends on, the page
+    is dropped from the cache once any of them changes.
     """
     template_name = 'template.html'
+    cache_timeout = None
+    cache_tags = ()
 
     @debug
     def get_context_data(self):
@@ -46,7 +229,47 @@ class TemplateView:
         """
         logger.logger(f'Rendering template: {self.template_name} '
                       f'for {self.__class__.__name__}')
-        return self.render_template_with_context()
+        if self.cache_timeout is None:
+            return self.render_template_with_context()
+        return self.render_cached(request)
+
+    def get_cache_key(self, request):
+        """
+        Returns the key of the page in the response cache: the view
+        and its query parameters sorted by name.
+        :param request: HTTP request
+        """
+        params = ()
+        if request.query_string:
+            params = tuple(sorted(
+                (key, tuple(values))
+                for key, values in request['req_params'].lists.items()))
+        return self.__class__.__qualname__, params
+
+    def render_cached(self, request):
+        """
+        Serves the page from the response cache, rendering it on a miss.
+        Returns '304 Not Modified' without the body if the client already
+        has the page with the same ETag.
+        :param request: HTTP request
+        :return: status, body and headers of the response
+        """
+        def render():
+            status, body = self.render_template_with_context()
+            return b''.join(body)
+
+        entry = response_cache.get_or_render(
+            self.get_cache_key(request), render,
+            self.cache_timeout, self.cache_tags)
+        headers = [('ETag', entry.etag)]
+        if_none_match = request.headers.get('if-none-match', '')
+        if if_none_match:
+            tags = {tag.strip().removeprefix('W/')
+                    for tag in if_none_match.split(',')}
+            if entry.etag in tags or '*' in tags:
+                response_cache.count('not_modified')
+                return '304 Not Modified', [], headers
+        return '200 Ok', [entry.body], headers
 
 
 class ListView(TemplateView):
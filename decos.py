@@ -1,6 +1,11 @@
+from functools import wraps
+from inspect import iscoroutinefunction
 from time import perf_counter
 
+import settings
 from bases import NamedSingleton
+from instrumentation import timings
+from router import Router
 
 
 class UrlPaths(metaclass=NamedSingleton):
@@ -10,9 +15,12 @@ class UrlPaths(metaclass=NamedSingleton):
     link to the CBV-object in the memory serves as the value. The metaclass
     here is NamedSingleton to ensure that the object returned does indeed
     have the URLs added into it earlier. The class uses a decorator function
-    add_route to gather the URL routes.
+    add_route to gather the URL routes. All the routes are also added to
+    the compiled ROUTER, which supports path parameters and
+    method-specific views.
     """
     URLS = {}
+    ROUTER = Router()
 
     def __init__(self, name='urlpaths'):
         """
@@ -24,13 +32,23 @@ class UrlPaths(metaclass=NamedSingleton):
         """
         self.name = name
 
-    def add_route(self, url):
+    @property
+    def router(self):
+        """
+        Returns the compiled router with all the routes.
+        """
+        return self.ROUTER
+
+    def add_route(self, url, methods=None):
         """
         Decorates the callable view class to update the list of url-paths
         in the framework. The url-string becomes the key in the
-        url-paths dictionary.
+        url-paths dictionary. The url may contain typed path parameters,
+        e.g. '/course/<int:id>/', which are passed to the view in
+        request.path_params.
 
         :param url: a string with the url-address
+        :param methods: HTTP-methods handled by the view, all by default
         """
 
         def wrapped(view, *args, **kwargs):
@@ -41,29 +59,53 @@ class UrlPaths(metaclass=NamedSingleton):
             :param view: class-based view
             """
             self.URLS[url] = view(*args, **kwargs)
+            self.ROUTER.add(url, self.URLS[url], methods)
+            return view
 
         return wrapped
 
 
 def debug(func):
     """
-    Decorates the function in order to measure its runtime. If you use
-    it on a class' method, unfortunately for now it can only give you the
-    name of the method, but not the name of the class which this method
-    belongs to.
+    Decorates the function in order to measure its runtime. The timings
+    are aggregated in memory into a histogram per function (available via
+    instrumentation.timings, the /debug/timings/ page and the periodic
+    summary), the function is identified by its qualified name, e.g.
+    'TemplateView.get_context_data'.
+
+    If debugging is disabled (settings.DEBUG, the DEBUG environment
+    variable) the function is returned as is, without any wrapping.
 
     :param func: callable function or method
     """
+    if not settings.DEBUG:
+        return func
+
+    histogram = timings.get(func.__qualname__)
+
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapped_async(*args, **kwargs):
+            """
+            Decorated coroutine function, e.g. an async view.
+            """
+            start = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.record(perf_counter() - start)
+
+        return wrapped_async
+
+    @wraps(func)
     def wrapped(*args, **kwargs):
         """
         Decorated callable function. Can be anything really, not just views.
         """
         start = perf_counter()
-        res = func(*args, **kwargs)
-        finish = perf_counter()
-        print(f'DEBUG.\n'
-            f'Function: {func.__name__};\n'
-            f'Function run time: {finish - start} sec.')
-        return res
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.record(perf_counter() - start)
 
     return wrapped
@@ -0,0 +1,370 @@
+from array import array
+from heapq import nlargest
+from itertools import accumulate
+from threading import Lock
+from time import time
+
+import settings
+
+try:
+    import numpy
+except ImportError:  # the aggregates are computed in pure Python then
+    numpy = None
+
+# category of the unknown (or removed) courses and of the courses
+# without a category
+NO_COURSE = 0xFFFFFFFF
+NO_CATEGORY = 0xFFFFFFFE
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class EnrollmentIndex:
+    """
+    Compressed sparse row (CSR) index of the enrollments by one of their
+    columns: the values of the key k are values[offsets[k]:offsets[k + 1]],
+    e.g. the ids of the students of the course k.
+    """
+    __slots__ = ('offsets', 'values')
+
+    def __init__(self, offsets, values):
+        """
+        :param offsets: array of len(keys) + 1 positions in values
+        :param values: array of the values sorted by the key
+        """
+        self.offsets = offsets
+        self.values = values
+
+    def __getitem__(self, key):
+        """
+        :param key: id of the key, e.g. of the course
+        :return: list of the values of the key, empty for an unknown one
+        """
+        if not 0 <= key < len(self.offsets) - 1:
+            return []
+        return [int(value) for value in
+                self.values[self.offsets[key]:self.offsets[key + 1]]]
+
+
+class EnrollmentStore:
+    """
+    Columnar store of the enrollments for the reports, kept beside the
+    object graph of OnlineUniversity as one of its listeners. Every
+    enrollment is a row of three parallel array('I') columns: the id of
+    the student, the id of the course and the time of the enrollment
+    (the loaded enrollments get the time they were loaded, the storages
+    don't keep it). The category of every course and the numbers of
+    the enrollments of every course and of every student are columns
+    indexed by the ids, the numbers are kept up to date by every change.
+
+    The aggregates (group-by counts, top courses, histograms) are
+    computed over these columns: with NumPy installed, they are scanned
+    as NumPy arrays without copying them, otherwise in pure Python. The
+    students of a course and the courses of a student are looked up in
+    the CSR indexes, built by a counting sort on the first lookup after
+    a change. Removing a course or a student compacts the columns, O(n).
+    """
+
+    def __init__(self, use_numpy=settings.REPORTS_USE_NUMPY):
+        """
+        :param use_numpy: use NumPy if it's installed
+        """
+        self.use_numpy = use_numpy and numpy is not None
+        self.lock = Lock()
+        self.student_ids = array('I')
+        self.course_ids = array('I')
+        self.enrolled_at = array('I')
+        self.course_categories = array('I')
+        self.course_totals = array('I')
+        self.student_totals = array('I')
+        self.by_course = None
+        self.by_student = None
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def handle(self, event, obj):
+        """
+        Listener of the site's events, see OnlineUniversity.listeners.
+
+        :param event: name of the event
+        :param obj: the changed object
+        """
+        if event == 'student_enrolled':
+            course, student = obj
+            self.add(course.id, student.id)
+        elif event in ('course_created', 'course_cloned', 'course_moved'):
+            with self.lock:
+                self.set_category(obj.id, obj.category)
+            if event == 'course_created':
+                # the courses loaded from a snapshot come with students
+                for student in obj.students:
+                    self.add(obj.id, student.id)
+        elif event == 'course_removed':
+            with self.lock:
+                if obj.id < len(self.course_categories):
+                    self.course_categories[obj.id] = NO_COURSE
+            self.remove(self.course_ids, obj.id)
+        elif event == 'student_removed':
+            self.remove(self.student_ids, obj.id)
+
+    def add(self, course_id, student_id, enrolled_at=None):
+        """
+        Appends the enrollment.
+
+        :param course_id: id of the course
+        :param student_id: id of the student
+        :param enrolled_at: timestamp of the enrollment, now if omitted
+        """
+        with self.lock:
+            self.course_ids.append(course_id)
+            self.student_ids.append(student_id)
+            self.enrolled_at.append(
+                int(time() if enrolled_at is None else enrolled_at))
+            self.count(course_id, student_id, 1)
+            self.by_course = self.by_student = None
+
+    def count(self, course_id, student_id, change):
+        """
+        Changes the numbers of the enrollments of the course and of the
+        student.
+
+        :param course_id: id of the course
+        :param student_id: id of the student
+        :param change: 1 for a new enrollment, -1 for a removed one
+        """
+        for totals, key in ((self.course_totals, course_id),
+                            (self.student_totals, student_id)):
+            if key >= len(totals):
+                totals.extend(array('I', [0]) * (key + 1 - len(totals)))
+            totals[key] += change
+
+    def set_category(self, course_id, category):
+        """
+        :param course_id: id of the course
+        :param category: the course's category, None if it has none
+        """
+        categories = self.course_categories
+        if course_id >= len(categories):
+            categories.extend(
+                array('I', [NO_COURSE]) * (course_id + 1 - len(categories)))
+        categories[course_id] = NO_CATEGORY if category is None \
+            else category.id
+
+    def remove(self, column, value):
+        """
+        Removes the enrollments having the value in the column.
+
+        :param column: self.course_ids or self.student_ids
+        :param value: id of the removed course or student
+        """
+        with self.lock:
+            columns = (self.student_ids, self.course_ids, self.enrolled_at)
+            if self.use_numpy:
+                keep = self.view(column) != value
+                removed = zip(self.view(self.course_ids)[~keep].tolist(),
+                              self.view(self.student_ids)[~keep].tolist())
+                kept = [array('I', self.view(data)[keep].tobytes())
+                        for data in columns]
+                del keep
+            else:
+                position = 0 if column is self.student_ids else 1
+                rows = []
+                removed = []
+                for row in zip(*columns):
+                    if row[position] != value:
+                        rows.append(row)
+                    else:
+                        removed.append((row[1], row[0]))
+                kept = [array('I', values) for values in zip(*rows)] \
+                    if rows else [array('I'), array('I'), array('I')]
+            for course_id, student_id in removed:
+                self.count(course_id, student_id, -1)
+            self.student_ids, self.course_ids, self.enrolled_at = kept
+            self.by_course = self.by_student = None
+
+    @staticmethod
+    def view(column):
+        """
+        :param column: array('I')
+        :return: NumPy array sharing the memory of the column, has to be
+        released before the column is changed
+        """
+        return numpy.frombuffer(column, dtype=numpy.uint32) if column \
+            else numpy.zeros(0, dtype=numpy.uint32)
+
+    def size(self, column):
+        """
+        :param column: array('I') of the ids
+        :return: the largest id + 1, 0 for an empty column
+        """
+        if not column:
+            return 0
+        if self.use_numpy:
+            return int(self.view(column).max()) + 1
+        return max(column) + 1
+
+    def build_index(self, keys, values, size):
+        """
+        Sorts the values by the keys (counting sort, O(n + size)).
+
+        :param keys: array('I') of the keys, e.g. the course ids
+        :param values: array('I') of the values, e.g. the student ids
+        :param size: number of the keys, greater than the largest one
+        :return: EnrollmentIndex
+        """
+        if self.use_numpy:
+            keys, values = self.view(keys), self.view(values)
+            offsets = numpy.zeros(size + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(keys, minlength=size),
+                         out=offsets[1:])
+            return EnrollmentIndex(
+                offsets, values[numpy.argsort(keys, kind='stable')])
+        counts = [0] * (size + 1)
+        for key in keys:
+            counts[key + 1] += 1
+        offsets = array('I', accumulate(counts))
+        positions = list(offsets)
+        sorted_values = array('I', bytes(len(values) * values.itemsize))
+        for key, value in zip(keys, values):
+            sorted_values[positions[key]] = value
+            positions[key] += 1
+        return EnrollmentIndex(offsets, sorted_values)
+
+    def indexes(self):
+        """
+        :return: tuple of the indexes by the course and by the student,
+        built if the enrollments have changed since the last call
+        """
+        if self.by_course is None:
+            courses = self.size(self.course_ids)
+            students = self.size(self.student_ids)
+            self.by_course = self.build_index(
+                self.course_ids, self.student_ids,
+                max(courses, len(self.course_categories)))
+            self.by_student = self.build_index(
+                self.student_ids, self.course_ids, students)
+        return self.by_course, self.by_student
+
+    def students_of(self, course_id):
+        """
+        :param course_id: id of the course
+        :return: list of the ids of the course's students
+        """
+        with self.lock:
+            return self.indexes()[0][course_id]
+
+    def courses_of(self, student_id):
+        """
+        :param student_id: id of the student
+        :return: list of the ids of the courses the student attends
+        """
+        with self.lock:
+            return self.indexes()[1][student_id]
+
+    def course_counts(self):
+        """
+        :return: dict of the numbers of the students by the course ids,
+        the courses without students included
+        """
+        with self.lock:
+            totals = self.course_totals
+            categories = self.course_categories
+            counts = {}
+            for course_id in range(max(len(totals), len(categories))):
+                count = totals[course_id] if course_id < len(totals) else 0
+                if count or course_id < len(categories) and \
+                        categories[course_id] != NO_COURSE:
+                    counts[course_id] = count
+            return counts
+
+    def top_courses(self, limit=settings.REPORTS_TOP_COURSES):
+        """
+        :param limit: number of the courses
+        :return: list of (course id, number of students) of the courses
+        with the most students, the most popular first
+        """
+        with self.lock:
+            if self.use_numpy:
+                totals = self.view(self.course_totals)
+                limit = min(limit, len(totals))
+                if not limit:
+                    return []
+                top = numpy.argpartition(-totals.astype(numpy.int64),
+                                         limit - 1)[:limit]
+                # by the count descending, then by the id
+                top = top[numpy.lexsort((top, -totals[top].astype(
+                    numpy.int64)))]
+                return [(int(course_id), int(totals[course_id]))
+                        for course_id in top if totals[course_id]]
+            return [(course_id, count) for course_id, count in nlargest(
+                limit, enumerate(self.course_totals),
+                key=lambda item: item[1]) if count]
+
+    def category_counts(self):
+        """
+        Groups the courses and their enrollments by the category (the
+        category's own courses only, not of its subcategories).
+
+        :return: dict of (number of courses, number of enrollments) by
+        the category ids
+        """
+        with self.lock:
+            categories = self.course_categories
+            totals = self.course_totals
+            if self.use_numpy:
+                categories = self.view(categories)
+                weights = numpy.zeros(len(categories))
+                size = min(len(categories), len(totals))
+                weights[:size] = self.view(totals)[:size]
+                known = categories < NO_CATEGORY
+                courses = numpy.bincount(categories[known])
+                enrollments = numpy.bincount(
+                    categories[known], weights=weights[known],
+                    minlength=len(courses))
+                del categories
+                return {int(category_id): (int(courses[category_id]),
+                                           int(enrollments[category_id]))
+                        for category_id in numpy.flatnonzero(courses)}
+            result = {}
+            for course_id, category_id in enumerate(categories):
+                if category_id < NO_CATEGORY:
+                    courses, enrollments = result.get(category_id, (0, 0))
+                    if course_id < len(totals):
+                        enrollments += totals[course_id]
+                    result[category_id] = (courses + 1, enrollments)
+            return result
+
+    def courses_per_student(self):
+        """
+        :return: histogram of the numbers of the courses the students
+        attend: list of the numbers of the students attending 1, 2, ...
+        courses
+        """
+        with self.lock:
+            if self.use_numpy:
+                return [int(count) for count in numpy.bincount(
+                    self.view(self.student_totals))[1:]]
+            totals = self.student_totals
+            histogram = [0] * (max(totals, default=0) + 1)
+            for count in totals:
+                histogram[count] += 1
+            return histogram[1:]
+
+    def enrollments_per_period(self, period=SECONDS_PER_DAY):
+        """
+        :param period: length of the period in seconds, a day by default
+        :return: list of (start of the period, number of enrollments) of
+        the periods with enrollments, the oldest first
+        """
+        with self.lock:
+            if self.use_numpy:
+                periods, counts = numpy.unique(
+                    self.view(self.enrolled_at) // period,
+                    return_counts=True)
+                return [(int(start) * period, int(count))
+                        for start, count in zip(periods, counts)]
+            counts = {}
+            for timestamp in self.enrolled_at:
+                start = timestamp // period
+                counts[start] = counts.get(start, 0) + 1
+            return [(start * period, counts[start]) for start in sorted(counts)]
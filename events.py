@@ -0,0 +1,249 @@
+import atexit
+import os
+from collections import deque
+from queue import Queue, Empty, Full
+from threading import Thread, Lock, Condition
+from time import monotonic, sleep
+
+import settings
+from bases import Observer
+from logs.config import Logger
+
+logger = Logger('events', 'file')
+
+
+class EventDispatcher:
+    """
+    Delivers the events of the subjects to their observers in the
+    background. The subject only puts (observer, event) into a bounded
+    queue, a pool of worker threads drains the queue: every worker
+    collects up to batch_size events (waiting no longer than
+    flush_interval seconds for them) and hands each observer all of its
+    events from the batch in one deliver call.
+
+    A failed delivery is retried max_retries times, the delay before the
+    retry doubles every time starting from retry_backoff seconds. The
+    events still not delivered after that are dropped and logged.
+
+    If the queue is full, the event is either dropped (and counted) or
+    the subject blocks until there is free space, depending on
+    overflow_policy.
+    """
+
+    def __init__(self,
+                 workers=settings.EVENT_WORKERS,
+                 max_queue_size=settings.EVENT_QUEUE_SIZE,
+                 batch_size=settings.EVENT_BATCH_SIZE,
+                 flush_interval=settings.EVENT_FLUSH_INTERVAL,
+                 max_retries=settings.EVENT_MAX_RETRIES,
+                 retry_backoff=settings.EVENT_RETRY_BACKOFF,
+                 overflow_policy=settings.EVENT_OVERFLOW_POLICY):
+        """
+        :param workers: number of the worker threads
+        :param max_queue_size: maximum number of queued events
+        :param batch_size: maximum number of events delivered at once
+        :param flush_interval: maximum time in seconds a worker waits
+        to fill the batch
+        :param max_retries: number of retries of a failed delivery
+        :param retry_backoff: delay in seconds before the first retry
+        :param overflow_policy: 'drop' or 'block'
+        """
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.overflow_policy = overflow_policy
+        self.lock = Lock()
+        self.pid = None
+        self.queue = None
+        self.threads = []
+        self.published = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        atexit.register(self.close)
+
+    def start(self):
+        """
+        Starts the worker threads. Called on the first event in every
+        process, so that the dispatcher keeps working in the forked
+        workers.
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = Queue(self.max_queue_size)
+            self.threads = [
+                Thread(target=self.run, name=f'events-{number}', daemon=True)
+                for number in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+            self.pid = os.getpid()
+
+    def publish(self, observer, event):
+        """
+        Queues the event for the observer.
+
+        :param observer: an instance of Observer
+        :param event: an instance of Event
+        """
+        if self.pid != os.getpid():
+            self.start()
+        if self.overflow_policy == 'block':
+            self.queue.put((observer, event))
+        else:
+            try:
+                self.queue.put_nowait((observer, event))
+            except Full:
+                with self.lock:
+                    self.dropped += 1
+                return
+        with self.lock:
+            self.published += 1
+
+    def run(self):
+        """
+        Main loop of a worker thread.
+        """
+        queue = self.queue
+        while True:
+            item = queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            batch = [item]
+            deadline = monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - monotonic()
+                try:
+                    item = queue.get(timeout=timeout) if timeout > 0 \
+                        else queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self.deliver_batch(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    queue.task_done()
+            if stop:
+                return
+
+    def deliver_batch(self, batch):
+        """
+        Groups the batch by the observers and delivers the events.
+
+        :param batch: list of (observer, event) tuples
+        """
+        events_by_observer = {}
+        for observer, event in batch:
+            events_by_observer.setdefault(id(observer), (observer, []))[
+                1].append(event)
+        for observer, events in events_by_observer.values():
+            self.deliver(observer, events)
+
+    def deliver(self, observer, events):
+        """
+        Delivers the events to the observer, retrying with the
+        exponential backoff.
+
+        :param observer: an instance of Observer
+        :param events: list of the observer's events
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                observer.deliver(events)
+            except Exception as error:
+                if attempt == self.max_retries:
+                    with self.lock:
+                        self.failed += len(events)
+                    logger.logger(f'{__name__}.py; EventDispatcher; '
+                                  f'{len(events)} events to {observer!r} '
+                                  f'dropped after {attempt + 1} attempts: '
+                                  f'{error!r}')
+                    return
+                with self.lock:
+                    self.retried += 1
+                sleep(self.retry_backoff * 2 ** attempt)
+            else:
+                with self.lock:
+                    self.delivered += len(events)
+                return
+
+    def join(self):
+        """
+        Waits until all the queued events are handled.
+        """
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        """
+        Delivers the queued events and stops the worker threads.
+        """
+        if self.pid != os.getpid():
+            return
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.pid = None
+
+    def stats(self):
+        """
+        :return: dict with the counters of the events
+        """
+        return {
+            'published': self.published,
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+        }
+
+
+class MemorySink(Observer):
+    """
+    Observer keeping the delivered events in memory, a local stand-in
+    for the real notifiers. Records every batch it gets, so the batching
+    can be checked as well.
+    """
+
+    def __init__(self, events=(), max_events=None):
+        """
+        :param events: types of the events to subscribe to, all if empty
+        :param max_events: number of the last events kept, all if None
+        """
+        self.events = tuple(events)
+        self.received = deque(maxlen=max_events)
+        self.batches = 0
+        self.condition = Condition()
+
+    def deliver(self, events):
+        with self.condition:
+            self.received.extend(events)
+            self.batches += 1
+            self.condition.notify_all()
+
+    def wait_for(self, count, timeout=5):
+        """
+        Waits until the sink gets at least count events.
+
+        :param count: number of events
+        :param timeout: maximum waiting time in seconds
+        :return: whether the events arrived in time
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: len(self.received) >= count, timeout)
+
+
+dispatcher = EventDispatcher()
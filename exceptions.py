@@ -0,0 +1,42 @@
+class HttpError(Exception):
+    """
+    Base exception for the errors that are turned into an HTTP-response
+    by the App. Can be raised from anywhere during the handling of
+    a request: front controllers, views or request parsing.
+    """
+    status = '500 INTERNAL SERVER ERROR'
+    message = 'INTERNAL SERVER ERROR'
+
+    def __init__(self, message=None):
+        """
+        :param message: text of the response, the default one of the
+        class is used if omitted
+        """
+        if message is not None:
+            self.message = message
+        super().__init__(self.message)
+
+
+class BadRequest(HttpError):
+    """
+    The request is malformed, e.g. the multipart body has no boundary.
+    """
+    status = '400 BAD REQUEST'
+    message = 'BAD REQUEST'
+
+
+class RequestEntityTooLarge(HttpError):
+    """
+    The body of the request exceeds the configured maximum size.
+    """
+    status = '413 REQUEST ENTITY TOO LARGE'
+    message = 'REQUEST ENTITY TOO LARGE'
+
+
+class NotFound(HttpError):
+    """
+    The resource the request refers to doesn't exist, e.g. the course
+    to copy.
+    """
+    status = '404 NOT FOUND'
+    message = 'PAGE NOT FOUND'
@@ -0,0 +1,767 @@
+import atexit
+import json
+import os
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from threading import Lock, Thread, Event, local
+from time import perf_counter, time
+
+import settings
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, run a single worker there
+    fcntl = None
+
+
+class Histogram:
+    """
+    Histogram of durations with exponentially growing buckets (from one
+    microsecond, each bucket twice as wide as the previous one). Takes
+    constant memory no matter how many values are recorded, the
+    percentiles are estimated by the upper bounds of the buckets.
+    """
+    bounds = [1e-6 * 2 ** power for power in range(32)]
+
+    def __init__(self):
+        self.lock = Lock()
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        """
+        :param value: duration in seconds
+        """
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        """
+        Adds the values of another histogram to this one.
+
+        :param other: an instance of Histogram
+        """
+        with self.lock:
+            for index, count in enumerate(other.buckets):
+                self.buckets[index] += count
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+
+    def to_dict(self):
+        """
+        :return: the state of the histogram as a JSON-compatible dict
+        """
+        return {'buckets': list(self.buckets), 'count': self.count,
+                'total': self.total, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: dict returned by to_dict
+        :return: a new histogram with the state
+        """
+        histogram = cls()
+        histogram.buckets = list(data['buckets'])
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.max = data['max']
+        return histogram
+
+    def percentile(self, percent):
+        """
+        :param percent: percentile, e.g. 95
+        :return: estimated duration in seconds
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                if index == len(self.bounds):
+                    return self.max
+                return min(self.bounds[index], self.max)
+        return self.max
+
+    def summary(self):
+        """
+        :return: dict with the count, the total time and the percentiles
+        """
+        return {
+            'count': self.count,
+            'total': self.total,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class ThreadHistogram(Histogram):
+    """
+    Histogram written by one thread only, so the values are recorded
+    without taking the lock. Other threads only read it to merge it.
+    """
+
+    def record(self, value):
+        """
+        :param value: duration in seconds
+        """
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+class TimingRegistry:
+    """
+    Collection of the timing histograms by the qualified names of the
+    measured functions, e.g. 'TemplateView.get_context_data'.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = {}
+        self.reporter = None
+
+    def get(self, name):
+        """
+        :param name: qualified name of the function
+        :return: the Histogram of the function
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def summary(self):
+        """
+        :return: dict of the histograms' summaries by the function names
+        """
+        return {name: histogram.summary()
+                for name, histogram in sorted(self.histograms.items())
+                if histogram.count}
+
+    def format_summary(self):
+        """
+        :return: summary as a text table, the times in milliseconds
+        """
+        lines = [f'{"function":<50} {"count":>8} {"p50":>9} {"p95":>9} '
+                 f'{"p99":>9} {"max":>9}']
+        for name, item in self.summary().items():
+            lines.append(
+                f'{name:<50} {item["count"]:>8} '
+                + ' '.join(f'{item[key] * 1000:>9.3f}'
+                           for key in ('p50', 'p95', 'p99', 'max')))
+        return '\n'.join(lines)
+
+    def start_reporter(self, interval, output=print):
+        """
+        Starts a daemon thread printing the summary every interval
+        seconds.
+
+        :param interval: interval in seconds
+        :param output: callable taking the summary text
+        :return: threading.Event, setting it stops the reporter
+        """
+        stop = Event()
+
+        def report():
+            while not stop.wait(interval):
+                if self.histograms:
+                    output(f'DEBUG. Timings summary:\n{self.format_summary()}')
+
+        self.reporter = Thread(target=report, name='timings-reporter',
+                               daemon=True)
+        self.reporter.start()
+        return stop
+
+
+timings = TimingRegistry()
+
+
+class RequestTrace:
+    """
+    Timings of the phases of one request. The phases may be nested
+    (the template is rendered inside the view), every phase gets its
+    own time only, without the time of the phases inside it. Used as
+    a context manager: `with trace.measure('view'): ...`.
+    """
+    __slots__ = ('route', 'method', 'start', 'phases', 'stack', 'finished')
+
+    def __init__(self, method, route=None):
+        """
+        :param method: HTTP-method of the request
+        :param route: pattern of the route, set once it's resolved
+        """
+        self.method = method
+        self.route = route
+        self.start = perf_counter()
+        self.phases = {}
+        self.stack = []
+        self.finished = False
+
+    def measure(self, name):
+        """
+        :param name: name of the phase, e.g. 'view'
+        :return: the trace, measuring the phase inside the with block
+        """
+        self.stack.append([name, perf_counter(), 0.0])
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        name, start, nested = self.stack.pop()
+        elapsed = perf_counter() - start
+        self.add(name, elapsed - nested)
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def add(self, name, duration):
+        """
+        :param name: name of the phase
+        :param duration: time spent in the phase in seconds
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+
+class TracedBody:
+    """
+    Body of a response produced while the server sends it (e.g. the
+    streamed JSON), the time of producing the chunks is the serialize
+    phase. The trace is recorded once the body is exhausted or closed.
+    """
+
+    def __init__(self, body, trace, status, registry):
+        """
+        :param body: iterable body returned by the view
+        :param trace: RequestTrace of the request
+        :param status: status code of the response
+        :param registry: MetricsRegistry recording the trace
+        """
+        self.body = body
+        self.trace = trace
+        self.status = status
+        self.registry = registry
+
+    def __iter__(self):
+        iterator = iter(self.body)
+        while True:
+            start = perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                self.trace.add('serialize', perf_counter() - start)
+                self.registry.finish(self.trace, self.status)
+                return
+            self.trace.add('serialize', perf_counter() - start)
+            yield chunk
+
+    def close(self):
+        close = getattr(self.body, 'close', None)
+        if close is not None:
+            close()
+        self.registry.finish(self.trace, self.status)
+
+
+class RouteBucket:
+    """
+    Metrics of one route and HTTP-method collected by one thread:
+    the responses by the status codes, the latency histogram and the
+    histograms of the phases.
+    """
+    __slots__ = ('statuses', 'latency', 'phases')
+
+    def __init__(self, histogram=ThreadHistogram):
+        self.statuses = {}
+        self.latency = histogram()
+        self.phases = {}
+
+    def merge(self, other):
+        """
+        :param other: RouteBucket of another thread or worker
+        """
+        for status, count in dict(other.statuses).items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latency.merge(other.latency)
+        for name, histogram in dict(other.phases).items():
+            if name not in self.phases:
+                self.phases[name] = Histogram()
+            self.phases[name].merge(histogram)
+
+    def to_dict(self):
+        return {'statuses': dict(self.statuses),
+                'latency': self.latency.to_dict(),
+                'phases': {name: histogram.to_dict()
+                           for name, histogram in self.phases.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        bucket = cls(Histogram)
+        bucket.statuses = dict(data['statuses'])
+        bucket.latency = Histogram.from_dict(data['latency'])
+        bucket.phases = {name: Histogram.from_dict(histogram)
+                         for name, histogram in data['phases'].items()}
+        return bucket
+
+
+class MetricsRegistry:
+    """
+    Request metrics of the App by the route patterns: the numbers of
+    responses by the status codes, the latency histograms and the
+    histograms of the phases (reading the body, parsing, the front
+    controllers, the view, rendering the templates and serializing the
+    streamed bodies).
+
+    Every thread records into its own buckets, so recording takes no
+    locks, the buckets are merged only when the metrics are read. Every
+    worker process writes the snapshot of its metrics into its own file
+    of the metrics' directory every flush_interval seconds (and right
+    before the metrics are read), the metrics of all the workers are
+    the sum of the files of the running workers.
+
+    The file of a stopped worker is removed on the next read: if it was
+    a worker of the same server (the same parent process, e.g. a worker
+    recycled by gunicorn), its request counters are added to the
+    archive of the server first, so that they don't go down; its
+    collectors (gauges like the size of the cache) are dropped. The
+    files of another server (e.g. the previous run) are removed and
+    its archive is ignored.
+
+    Besides, any component may add a collector: a function returning
+    a dict of numbers, e.g. the counters of the response cache.
+    """
+    unmatched_route = '<unmatched>'
+    archive_name = 'archive.json'
+    lock_name = 'archive.lock'
+
+    def __init__(self, directory=settings.METRICS_DIR,
+                 flush_interval=settings.METRICS_FLUSH_INTERVAL):
+        """
+        :param directory: directory shared by the workers, an empty
+        string keeps the metrics of every worker to itself
+        :param flush_interval: interval in seconds of writing the
+        worker's snapshot
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self.collectors = {}
+        self.pid = None
+        self.local = None
+        self.thread_buckets = []
+        self.stop = None
+
+    def start(self):
+        """
+        Starts collecting in the current process: called on the first
+        request of every process, so that the forked workers start with
+        empty buckets and their own writer thread.
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.local = local()
+            self.thread_buckets = []
+            self.pid = os.getpid()
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+                # a file of this pid belongs to a stopped process
+                self.retire(os.path.join(self.directory,
+                                         f'{self.pid}.json'))
+                self.stop = Event()
+                Thread(target=self.run, name='metrics-writer',
+                       daemon=True).start()
+                atexit.register(self.write_snapshot)
+
+    def run(self):
+        """
+        Main loop of the writer thread.
+        """
+        while not self.stop.wait(self.flush_interval):
+            self.write_snapshot()
+
+    def start_trace(self, method, activate=True):
+        """
+        Starts the trace of a request.
+
+        :param method: HTTP-method of the request
+        :param activate: make it the active trace of the thread
+        :return: an instance of RequestTrace
+        """
+        if self.pid != os.getpid():
+            self.start()
+        trace = RequestTrace(method)
+        if activate:
+            self.local.trace = trace
+        return trace
+
+    def activate(self, trace):
+        """
+        Makes the trace the active one of the thread, the phases
+        measured by the thread go into it.
+
+        :param trace: an instance of RequestTrace
+        """
+        self.local.trace = trace
+
+    def deactivate(self):
+        """
+        Unsets the active trace of the thread.
+        """
+        if self.local is not None:
+            self.local.trace = None
+
+    def active_trace(self):
+        """
+        :return: the trace of the request handled by the thread or None
+        """
+        return getattr(self.local, 'trace', None)
+
+    def wrap_body(self, trace, status, body):
+        """
+        Records the trace once the body has been sent.
+
+        :param trace: RequestTrace of the request
+        :param status: status line of the response
+        :param body: body of the response
+        :return: the body to send
+        """
+        status = status.split(' ', 1)[0]
+        if isinstance(body, (list, tuple)):
+            self.finish(trace, status)
+            return body
+        return TracedBody(body, trace, status, self)
+
+    def finish(self, trace, status):
+        """
+        Records the trace into the buckets of the current thread.
+
+        :param trace: RequestTrace of the request
+        :param status: status code of the response, e.g. '200'
+        """
+        if trace.finished:
+            return
+        trace.finished = True
+        buckets = getattr(self.local, 'buckets', None)
+        if buckets is None:
+            buckets = self.local.buckets = {}
+            with self.lock:
+                self.thread_buckets.append(buckets)
+        key = (trace.route or self.unmatched_route, trace.method)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = RouteBucket()
+        bucket.statuses[status] = bucket.statuses.get(status, 0) + 1
+        bucket.latency.record(perf_counter() - trace.start)
+        for name, duration in trace.phases.items():
+            histogram = bucket.phases.get(name)
+            if histogram is None:
+                histogram = bucket.phases[name] = ThreadHistogram()
+            histogram.record(duration)
+
+    def add_collector(self, name, function):
+        """
+        Adds a function whose numbers are exported with the metrics.
+        The numbers of the collectors of the same name are summed.
+
+        :param name: name of the collector, e.g. 'response_cache'
+        :param function: callable returning a dict of numbers
+        """
+        with self.lock:
+            self.collectors.setdefault(name, []).append(function)
+
+    def snapshot(self):
+        """
+        :return: JSON-compatible dict with the metrics of this worker
+        """
+        merged = {}
+        with self.lock:
+            thread_buckets = list(self.thread_buckets)
+            collectors = {name: list(functions)
+                          for name, functions in self.collectors.items()}
+        for buckets in thread_buckets:
+            for key, bucket in list(buckets.items()):
+                if key not in merged:
+                    merged[key] = RouteBucket(Histogram)
+                merged[key].merge(bucket)
+        values = {}
+        for name, functions in collectors.items():
+            values[name] = {}
+            for function in functions:
+                for key, value in function().items():
+                    values[name][key] = values[name].get(key, 0) + value
+        return {
+            'parent': os.getppid(),
+            'routes': [dict(bucket.to_dict(), route=route, method=method)
+                       for (route, method), bucket in merged.items()],
+            'collectors': values,
+        }
+
+    def write_snapshot(self):
+        """
+        Writes the snapshot of this worker into its file, atomically.
+        """
+        if not self.directory or self.pid != os.getpid():
+            return
+        path = os.path.join(self.directory, f'{self.pid}.json')
+        try:
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+                json.dump(self.snapshot(), file)
+            os.replace(f'{path}.tmp', path)
+        except OSError as error:
+            print(f'Writing the metrics to {path} failed: {error}.')
+
+    def is_running(self, pid, path):
+        """
+        :param pid: pid of the worker which wrote the file
+        :param path: path to the worker's file
+        :return: whether the worker is still running
+        """
+        if os.name == 'nt':
+            # os.kill(pid, 0) would send CTRL_C_EVENT there, the file
+            # of a running worker is written every flush_interval
+            try:
+                return time() - os.path.getmtime(path) < \
+                    3 * self.flush_interval
+            except OSError:
+                return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # a process of another user
+            return True
+        return True
+
+    @contextmanager
+    def archive_lock(self):
+        """
+        Exclusive lock of the archive shared with the other workers.
+        """
+        file_descriptor = os.open(
+            os.path.join(self.directory, self.lock_name),
+            os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(file_descriptor)
+
+    @staticmethod
+    def read_file(path):
+        """
+        :param path: path to a JSON file of the metrics
+        :return: its content, None if it's missing or broken
+        """
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def read_archive(self):
+        """
+        :return: list of the routes archived by this server
+        """
+        archive = self.read_file(os.path.join(self.directory,
+                                              self.archive_name))
+        if archive is None or archive.get('parent') != os.getppid():
+            return []
+        return archive['routes']
+
+    def retire(self, path):
+        """
+        Removes the file of a stopped worker, adding its request
+        counters to the archive if it was a worker of this server.
+
+        :param path: path to the worker's file
+        """
+        with self.archive_lock():
+            snapshot = self.read_file(path)
+            if snapshot is None:
+                return
+            if snapshot.get('parent') == os.getppid():
+                routes = self.merge_routes(
+                    [self.read_archive(), snapshot['routes']])
+                archive = os.path.join(self.directory, self.archive_name)
+                with open(f'{archive}.tmp', 'w', encoding='utf-8') as file:
+                    json.dump({'parent': os.getppid(), 'routes': [
+                        dict(bucket.to_dict(), route=route, method=method)
+                        for (route, method), bucket in routes.items()]},
+                        file)
+                os.replace(f'{archive}.tmp', archive)
+            os.remove(path)
+
+    @staticmethod
+    def merge_routes(route_lists):
+        """
+        :param route_lists: lists of the routes of the snapshots
+        :return: dict of the merged RouteBuckets by the route and method
+        """
+        routes = {}
+        for items in route_lists:
+            for item in items:
+                key = (item['route'], item['method'])
+                if key not in routes:
+                    routes[key] = RouteBucket(Histogram)
+                routes[key].merge(RouteBucket.from_dict(item))
+        return routes
+
+    def collect(self):
+        """
+        :return: tuple of the dict of the RouteBuckets by the route and
+        method, the dict of the collectors' numbers and the number of
+        the workers, summed over all the running workers (plus the
+        archived requests of the stopped ones)
+        """
+        if self.pid != os.getpid():
+            self.start()
+        snapshots = []
+        archived = []
+        if self.directory:
+            self.write_snapshot()
+            for filename in os.listdir(self.directory):
+                name, extension = os.path.splitext(filename)
+                if extension != '.json' or not name.isdigit():
+                    continue
+                path = os.path.join(self.directory, filename)
+                if not self.is_running(int(name), path):
+                    try:
+                        self.retire(path)
+                    except OSError as error:
+                        print(f'Archiving the metrics of {path} failed: '
+                              f'{error}.')
+                    continue
+                snapshot = self.read_file(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+            with self.archive_lock():
+                archived = self.read_archive()
+        else:
+            snapshots.append(self.snapshot())
+        routes = self.merge_routes(
+            [archived] + [snapshot['routes'] for snapshot in snapshots])
+        collectors = {}
+        for snapshot in snapshots:
+            for name, values in snapshot['collectors'].items():
+                target = collectors.setdefault(name, {})
+                for key, value in values.items():
+                    target[key] = target.get(key, 0) + value
+        return routes, collectors, len(snapshots)
+
+    @staticmethod
+    def format_labels(**labels):
+        """
+        :return: labels in the Prometheus text format, e.g.
+        '{route="/",method="GET"}'
+        """
+        return '{' + ','.join(
+            f'{name}="{escape_label(value)}"'
+            for name, value in labels.items()) + '}'
+
+    def format_histogram(self, name, histogram, **labels):
+        """
+        :param name: name of the metric
+        :param histogram: an instance of Histogram
+        :return: lines of the histogram in the Prometheus text format
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket'
+                         f'{self.format_labels(**labels, le=repr(bound))} '
+                         f'{cumulative}')
+        lines.append(f'{name}_bucket{self.format_labels(**labels, le="+Inf")}'
+                     f' {histogram.count}')
+        lines.append(f'{name}_sum{self.format_labels(**labels)} '
+                     f'{histogram.total!r}')
+        lines.append(f'{name}_count{self.format_labels(**labels)} '
+                     f'{histogram.count}')
+        return lines
+
+    def format_prometheus(self):
+        """
+        :return: the metrics of all the workers in the Prometheus text
+        exposition format
+        """
+        routes, collectors, workers = self.collect()
+        items = sorted(routes.items())
+        lines = ['# HELP app_workers Number of the workers reporting '
+                 'the metrics.',
+                 '# TYPE app_workers gauge',
+                 f'app_workers {workers}',
+                 '# HELP app_http_requests_total Responses by the route, '
+                 'the method and the status code.',
+                 '# TYPE app_http_requests_total counter']
+        for (route, method), bucket in items:
+            for status, count in sorted(bucket.statuses.items()):
+                lines.append('app_http_requests_total' + self.format_labels(
+                    route=route, method=method, status=status) + f' {count}')
+        lines += ['# HELP app_http_request_duration_seconds Time from the '
+                  'start of the request to the end of the response.',
+                  '# TYPE app_http_request_duration_seconds histogram']
+        for (route, method), bucket in items:
+            lines += self.format_histogram(
+                'app_http_request_duration_seconds', bucket.latency,
+                route=route, method=method)
+        lines += ['# HELP app_http_request_phase_seconds Time spent in the '
+                  'phases of the request.',
+                  '# TYPE app_http_request_phase_seconds histogram']
+        for (route, method), bucket in items:
+            for phase, histogram in sorted(bucket.phases.items()):
+                lines += self.format_histogram(
+                    'app_http_request_phase_seconds', histogram,
+                    route=route, method=method, phase=phase)
+        for name, values in sorted(collectors.items()):
+            metric = f'app_{name}'
+            lines += [f'# HELP {metric} Counters of the {name}.',
+                      f'# TYPE {metric} untyped']
+            for key, value in sorted(values.items()):
+                lines.append(f'{metric}{self.format_labels(name=key)} '
+                             f'{value}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    """
+    :param value: value of a Prometheus label
+    :return: the value with the backslashes, quotes and newlines escaped
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+metrics = MetricsRegistry()
+
+no_trace = nullcontext()
+
+
+def phase(name):
+    """
+    Measures a phase of the request handled by the current thread, e.g.
+    `with phase('render'): ...`. Does nothing if no request is traced.
+
+    :param name: name of the phase
+    :return: context manager
+    """
+    trace = metrics.active_trace()
+    if trace is None:
+        return no_trace
+    return trace.measure(name)
@@ -1,7 +1,18 @@
+import atexit
+import os
 from datetime import datetime
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+from time import monotonic
 
+import settings
 from bases import NamedSingleton, LoggerStrategy
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows, rotation isn't locked there
+    fcntl = None
+
 
 class ConsoleLogger(LoggerStrategy):
      def __init__(self, name):
@@ -14,22 +25,211 @@ class ConsoleLogger(LoggerStrategy):
 
 
 class FileLogger(LoggerStrategy):
-    def __init__(self, filename):
+    """
+    Buffered file logger. The calling thread only puts the message into
+    a bounded in-memory queue, a background thread drains the queue and
+    writes the messages in batches into a long-lived file handle. The
+    batch is flushed once it has batch_size messages or once
+    flush_interval seconds have passed since its first message.
+
+    The file is rotated once it exceeds max_bytes or once it has been
+    open for rotate_interval seconds: 'name.log' becomes 'name.log.1'
+    and so on up to backup_count files. The rotation is guarded by a
+    file lock, so several gunicorn workers writing into the same file
+    rotate it only once and reopen the new file afterwards.
+
+    If the queue is full, the message is either dropped (the number of
+    dropped messages is written into the log later) or the caller
+    blocks until there is free space, depending on overflow_policy.
+    The queue is flushed at the interpreter's exit.
+    """
+
+    def __init__(self, filename,
+                 max_queue_size=settings.LOG_QUEUE_SIZE,
+                 batch_size=settings.LOG_BATCH_SIZE,
+                 flush_interval=settings.LOG_FLUSH_INTERVAL,
+                 max_bytes=settings.LOG_MAX_BYTES,
+                 rotate_interval=settings.LOG_ROTATE_INTERVAL,
+                 backup_count=settings.LOG_BACKUP_COUNT,
+                 overflow_policy=settings.LOG_OVERFLOW_POLICY):
+        """
+        :param filename: name of the log file without the extension
+        :param max_queue_size: maximum number of queued messages
+        :param batch_size: maximum number of messages written at once
+        :param flush_interval: maximum delay of a message in seconds
+        :param max_bytes: size of the file triggering the rotation,
+        0 disables the size-based rotation
+        :param rotate_interval: age of the file in seconds triggering
+        the rotation, 0 disables the time-based rotation
+        :param backup_count: number of the rotated files kept
+        :param overflow_policy: 'drop' or 'block'
+        """
         self.filename = filename
+        self.path = f'logs/{filename}.log'
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.file = None
+        self.opened_at = None
+        self.lock = Lock()
+        self.pid = None
+        self.queue = None
+        self.writer = None
+        atexit.register(self.close)
+
+    def start(self):
+        """
+        Starts the writer thread. Called on the first message in every
+        process, so that the logger keeps working in the forked workers.
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = Queue(self.max_queue_size)
+            self.file = None
+            self.writer = Thread(target=self.run, name=f'log-{self.filename}',
+                                 daemon=True)
+            self.writer.start()
+            self.pid = os.getpid()
 
     def write(self, text):
-        with open(f'logs/{self.filename}.log', 'a', encoding='utf-8') as file:
-            message = f'Date: {datetime.now().replace(microsecond=0)}\n' \
-                    + text + '\n'
-            file.write(message)
-            file.close()
+        message = f'Date: {datetime.now().replace(microsecond=0)}\n' \
+                  + text + '\n'
+        if self.pid != os.getpid():
+            self.start()
+        if self.overflow_policy == 'block':
+            self.queue.put(message)
+            return
+        try:
+            self.queue.put_nowait(message)
+        except Full:
+            self.dropped += 1
+
+    def run(self):
+        """
+        Main loop of the writer thread.
+        """
+        queue = self.queue
+        while True:
+            message = queue.get()
+            if message is None:
+                return
+            batch = [message]
+            deadline = monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - monotonic()
+                try:
+                    message = queue.get(timeout=timeout) if timeout > 0 \
+                        else queue.get_nowait()
+                except Empty:
+                    break
+                if message is None:
+                    stop = True
+                    break
+                batch.append(message)
+            self.write_batch(batch)
+            if stop:
+                return
+
+    def write_batch(self, batch):
+        """
+        Writes the messages into the file and flushes it.
+
+        :param batch: list of the messages
+        """
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            batch.append(f'Date: {datetime.now().replace(microsecond=0)}\n'
+                         f'{dropped} log messages were dropped, '
+                         f'the queue was full.\n')
+        data = ''.join(batch)
+        try:
+            self.open()
+            if self.should_rotate(len(data)):
+                self.rotate(len(data))
+            self.file.write(data)
+            self.file.flush()
+        except OSError as error:
+            print(f'Writing to {self.path} failed: {error}.')
+
+    def open(self):
+        """
+        Opens the file if it's not open yet or if it has been rotated
+        by another process.
+        """
+        if self.file is not None:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(
+                        self.file.fileno()).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self.file.close()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.opened_at = monotonic()
+
+    def should_rotate(self, size):
+        """
+        :param size: size of the data about to be written
+        :return: whether the file has to be rotated first
+        """
+        position = self.file.tell()
+        if self.max_bytes and position and position + size > self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and \
+            monotonic() - self.opened_at >= self.rotate_interval
+
+    def rotate(self, size):
+        """
+        Renames the current file to 'name.log.1' (shifting the older
+        backups) and opens a new one.
+
+        :param size: size of the data about to be written
+        """
+        with open(f'{self.path}.lock', 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # another worker could have rotated the file already
+            self.open()
+            if self.should_rotate(size):
+                self.file.close()
+                for number in range(self.backup_count - 1, 0, -1):
+                    if os.path.exists(f'{self.path}.{number}'):
+                        os.replace(f'{self.path}.{number}',
+                                   f'{self.path}.{number + 1}')
+                if self.backup_count:
+                    os.replace(self.path, f'{self.path}.1')
+                else:
+                    os.remove(self.path)
+                self.file = None
+                self.open()
+
+    def close(self):
+        """
+        Flushes all the queued messages and stops the writer thread.
+        Called automatically at the interpreter's exit, e.g. when
+        a gunicorn worker shuts down.
+        """
+        if self.pid != os.getpid() or not self.writer.is_alive():
+            return
+        self.queue.put(None)
+        self.writer.join(timeout=5)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
 
 
 class Logger(metaclass=NamedSingleton):
     """
     The main config class for a simple logger.
     """
-    
+
     strategies = {
          'console': ConsoleLogger,
          'file': FileLogger
@@ -47,7 +247,7 @@ class Logger(metaclass=NamedSingleton):
     def logger(self, message):
         """
         Main logging class.
-        Opens the log file and appends the message there.
+        Passes the message to the logging strategy.
 
         :param message: logging message
         """
@@ -1,7 +1,12 @@
-from core import App
+import settings
+from core import App, AsyncApp
 from views import *
 from front_controllers import front_controller
 from decos import UrlPaths
+from instrumentation import timings
+from storage import UnitOfWorkMiddleware, request_unit_of_work
+from static import StaticFiles
+from compression import CompressionMiddleware
 
 
 # routes = {
@@ -21,4 +26,12 @@ controllers = [
     front_controller
 ]
 
-app = App(routes.URLS, controllers)
+app = CompressionMiddleware(StaticFiles(
+    UnitOfWorkMiddleware(App(routes.router, controllers), site)))
+
+# the same routes served by an ASGI server, e.g. `uvicorn main:asgi_app`
+asgi_app = AsyncApp(routes.router, controllers,
+                    context=lambda: request_unit_of_work(site))
+
+if settings.DEBUG and settings.DEBUG_REPORT_INTERVAL > 0:
+    timings.start_reporter(settings.DEBUG_REPORT_INTERVAL)
@@ -1,11 +1,40 @@
-from bases import User, Factory, PrototypeMixin, Subject, Observer
+from bases import User, Factory, PrototypeMixin, Subject, Observer, Event
+from repository import Repository, Roster
+from serializers import serializable, IntegerField, StringField, \
+    ReferenceField, ReferenceListField
+from storage import InMemoryStorage
 
 
+@serializable
 class CourseCategory:
     """
     Class representing the categories of the courses in the ORM.
+
+    The category keeps the aggregates of its courses up to date, so
+    that reading them costs O(1): the number of its own courses, the
+    number of courses in the whole subtree (the category and all of its
+    subcategories) and the number of students enrolled on the courses
+    of the subtree (a student attending two courses counts twice).
+    A change of a course updates the category and its ancestors.
+
+    The categories without courses share one empty tuple of courses,
+    the category gets a list of its own with the first course.
     """
+    __slots__ = ('id', 'name', 'category', 'existing_courses',
+                 'course_count', 'subtree_course_count', 'student_count')
     auto_id = 0
+    serializer_kind = 'category'
+    serializer_fields = {
+        'id': IntegerField(),
+        'name': StringField(),
+        'category': ReferenceField('category'),
+    }
+    serializer_defaults = {
+        'existing_courses': tuple,
+        'course_count': int,
+        'subtree_course_count': int,
+        'student_count': int,
+    }
 
     def __init__(self, name, category):
         """
@@ -17,17 +46,111 @@ class CourseCategory:
         CourseCategory.auto_id += 1
         self.name = name
         self.category = category
-        self.existing_courses = []
+        self.existing_courses = ()
+        self.course_count = 0
+        self.subtree_course_count = 0
+        self.student_count = 0
 
     def count_courses(self):
         """
-        Counts the number of existing courses and returns the value.
+        Returns the number of courses of the category, including the
+        courses of all its subcategories.
         :return: the number of existing courses.
         """
-        res = len(self.existing_courses)
-        if self.category:
-            res += self.category.count_courses()
-        return res
+        return self.subtree_course_count
+
+    def update_counts(self, courses=0, students=0):
+        """
+        Changes the aggregates of the category and of all its ancestors.
+        The parent chain is walked iteratively, so the depth of the tree
+        isn't limited by the recursion limit.
+        :param courses: change of the number of the category's courses
+        :param students: change of the number of enrolled students
+        """
+        self.course_count += courses
+        category = self
+        while category is not None:
+            category.subtree_course_count += courses
+            category.student_count += students
+            category = category.category
+
+    def attach_course(self, course):
+        """
+        Adds the course with its students to the category.
+        :param course: an instance of one of Course subclasses
+        """
+        if not self.existing_courses:
+            self.existing_courses = []
+        self.existing_courses.append(course)
+        self.update_counts(1, len(course.students))
+
+    def detach_course(self, course):
+        """
+        Removes the course with its students from the category.
+        :param course: an instance of one of Course subclasses
+        """
+        if course in self.existing_courses:
+            self.existing_courses.remove(course)
+            self.update_counts(-1, -len(course.students))
+
+
+class EnrollmentRegistry:
+    """
+    Bidirectional many-to-many index of the enrollments. Every course
+    keeps the Roster of its students and every student the Roster of
+    the courses they attend, the registry changes both sides (and the
+    aggregates of the course's category) at once, so they never drift
+    apart. Nobody is notified here, see Course.add_student for that.
+    """
+
+    @staticmethod
+    def is_enrolled(course, student):
+        """
+        :param course: an instance of one of Course subclasses
+        :param student: an instance of Student
+        :return: whether the student attends the course, O(1)
+        """
+        return student in course.students
+
+    @staticmethod
+    def enroll(course, student):
+        """
+        :param course: an instance of one of Course subclasses
+        :param student: an instance of Student
+        :return: whether the student was enrolled, False if they
+        already attend the course
+        """
+        if not course.students.add(student):
+            return False
+        student.courses_in_attendance.add(course)
+        if course.category is not None:
+            course.category.update_counts(students=1)
+        return True
+
+    @classmethod
+    def enroll_many(cls, course, students):
+        """
+        :param course: an instance of one of Course subclasses
+        :param students: iterable of Student instances
+        :return: list of the students enrolled, without the ones who
+        already attended the course
+        """
+        return [student for student in students
+                if cls.enroll(course, student)]
+
+    @staticmethod
+    def unenroll(course, student):
+        """
+        :param course: an instance of one of Course subclasses
+        :param student: an instance of Student
+        :return: whether the student was removed from the course
+        """
+        if not course.students.discard(student):
+            return False
+        student.courses_in_attendance.discard(course)
+        if course.category is not None:
+            course.category.update_counts(students=-1)
+        return True
 
 
 class Course(PrototypeMixin, Subject):
@@ -35,47 +158,162 @@ class Course(PrototypeMixin, Subject):
     Main abstract class for courses, inherits from the Prototype Mixin
     which allows for cloning of existing courses.
     """
+    __slots__ = ('id', 'name', 'category', 'students')
+    auto_id = 0
+    serializer_kind = 'course'
+    serializer_fields = {
+        'id': IntegerField(),
+        'name': StringField(),
+        'category': ReferenceField('category'),
+        'students': ReferenceListField('student', Roster),
+    }
+    serializer_defaults = {'observers': tuple}
+    # the clone shares the category and the (immutable) tuple of the
+    # observers and starts with no students
+    clone_reset = {'students': Roster}
 
     def __init__(self, course_name, course_category):
         """
         Initializes the Course object and appends it to the list of
-        existing courses.
+        existing courses, increases the auto_id by 1.
         :param course_name:
         :param course_category:
         """
+        self.id = Course.auto_id
+        Course.auto_id += 1
         self.name = course_name
         self.category = course_category
-        self.category.existing_courses.append(self)
-        self.students = []
+        self.students = Roster()
+        if self.category is not None:
+            self.category.attach_course(self)
         super().__init__()
 
     def __getitem__(self, item):
         """
         Redefines the built-in magic method - allows for the following
         call: Course[Student], which would return a student enlisted
-        in the course.
+        in the course (O(1), KeyError if they don't attend it).
+        Course[0] returns the student by the position.
 
-        :param item: student in question
+        :param item: student in question or a position
         :return: a Student object
         """
-        return self.students[item]
+        if isinstance(item, int):
+            return self.students[item]
+        if item not in self.students:
+            raise KeyError(item)
+        return item
+
+    def clone(self):
+        """
+        Clones the course and gives the copy an id of its own. The copy
+        is added to the courses of the same category.
+        :return: a copy of the course
+        """
+        new_course = super().clone()
+        new_course.id = Course.auto_id
+        Course.auto_id += 1
+        if new_course.category is not None:
+            new_course.category.attach_course(new_course)
+        return new_course
+
+    def move_to(self, category):
+        """
+        Moves the course with its students to another category.
+        :param category: the new category, an instance of CourseCategory
+        """
+        if self.category is not None:
+            self.category.detach_course(self)
+        self.category = category
+        if category is not None:
+            category.attach_course(self)
+
+    def restore_links(self, loaded):
+        """
+        Called after the deserialization, adds the course back to its
+        category and to the courses of its students.
+
+        :param loaded: set of id() of the objects loaded together,
+        only these are updated
+        """
+        if self.category is not None and id(self.category) in loaded:
+            self.category.attach_course(self)
+        for student in self.students:
+            if id(student) in loaded:
+                student.courses_in_attendance.add(self)
 
     def add_student(self, student):
         """
-        Handles the addition of a new student to the course on the course's
-        side.
+        Enrolls the student on the course and notifies the observers.
+        Does nothing if the student already attends the course.
+
+        :param student: an instance of Student
+        :return: whether the student was enrolled
+        """
+        if not EnrollmentRegistry.enroll(self, student):
+            return False
+        self.notify(StudentEnrolled(self, student))
+        return True
 
-        :param student:
+    def add_students(self, students):
         """
-        self.students.append(student)
-        student.courses_in_attendance.append(self)
-        self.notify()
+        Enrolls all the students at once, the observers get one
+        notification about all of them.
 
+        :param students: iterable of Student instances
+        :return: list of the students enrolled, without the ones who
+        already attended the course
+        """
+        enrolled = EnrollmentRegistry.enroll_many(self, students)
+        if enrolled:
+            self.notify(StudentsEnrolled(self, enrolled))
+        return enrolled
+
+    def remove_student(self, student):
+        """
+        :param student: an instance of Student
+        :return: whether the student was removed from the course
+        """
+        return EnrollmentRegistry.unenroll(self, student)
+
+
+class StudentsEnrolled(Event):
+    """
+    Event of several students joining the course at once.
+    """
+
+    def __init__(self, course, students):
+        """
+        :param course: the course, emitter of the event
+        :param students: list of the new students of the course
+        """
+        super().__init__(course)
+        self.course = course
+        self.students = students
+
+
+class StudentEnrolled(StudentsEnrolled):
+    """
+    Event of a student joining the course.
+    """
 
+    def __init__(self, course, student):
+        """
+        :param course: the course, emitter of the event
+        :param student: the new student of the course
+        """
+        super().__init__(course, [student])
+        self.student = student
+
+
+@serializable
 class OnlineCourse(Course):
     """
     Class representing the online (pre-recorded) courses in the ORM.
     """
+    __slots__ = ('number_of_lessons',)
+    type_ = 'online'
+    serializer_fields = {'number_of_lessons': IntegerField()}
 
     def __init__(self, course_name, course_category):
         """
@@ -88,10 +326,14 @@ class OnlineCourse(Course):
         self.number_of_lessons = 0
 
 
+@serializable
 class OfflineCourse(Course):
     """
     Class representing the offline courses in the ORM.
     """
+    __slots__ = ('address',)
+    type_ = 'offline'
+    serializer_fields = {'address': StringField()}
 
     def __init__(self, course_name, course_category):
         """
@@ -104,10 +346,13 @@ class OfflineCourse(Course):
         self.address = None
 
 
+@serializable
 class WebinarCourse(Course):
     """
     Class representing the webinars in the ORM.
     """
+    __slots__ = ()
+    type_ = 'webinar'
 
     def __init__(self, course_name, course_category):
         """
@@ -148,21 +393,34 @@ class Teacher(User):
     """
     Class representing teachers in the ORM.
     """
+    __slots__ = ()
 
 
+@serializable
 class Student(User):
     """
     Class representing students in the ORM.
     """
+    __slots__ = ('id', 'courses_in_attendance')
+    auto_id = 0
+    serializer_kind = 'student'
+    serializer_fields = {
+        'id': IntegerField(),
+        'name': StringField(),
+    }
+    serializer_defaults = {'courses_in_attendance': Roster}
 
     def __init__(self, name):
         """
         Initializes the instance of Student class and creates
-        the list with courses this student is attending
+        the list with courses this student is attending,
+        increases the auto_id by 1.
         :param name: student's name
         """
         super().__init__(name)
-        self.courses_in_attendance = []
+        self.id = Student.auto_id
+        Student.auto_id += 1
+        self.courses_in_attendance = Roster()
 
     def attend_course(self, course):
         """
@@ -171,10 +429,7 @@ class Student(User):
         an error message.
         :param course: the course to be enlisted on
         """
-        already_attending_flag = self.courses_in_attendance.count(course)
-        if not already_attending_flag:
-            self.courses_in_attendance.append(course)
-        else:
+        if not EnrollmentRegistry.enroll(course, self):
             print('You are already attending this course.')
 
     def leave_course(self, course: Course):
@@ -183,9 +438,7 @@ class Student(User):
         For now it's as simple as this.
         :param course: the course the student wishes to leave
         """
-        try:
-            self.courses_in_attendance.remove(course)
-        except ValueError:
+        if not EnrollmentRegistry.unenroll(course, self):
             print('You are not attending this course!')
 
 
@@ -216,16 +469,17 @@ class TextMessageNotifier(Observer):
      enlists in a course, and sends text messages regarding that. Not really
      sends though, it's a spoof.
      """
+     events = (StudentsEnrolled,)
 
-     def update(self, subject):
+     def deliver(self, events):
          """
-         Sends text messages once the signal from the Subject-subclass
-         object is emitted.
+         Sends one text message about the batch of the enrollments.
 
-         :param subject: course that emitted the signal
+         :param events: list of StudentsEnrolled events
          """
-         print(f'Text message sent!'
-               f'"Student {subject.students[-1]} joined {subject.name} course"')
+         print('Text message sent!\n' + '\n'.join(
+             f'"Student {student.name} joined {event.course.name} course"'
+             for event in events for student in event.students))
 
 
 class EmailNotifier(Observer):
@@ -234,33 +488,71 @@ class EmailNotifier(Observer):
     enlists in a course, and sends emails regarding that. Not really sends
     though, it's a spoof.
     """
+    events = (StudentsEnrolled,)
 
-    def update(self, subject):
+    def deliver(self, events):
         """
-        Sends emails once the signal from the Subject-subclass object
-        is emitted.
+        Sends one email about the batch of the enrollments.
 
-        :param subject: course that emitted the signal
+        :param events: list of StudentsEnrolled events
         """
-        print(f'Email sent!'
-            f'"Student {subject.students[-1]} joined {subject.name} course"')
+        print('Email sent!\n' + '\n'.join(
+            f'"Student {student.name} joined {event.course.name} course"'
+            for event in events for student in event.students))
 
 
 class OnlineUniversity:
     """
     The main class of the online university, built with this simple
-    WSGI framework.
+    WSGI framework. Categories, courses and students are kept in
+    indexed repositories, the lists of them (e.g. self.courses) stay
+    available for the views' querysets.
+
+    Every change of the data is reported to the listeners, callables
+    taking the name of the event (e.g. 'course_created') and the changed
+    object. The storage backend is one of the listeners: it persists the
+    changes and gives the new objects their ids.
     """
 
-    def __init__(self):
+    def __init__(self, storage=None):
         """
         Initializes the main class.
         Creates the necessary data structures.
+        :param storage: storage backend, InMemoryStorage by default
         """
         self.teachers = []
-        self.students = []
-        self.course_categories = []
-        self.courses = []
+        self.category_repository = Repository()
+        self.course_repository = Repository()
+        self.student_repository = Repository()
+        self.students = self.student_repository.objects
+        self.course_categories = self.category_repository.objects
+        self.courses = self.course_repository.objects
+        # secondary index: category id -> courses, the courses of the
+        # students are kept by the students themselves
+        self.category_courses = {}
+        self.storage = storage or InMemoryStorage()
+        self.listeners = [self.storage.handle]
+
+    def emit(self, event, obj):
+        """
+        Reports the change of the data to all the listeners.
+        :param event: name of the event, e.g. 'course_created'
+        :param obj: the changed object
+        """
+        for listener in self.listeners:
+            listener(event, obj)
+
+    def load(self):
+        """
+        Loads all the data from the storage.
+        """
+        self.storage.load(self)
+
+    def refresh(self):
+        """
+        Applies the changes made by other processes to the storage.
+        """
+        self.storage.refresh(self)
 
     @staticmethod
     def create_user(type_, name):
@@ -272,6 +564,35 @@ class OnlineUniversity:
         """
         return UserFactory.create(type_, name)
 
+    def add_student(self, student):
+        """
+        Registers a new student in the university.
+        :param student: an instance of Student
+        :return: the student
+        """
+        student.id = self.storage.next_id('student', student.id)
+        self.index_student(student)
+        self.emit('student_created', student)
+        return student
+
+    def index_student(self, student):
+        """
+        Stores the student.
+        :param student: an instance of Student
+        """
+        self.student_repository.add(student)
+
+    def remove_student(self, student):
+        """
+        Removes the student from the university and from all
+        the courses they attend.
+        :param student: an instance of Student
+        """
+        for course in list(student.courses_in_attendance):
+            EnrollmentRegistry.unenroll(course, student)
+        self.student_repository.remove(student)
+        self.emit('student_removed', student)
+
     @staticmethod
     def create_category(name, category):
         """
@@ -283,6 +604,35 @@ class OnlineUniversity:
         """
         return CourseCategory(name, category)
 
+    def add_category(self, category):
+        """
+        Registers a new course category in the university.
+        :param category: an instance of CourseCategory
+        :return: the category
+        """
+        category.id = self.storage.next_id('category', category.id)
+        self.index_category(category)
+        self.emit('category_created', category)
+        return category
+
+    def index_category(self, category):
+        """
+        Stores the category.
+        :param category: an instance of CourseCategory
+        """
+        self.category_courses.setdefault(category.id, [])
+        self.category_repository.add(category)
+
+    def remove_category(self, category):
+        """
+        Removes the course category from the university. The courses
+        of the category are kept.
+        :param category: an instance of CourseCategory
+        """
+        self.category_courses.pop(category.id, None)
+        self.category_repository.remove(category)
+        self.emit('category_removed', category)
+
     def find_category(self, cat_id):
         """
         Looks for an existing category by its ID.
@@ -290,10 +640,10 @@ class OnlineUniversity:
         :param cat_id: category ID
         :return: an instance of CourseCategory class
         """
-        for item in self.course_categories:
-            if item.id == cat_id:
-                return item
-        raise Exception(f"There's no category with id {cat_id}")
+        category = self.category_repository.get(cat_id)
+        if category is None:
+            raise Exception(f"There's no category with id {cat_id}")
+        return category
 
     @staticmethod
     def create_course(type_, name, category):
@@ -307,6 +657,119 @@ class OnlineUniversity:
         """
         return CourseFactory.create(type_, name, category)
 
+    def add_course(self, course):
+        """
+        Registers a new course in the university.
+        :param course: an instance of one of Course subclasses
+        :return: the course
+        """
+        course.id = self.storage.next_id('course', course.id)
+        self.index_course(course)
+        self.emit('course_created', course)
+        return course
+
+    def index_course(self, course):
+        """
+        Stores the course and indexes it by its category.
+        :param course: an instance of one of Course subclasses
+        """
+        self.course_repository.add(course)
+        if course.category is not None:
+            self.category_courses.setdefault(
+                course.category.id, []).append(course)
+
+    def clone_course(self, course, new_name):
+        """
+        Clones the course and registers the copy under the new name.
+        :param course: the course to copy
+        :param new_name: name of the copy
+        :return: the copy of the course
+        """
+        new_course = course.clone()
+        new_course.name = new_name
+        new_course.id = self.storage.next_id('course', new_course.id)
+        self.index_course(new_course)
+        self.emit('course_cloned', new_course)
+        return new_course
+
+    def move_course(self, course, category):
+        """
+        Moves the course to another category and updates the indexes
+        and the aggregates of both categories.
+        :param course: an instance of one of Course subclasses
+        :param category: the new category
+        """
+        if course.category is not None:
+            category_courses = self.category_courses.get(course.category.id)
+            if category_courses and course in category_courses:
+                category_courses.remove(course)
+        course.move_to(category)
+        if category is not None:
+            self.category_courses.setdefault(category.id, []).append(course)
+        self.emit('course_moved', course)
+
+    def recompute_category_counts(self, fix=False):
+        """
+        Recomputes the aggregates of all the categories from scratch
+        and compares them with the maintained ones, a consistency check.
+        :param fix: whether to replace the wrong values
+        :return: dict of the mismatches by the categories' ids, every
+        one is a dict of the attribute name to (maintained, computed)
+        """
+        # depth of every category, the ancestors outside the site included
+        depths = {}
+        nodes = {}
+        for category in self.course_categories:
+            chain = []
+            node = category
+            while node is not None and id(node) not in depths:
+                chain.append(node)
+                node = node.category
+            depth = depths[id(node)] if node is not None else -1
+            for node in reversed(chain):
+                depth += 1
+                depths[id(node)] = depth
+                nodes[id(node)] = node
+        # the deepest categories first, every one adds its totals
+        # to the parent
+        computed = {}
+        for key in sorted(nodes, key=depths.get, reverse=True):
+            node = nodes[key]
+            counts = computed.setdefault(key, [0, 0, 0])
+            counts[0] = len(node.existing_courses)
+            counts[1] += counts[0]
+            counts[2] += sum(len(course.students)
+                             for course in node.existing_courses)
+            if node.category is not None:
+                parent = computed.setdefault(id(node.category), [0, 0, 0])
+                parent[1] += counts[1]
+                parent[2] += counts[2]
+        attributes = ('course_count', 'subtree_course_count', 'student_count')
+        mismatches = {}
+        for category in self.course_categories:
+            for attribute, value in zip(attributes, computed[id(category)]):
+                if getattr(category, attribute) != value:
+                    mismatches.setdefault(category.id, {})[attribute] = (
+                        getattr(category, attribute), value)
+                    if fix:
+                        setattr(category, attribute, value)
+        return mismatches
+
+    def remove_course(self, course):
+        """
+        Removes the course from the university and from all the indexes.
+        :param course: an instance of one of Course subclasses
+        """
+        for student in list(course.students):
+            EnrollmentRegistry.unenroll(course, student)
+        if course.category is not None:
+            category_courses = self.category_courses.get(course.category.id)
+            if category_courses and course in category_courses:
+                category_courses.remove(course)
+            course.category.detach_course(course)
+        self.course_repository.remove(course)
+        self.emit('course_removed', course)
+
     def get_course(self, name):
         """
         Tries to fetch a course by name. If nothing has been found
@@ -314,20 +777,79 @@ class OnlineUniversity:
         :param name: name of the course in string format
         :return: either an instance of one of Course subclasses or None
         """
-        for item in self.courses:
-            if item.name == name:
-                return item
-        return None
+        return self.course_repository.get_by_name(name)
+
+    def get_course_by_id(self, course_id):
+        """
+        Tries to fetch a course by its id.
+        :param course_id: id of the course
+        :return: either an instance of one of Course subclasses or None
+        """
+        return self.course_repository.get(course_id)
 
     def get_student(self, name):
-         """
-         Tries to fetch a student by name. If nothing has been found
-         returns None instead.
+        """
+        Tries to fetch a student by name. If nothing has been found
+        returns None instead.
 
-         :param name: name of the student in string format
-         :return: either an instance of Student or None
-         """
-         for student in self.students:
-             if student.name == name:
-                 return student
-         return None
+        :param name: name of the student in string format
+        :return: either an instance of Student or None
+        """
+        return self.student_repository.get_by_name(name)
+
+    def get_student_by_id(self, student_id):
+        """
+        Tries to fetch a student by their id.
+        :param student_id: id of the student
+        :return: either an instance of Student or None
+        """
+        return self.student_repository.get(student_id)
+
+    def enroll(self, course, student):
+        """
+        Enlists the student in the course, unless they already attend it.
+        :param course: an instance of one of Course subclasses
+        :param student: an instance of Student
+        :return: whether the student was enrolled
+        """
+        if not course.add_student(student):
+            return False
+        self.emit('student_enrolled', (course, student))
+        return True
+
+    def enroll_many(self, course, students):
+        """
+        Enlists all the students in the course at once, the course's
+        observers get one notification about all of them.
+        :param course: an instance of one of Course subclasses
+        :param students: iterable of Student instances
+        :return: list of the students enrolled, without the ones who
+        already attended the course
+        """
+        enrolled = course.add_students(students)
+        for student in enrolled:
+            self.emit('student_enrolled', (course, student))
+        return enrolled
+
+    def index_enrollment(self, course, student):
+        """
+        Enlists the student in the course without notifying the course's
+        observers, used when the enrollment is loaded from the storage.
+        :param course: an instance of one of Course subclasses
+        :param student: an instance of Student
+        """
+        EnrollmentRegistry.enroll(course, student)
+
+    def courses_of_category(self, category):
+        """
+        :param category: an instance of CourseCategory
+        :return: list of courses created directly under the category
+        """
+        return self.category_courses.get(category.id, [])
+
+    def courses_of_student(self, student):
+        """
+        :param student: an instance of Student
+        :return: Roster of the courses the student attends
+        """
+        return student.courses_in_attendance
@@ -0,0 +1,340 @@
+from email.message import Message
+from email.utils import collapse_rfc2231_value
+from tempfile import SpooledTemporaryFile
+from urllib.parse import unquote_plus
+
+import settings
+from exceptions import BadRequest, RequestEntityTooLarge
+from instrumentation import phase
+
+
+class MultiDict(dict):
+    """
+    Dictionary of the form data which keeps all the values of the
+    repeated keys. Plain item access returns the last value of the key
+    (the way the framework always treated repeated keys), getlist
+    returns all of them.
+    """
+
+    def __init__(self, pairs=()):
+        """
+        :param pairs: iterable of (key, value) tuples
+        """
+        super().__init__()
+        self.lists = {}
+        for key, value in pairs:
+            self.add(key, value)
+
+    def add(self, key, value):
+        """
+        Adds one more value for the key.
+
+        :param key: name of the field
+        :param value: value of the field
+        """
+        self.lists.setdefault(key, []).append(value)
+        self[key] = value
+
+    def getlist(self, key):
+        """
+        :param key: name of the field
+        :return: list of all the values of the key
+        """
+        return list(self.lists.get(key, ()))
+
+
+class UploadedFile:
+    """
+    File from a multipart/form-data request. Small files are kept in
+    memory, the larger ones are spilled to a temporary file on disk.
+    """
+
+    def __init__(self, filename, content_type, max_memory_size):
+        """
+        :param filename: name of the file sent by the client
+        :param content_type: content type of the part
+        :param max_memory_size: size after which the file goes to disk
+        """
+        self.filename = filename
+        self.content_type = content_type
+        self.file = SpooledTemporaryFile(max_size=max_memory_size)
+        self.size = 0
+
+    def write(self, chunk):
+        """
+        :param chunk: next chunk of the file's content
+        """
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def read(self):
+        """
+        :return: the whole content of the file
+        """
+        self.file.seek(0)
+        return self.file.read()
+
+    def save(self, path, chunk_size=settings.READ_CHUNK_SIZE):
+        """
+        Copies the file to the given path chunk by chunk.
+
+        :param path: destination path
+        :param chunk_size: size of the copied chunks
+        """
+        self.file.seek(0)
+        with open(path, 'wb') as destination:
+            while chunk := self.file.read(chunk_size):
+                destination.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return f'<UploadedFile {self.filename!r} ({self.size} bytes)>'
+
+
+def parse_header(value):
+    """
+    Parses a header with parameters, e.g.
+    'form-data; name="file"; filename="a.txt"'.
+
+    :param value: value of the header
+    :return: tuple of the main value in lowercase and the dict
+    of the parameters
+    """
+    message = Message()
+    message['header'] = value
+    params = message.get_params(header='header', failobj=[('', '')])
+    parameters = {key.lower(): collapse_rfc2231_value(param)
+                  for key, param in params[1:]}
+    return params[0][0].lower(), parameters
+
+
+def decode_pair(pair, encoding='utf-8'):
+    """
+    URL-decodes one 'key=value' pair. The value may contain '=' itself,
+    a key with no '=' gets an empty value.
+
+    :param pair: raw pair in bytes
+    :param encoding: encoding of the decoded values
+    :return: tuple of the key and the value
+    """
+    key, _, value = pair.partition(b'=')
+    return (unquote_plus(key.decode('latin-1'), encoding=encoding),
+            unquote_plus(value.decode('latin-1'), encoding=encoding))
+
+
+def parse_query_string(query_string):
+    """
+    Parses a query string, e.g. 'name=a%20b&tag=1&tag=2'.
+
+    :param query_string: raw query string
+    :return: MultiDict with the decoded values
+    """
+    result = MultiDict()
+    if query_string:
+        for pair in query_string.encode('latin-1', 'replace').split(b'&'):
+            if pair:
+                result.add(*decode_pair(pair))
+    return result
+
+
+def read_chunks(stream, content_length, max_body_size, chunk_size):
+    """
+    Reads the body of the request chunk by chunk.
+
+    :param stream: wsgi.input
+    :param content_length: value of the Content-Length header
+    :param max_body_size: maximum allowed size of the body
+    :param chunk_size: size of the chunks
+    :return: generator of the chunks in bytes
+    """
+    if content_length > max_body_size:
+        raise RequestEntityTooLarge()
+    remaining = content_length
+    while remaining > 0:
+        with phase('read'):
+            chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def parse_urlencoded(chunks):
+    """
+    Parses an application/x-www-form-urlencoded body without joining
+    it into one string first. The unfinished pair is collected in
+    a bytearray, so a large field spread over many chunks is copied
+    once rather than on every chunk.
+
+    :param chunks: iterable of the body chunks
+    :return: MultiDict with the decoded values
+    """
+    result = MultiDict()
+    pending = bytearray()
+    for chunk in chunks:
+        end = chunk.rfind(b'&')
+        if end == -1:
+            # the pair goes on in the next chunk
+            pending += chunk
+            continue
+        pairs = chunk[:end].split(b'&')
+        pending += pairs[0]
+        pairs[0] = bytes(pending)
+        for pair in pairs:
+            if pair:
+                result.add(*decode_pair(pair))
+        pending = bytearray(chunk[end + 1:])
+    if pending:
+        result.add(*decode_pair(bytes(pending)))
+    return result
+
+
+class MultipartParser:
+    """
+    Streaming parser of multipart/form-data bodies. The body is read
+    chunk by chunk, the files are written into UploadedFile objects
+    (spilled to disk once large enough), the rest of the fields are
+    collected as strings.
+    """
+    max_header_size = 16 * 1024
+
+    def __init__(self, boundary, max_memory_size, encoding='utf-8'):
+        """
+        :param boundary: boundary from the Content-Type header
+        :param max_memory_size: size after which the files go to disk
+        :param encoding: encoding of the text fields
+        """
+        self.delimiter = b'--' + boundary.encode('latin-1')
+        self.separator = b'\r\n' + self.delimiter
+        self.max_memory_size = max_memory_size
+        self.encoding = encoding
+
+    def start_part(self, raw_headers):
+        """
+        Parses the headers of a part and prepares its target.
+
+        :param raw_headers: headers of the part in bytes
+        :return: tuple of the field name and the target (either an
+        UploadedFile or a bytearray)
+        """
+        headers = {}
+        for line in raw_headers.decode(self.encoding, 'replace').split('\r\n'):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        _, disposition = parse_header(headers.get('content-disposition', ''))
+        if 'name' not in disposition:
+            raise BadRequest('Multipart part without a name')
+        if 'filename' in disposition:
+            return disposition['name'], UploadedFile(
+                disposition['filename'],
+                headers.get('content-type', 'application/octet-stream'),
+                self.max_memory_size)
+        return disposition['name'], bytearray()
+
+    @staticmethod
+    def write_part(target, data):
+        """
+        Appends the data to the part's target.
+        """
+        if isinstance(target, UploadedFile):
+            target.write(data)
+        else:
+            target += data
+
+    def finish_part(self, result, name, target):
+        """
+        Adds the finished part to the result.
+        """
+        if isinstance(target, UploadedFile):
+            target.file.seek(0)
+            result.add(name, target)
+        else:
+            result.add(name, target.decode(self.encoding, 'replace'))
+
+    def parse(self, chunks):
+        """
+        :param chunks: iterable of the body chunks
+        :return: MultiDict with the strings and UploadedFile objects
+        """
+        result = MultiDict()
+        buffer = b''
+        state = 'preamble'
+        name = target = None
+        for chunk in chunks:
+            buffer += chunk
+            while True:
+                if state == 'preamble':
+                    position = buffer.find(self.delimiter)
+                    if position < 0:
+                        buffer = buffer[-len(self.delimiter):]
+                        break
+                    buffer = buffer[position + len(self.delimiter):]
+                    state = 'delimiter'
+                elif state == 'delimiter':
+                    if len(buffer) < 2:
+                        break
+                    if buffer.startswith(b'--'):
+                        return result
+                    if not buffer.startswith(b'\r\n'):
+                        raise BadRequest('Malformed multipart body')
+                    buffer = buffer[2:]
+                    state = 'headers'
+                elif state == 'headers':
+                    position = buffer.find(b'\r\n\r\n')
+                    if position < 0:
+                        if len(buffer) > self.max_header_size:
+                            raise BadRequest('Multipart headers are too long')
+                        break
+                    name, target = self.start_part(buffer[:position])
+                    buffer = buffer[position + 4:]
+                    state = 'body'
+                else:
+                    position = buffer.find(self.separator)
+                    if position < 0:
+                        # the tail might be the beginning of the separator
+                        keep = len(self.separator) - 1
+                        if len(buffer) > keep:
+                            self.write_part(target, buffer[:-keep])
+                            buffer = buffer[-keep:]
+                        break
+                    self.write_part(target, buffer[:position])
+                    self.finish_part(result, name, target)
+                    buffer = buffer[position + len(self.separator):]
+                    state = 'delimiter'
+        raise BadRequest('Multipart body ended unexpectedly')
+
+
+def parse_body(environment,
+               max_body_size=settings.MAX_BODY_SIZE,
+               max_memory_size=settings.MAX_MEMORY_FILE_SIZE,
+               chunk_size=settings.READ_CHUNK_SIZE):
+    """
+    Reads and parses the body of the request according to its
+    Content-Type. Raises RequestEntityTooLarge if the body is larger
+    than allowed.
+
+    :param environment: WSGI environment of the request
+    :param max_body_size: maximum allowed size of the body
+    :param max_memory_size: size after which uploaded files go to disk
+    :param chunk_size: size of the chunks the body is read by
+    :return: MultiDict with the parsed data
+    """
+    content_length = environment.get('CONTENT_LENGTH')
+    try:
+        content_length = int(content_length) if content_length else 0
+    except ValueError:
+        raise BadRequest('Invalid Content-Length')
+    if content_length <= 0:
+        return MultiDict()
+    chunks = read_chunks(environment['wsgi.input'], content_length,
+                         max_body_size, chunk_size)
+    content_type, parameters = parse_header(
+        environment.get('CONTENT_TYPE', ''))
+    if content_type == 'multipart/form-data':
+        if not parameters.get('boundary'):
+            raise BadRequest('Multipart body without a boundary')
+        return MultipartParser(parameters['boundary'],
+                               max_memory_size).parse(chunks)
+    return parse_urlencoded(chunks)
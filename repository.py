@@ -0,0 +1,161 @@
+class Repository:
+    """
+    In-memory storage for the model objects of one kind. Keeps the objects
+    in a list (in order of creation) and maintains hash indexes by id and
+    by name on top of it, so that lookups don't have to scan the list.
+    """
+
+    def __init__(self):
+        """
+        Initializes the empty repository.
+        """
+        self.objects = []
+        self.by_id = {}
+        self.by_name = {}
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, obj):
+        return self.by_id.get(obj.id) is obj
+
+    def add(self, obj):
+        """
+        Stores the object and indexes it by its id and name.
+
+        :param obj: model object with the 'id' and 'name' attributes
+        :return: the stored object
+        """
+        if obj.id in self.by_id:
+            raise Exception(f'Object with id {obj.id} is already stored')
+        self.objects.append(obj)
+        self.by_id[obj.id] = obj
+        self.by_name.setdefault(obj.name, []).append(obj)
+        return obj
+
+    def remove(self, obj):
+        """
+        Removes the object from the repository and all of its indexes.
+
+        :param obj: stored model object
+        """
+        del self.by_id[obj.id]
+        namesakes = self.by_name[obj.name]
+        namesakes.remove(obj)
+        if not namesakes:
+            del self.by_name[obj.name]
+        self.objects.remove(obj)
+
+    def rename(self, obj, new_name):
+        """
+        Changes the name of a stored object keeping the name index in sync.
+
+        :param obj: stored model object
+        :param new_name: new name of the object
+        """
+        namesakes = self.by_name[obj.name]
+        namesakes.remove(obj)
+        if not namesakes:
+            del self.by_name[obj.name]
+        obj.name = new_name
+        self.by_name.setdefault(new_name, []).append(obj)
+
+    def get(self, obj_id):
+        """
+        Looks for an object by its id.
+
+        :param obj_id: id of the object
+        :return: the object or None
+        """
+        return self.by_id.get(obj_id)
+
+    def get_by_name(self, name):
+        """
+        Looks for an object by its name. If there are several objects with
+        the same name, the one created first is returned.
+
+        :param name: name of the object
+        :return: the object or None
+        """
+        namesakes = self.by_name.get(name)
+        return namesakes[0] if namesakes else None
+
+
+# dict shared by all the empty rosters, never changed
+EMPTY_ITEMS = {}
+
+
+class Roster:
+    """
+    Ordered set of model objects, e.g. the students of a course: O(1)
+    membership test, addition and removal, iteration in the order the
+    objects were added. Backed by the keys of a dict, the empty rosters
+    share one dict until the first object is added.
+
+    The iteration goes over a snapshot of the objects (copied at once,
+    without releasing the GIL), so a template or a serializer walking
+    the roster doesn't fail when another thread enrolls a student or
+    refreshes the site meanwhile.
+    """
+    __slots__ = ('items',)
+
+    def __init__(self, objects=()):
+        """
+        :param objects: initial objects, the duplicates are skipped
+        """
+        self.items = dict.fromkeys(objects) or EMPTY_ITEMS
+
+    def __iter__(self):
+        return iter(tuple(self.items))
+
+    def __reversed__(self):
+        return reversed(tuple(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, obj):
+        return obj in self.items
+
+    def __getitem__(self, index):
+        """
+        Positional access. O(1) for the first and the last object,
+        O(n) for the rest.
+
+        :param index: position of the object, negative ones included
+        :return: the object
+        """
+        if index == 0 and self.items:
+            return next(iter(self.items))
+        if index == -1 and self.items:
+            return next(reversed(self.items))
+        return list(self.items)[index]
+
+    def __repr__(self):
+        return f'Roster({list(self.items)!r})'
+
+    def add(self, obj):
+        """
+        :param obj: model object
+        :return: whether the object was added, False if already present
+        """
+        if obj in self.items:
+            return False
+        if self.items is EMPTY_ITEMS:
+            self.items = {obj: None}
+        else:
+            self.items[obj] = None
+        return True
+
+    def discard(self, obj):
+        """
+        :param obj: model object
+        :return: whether the object was removed, False if not present
+        """
+        if obj not in self.items:
+            return False
+        del self.items[obj]
+        return True
@@ -0,0 +1,202 @@
+import re
+
+
+class RouteHandlers(dict):
+    """
+    Views of one route by HTTP-method. Knows the pattern of the route,
+    e.g. '/course/<int:id>/', which labels the route's metrics.
+    """
+
+    def __init__(self, pattern):
+        """
+        :param pattern: url pattern of the route
+        """
+        super().__init__()
+        self.pattern = pattern
+
+
+class RouteNode:
+    """
+    Node of the routes' trie. Each node corresponds to one segment of
+    the path: the literal segments are kept in a dictionary, the typed
+    parameters in a list checked in the order the routes were added.
+    """
+    __slots__ = ('static', 'parameters', 'handlers')
+
+    def __init__(self):
+        self.static = {}
+        self.parameters = []
+        self.handlers = None
+
+    def get_parameter_child(self, converter, name):
+        """
+        Returns the child node for the parameter, creating it if needed.
+
+        :param converter: name of the converter, e.g. 'int'
+        :param name: name of the parameter
+        :return: an instance of RouteNode
+        """
+        for child_converter, child_name, child in self.parameters:
+            if child_converter == converter and child_name == name:
+                return child
+        child = RouteNode()
+        self.parameters.append((converter, name, child))
+        return child
+
+
+class Router:
+    """
+    Compiled URL dispatcher of the framework. Routes without parameters
+    are looked up in a plain dictionary, the ones with typed path
+    parameters (e.g. '/course/<int:id>/') are stored in a trie by the
+    path segments, so the cost of a lookup depends on the length of the
+    path and not on the number of routes. Every route can have different
+    views for different HTTP-methods.
+    """
+    # converter name -> (regex, function converting the matched string)
+    converters = {
+        'str': (re.compile(r'[^/]+'), str),
+        'int': (re.compile(r'\d+'), int),
+        'slug': (re.compile(r'[-a-zA-Z0-9_]+'), str),
+        'path': (re.compile(r'.+'), str),
+    }
+    parameter_pattern = re.compile(
+        r'^<(?:(?P<converter>\w+):)?(?P<name>\w+)>$')
+    any_method = '*'
+
+    def __init__(self):
+        """
+        Initializes the empty router.
+        """
+        self.static_routes = {}
+        self.root = RouteNode()
+
+    @classmethod
+    def from_dict(cls, urls):
+        """
+        Builds the router from the plain dictionary of url-paths,
+        the way they used to be passed to the App.
+
+        :param urls: dictionary, url -> view
+        :return: an instance of Router
+        """
+        router = cls()
+        for url, view in urls.items():
+            router.add(url, view)
+        return router
+
+    @staticmethod
+    def split(path):
+        """
+        :param path: path or url pattern
+        :return: list of the path segments
+        """
+        return path.strip('/').split('/') if path.strip('/') else []
+
+    def add(self, pattern, view, methods=None):
+        """
+        Adds the route to the router.
+
+        :param pattern: url pattern, e.g. '/course/<int:id>/'
+        :param view: callable view
+        :param methods: HTTP-methods handled by the view, all by default
+        """
+        if not pattern.endswith('/'):
+            pattern = f'{pattern}/'
+        segments = self.split(pattern)
+        matches = [self.parameter_pattern.match(segment)
+                   for segment in segments]
+        if any(matches):
+            node = self.root
+            for position, (segment, match) in enumerate(
+                    zip(segments, matches)):
+                if match is None:
+                    node = node.static.setdefault(segment, RouteNode())
+                    continue
+                converter = match.group('converter') or 'str'
+                if converter not in self.converters:
+                    raise Exception(f'Unknown path converter {converter} '
+                                    f'in {pattern}')
+                if converter == 'path' and position != len(segments) - 1:
+                    raise Exception(f'The path converter must be the last '
+                                    f'segment of {pattern}')
+                node = node.get_parameter_child(converter, match.group('name'))
+            if node.handlers is None:
+                node.handlers = RouteHandlers(pattern)
+            handlers = node.handlers
+        else:
+            handlers = self.static_routes.get(pattern)
+            if handlers is None:
+                handlers = self.static_routes[pattern] = \
+                    RouteHandlers(pattern)
+        for method in methods or (self.any_method,):
+            handlers[method.upper()] = view
+
+    def match(self, node, segments, position, parameters):
+        """
+        Walks down the trie looking for the node of the route. Literal
+        segments take precedence over the parameters.
+
+        :param node: current node
+        :param segments: segments of the path
+        :param position: index of the current segment
+        :param parameters: dict collecting the path parameters
+        :return: handlers of the found route or None
+        """
+        if position == len(segments):
+            return node.handlers
+        segment = segments[position]
+        child = node.static.get(segment)
+        if child is not None:
+            handlers = self.match(child, segments, position + 1, parameters)
+            if handlers is not None:
+                return handlers
+        for converter, name, child in node.parameters:
+            regex, function = self.converters[converter]
+            if converter == 'path':
+                if child.handlers is None:
+                    continue
+                parameters[name] = '/'.join(segments[position:])
+                return child.handlers
+            if regex.fullmatch(segment) is None:
+                continue
+            parameters[name] = function(segment)
+            handlers = self.match(child, segments, position + 1, parameters)
+            if handlers is not None:
+                return handlers
+            del parameters[name]
+        return None
+
+    def resolve(self, path):
+        """
+        Looks for the route matching the path.
+
+        :param path: path of the request, ending with a slash
+        :return: a tuple of the RouteHandlers (dict with views by
+        HTTP-method) and the dict with path parameters, or None if there
+        is no such route
+        """
+        handlers = self.static_routes.get(path)
+        if handlers is not None:
+            return handlers, {}
+        parameters = {}
+        handlers = self.match(self.root, self.split(path), 0, parameters)
+        if handlers is None:
+            return None
+        return handlers, parameters
+
+    def get_view(self, handlers, method):
+        """
+        Picks the view for the HTTP-method from the route's handlers.
+
+        :param handlers: dict with views by HTTP-method
+        :param method: HTTP-method of the request
+        :return: the view or None if the method is not allowed
+        """
+        view = handlers.get(method)
+        if view is None:
+            view = handlers.get(self.any_method)
+        return view
+
+    def __contains__(self, path):
+        return self.resolve(path) is not None
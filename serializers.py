@@ -0,0 +1,496 @@
+from abc import ABCMeta, abstractmethod
+from json import JSONEncoder, loads
+from struct import Struct, pack, unpack_from
+
+from exceptions import BadRequest
+
+encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class Field:
+    """
+    Field of a schema. Takes the value from the object's attribute
+    (the field's name by default) or computes it with the getter.
+    """
+
+    def __init__(self, attribute=None, getter=None):
+        """
+        :param attribute: name of the object's attribute
+        :param getter: callable taking the object and returning the value
+        """
+        self.attribute = attribute
+        self.getter = getter
+
+    def bind(self, name):
+        """
+        :param name: name of the field in the schema
+        :return: callable taking the object and returning the value
+        """
+        if self.getter is not None:
+            return self.getter
+        attribute = self.attribute or name
+
+        def get(obj):
+            return getattr(obj, attribute)
+
+        return get
+
+
+class Schema:
+    """
+    Lean schema-driven encoder: the subclasses list their fields, only
+    these are written, the related objects are written as ids. The
+    getters of the selected fields are prepared once per schema object.
+    """
+    fields = {}
+    default_fields = None
+
+    def __init__(self, only=None):
+        """
+        :param only: names of the fields to write, the default ones
+        (or all of them) if omitted
+        """
+        names = only or self.default_fields or list(self.fields)
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise BadRequest(f'Unknown fields: {", ".join(unknown)}')
+        self.getters = [(name, self.fields[name].bind(name))
+                        for name in names]
+
+    def dump(self, obj):
+        """
+        :param obj: object to serialize
+        :return: dict with the values of the selected fields
+        """
+        return {name: get(obj) for name, get in self.getters}
+
+    def encode(self, obj):
+        """
+        :param obj: object to serialize
+        :return: JSON string
+        """
+        return encoder.encode(self.dump(obj))
+
+
+def related_id(attribute):
+    """
+    :param attribute: name of the attribute with the related object
+    :return: getter returning the id of the related object or None
+    """
+    def get(obj):
+        related = getattr(obj, attribute)
+        return related.id if related is not None else None
+
+    return get
+
+
+class CourseSchema(Schema):
+    """
+    Schema of the courses for the API.
+    """
+    fields = {
+        'id': Field(),
+        'name': Field(),
+        'type': Field('type_'),
+        'category': Field(getter=related_id('category')),
+        'category_name': Field(getter=lambda course: course.category.name
+                               if course.category is not None else None),
+        'students': Field(getter=lambda course: [student.id for student
+                                                 in course.students]),
+        'students_count': Field(getter=lambda course: len(course.students)),
+    }
+    default_fields = ['id', 'name', 'type', 'category', 'students_count']
+
+
+class ModelField(metaclass=ABCMeta):
+    """
+    Base class of the fields declared by the models for their
+    serialization (see ModelSchema). Each field knows how to generate
+    the code reading and writing its value, the schema compiles this
+    code into the encoding and decoding functions of the model.
+    """
+
+    def json_encode(self, attribute):
+        """
+        :param attribute: name of the object's attribute
+        :return: Python expression with the JSON value of the field
+        """
+        return f'obj.{attribute}'
+
+    def json_decode(self, attribute, value):
+        """
+        :param attribute: name of the object's attribute
+        :param value: Python expression with the JSON value
+        :return: line of code restoring the attribute
+        """
+        return f'obj.{attribute} = {value}'
+
+    @abstractmethod
+    def pack(self, attribute):
+        """
+        :param attribute: name of the object's attribute
+        :return: lines of code appending the binary value to 'parts'
+        """
+
+    @abstractmethod
+    def unpack(self, attribute):
+        """
+        :param attribute: name of the object's attribute
+        :return: lines of code reading the value from 'buffer' at
+        'offset' and moving the offset past it
+        """
+
+
+class IntegerField(ModelField):
+    """
+    Signed 64-bit integer.
+    """
+
+    def pack(self, attribute):
+        return [f'parts.append(pack_q(obj.{attribute}))']
+
+    def unpack(self, attribute):
+        return [f'obj.{attribute}, = unpack_q(buffer, offset)',
+                'offset += 8']
+
+
+class FloatField(ModelField):
+    """
+    Double precision float.
+    """
+
+    def pack(self, attribute):
+        return [f'parts.append(pack_d(obj.{attribute}))']
+
+    def unpack(self, attribute):
+        return [f'obj.{attribute}, = unpack_d(buffer, offset)',
+                'offset += 8']
+
+
+class StringField(ModelField):
+    """
+    Unicode string, None is allowed as well.
+    """
+
+    def pack(self, attribute):
+        return [f'value = obj.{attribute}',
+                'if value is None:',
+                '    parts.append(pack_I(NULL_LENGTH))',
+                'else:',
+                "    value = value.encode('utf-8')",
+                '    parts.append(pack_I(len(value)))',
+                '    parts.append(value)']
+
+    def unpack(self, attribute):
+        return ['length, = unpack_I(buffer, offset)',
+                'offset += 4',
+                'if length == NULL_LENGTH:',
+                f'    obj.{attribute} = None',
+                'else:',
+                f"    obj.{attribute} = str(buffer[offset:offset + length], "
+                f"'utf-8')",
+                '    offset += length']
+
+
+class ReferenceField(ModelField):
+    """
+    Reference to another model object, written as its id. Resolved back
+    to the object once all the objects are loaded.
+    """
+
+    def __init__(self, kind):
+        """
+        :param kind: serializer_kind of the referenced model
+        """
+        self.kind = kind
+
+    def json_encode(self, attribute):
+        return f'(None if obj.{attribute} is None else obj.{attribute}.id)'
+
+    def json_decode(self, attribute, value):
+        return f"references.append((obj, '{attribute}', '{self.kind}', " \
+               f"{value}, None))"
+
+    def pack(self, attribute):
+        return [f'value = obj.{attribute}',
+                'parts.append(pack_q(-1 if value is None else value.id))']
+
+    def unpack(self, attribute):
+        return ['value, = unpack_q(buffer, offset)',
+                'offset += 8',
+                f"references.append((obj, '{attribute}', '{self.kind}', "
+                f"None if value == -1 else value, None))"]
+
+
+class ReferenceListField(ReferenceField):
+    """
+    Collection of references to other model objects, written as the
+    list of their ids.
+    """
+
+    def __init__(self, kind, container=list):
+        """
+        :param kind: serializer_kind of the referenced models
+        :param container: type of the collection restored, takes
+        an iterable of the objects
+        """
+        super().__init__(kind)
+        self.container = container
+
+    def json_encode(self, attribute):
+        return f'[item.id for item in obj.{attribute}]'
+
+    def json_decode(self, attribute, value):
+        return f"references.append((obj, '{attribute}', '{self.kind}', " \
+               f"{value}, containers['{attribute}']))"
+
+    def pack(self, attribute):
+        return [f'value = [item.id for item in obj.{attribute}]',
+                'parts.append(pack_I(len(value)))',
+                "parts.append(pack(f'<{len(value)}q', *value))"]
+
+    def unpack(self, attribute):
+        return ['length, = unpack_I(buffer, offset)',
+                'offset += 4',
+                f"references.append((obj, '{attribute}', '{self.kind}', "
+                f"list(unpack_from(f'<{{length}}q', buffer, offset)), "
+                f"containers['{attribute}']))",
+                'offset += 8 * length']
+
+
+class ModelSchema:
+    """
+    Serialization schema of a model class, built from the fields the
+    class (and its parents) declare in 'serializer_fields'. The encoding
+    and decoding functions for JSON and for the binary format are
+    generated and compiled once per class.
+
+    The attributes which are not serialized get the values from the
+    factories in 'serializer_defaults'. Once all the objects are loaded
+    and the references are resolved, the 'restore_links' method of the
+    object (if any) rebuilds the back-references to the other loaded
+    objects; the objects returned by the resolver are left untouched.
+    """
+    registry = {}
+
+    def __init__(self, cls):
+        """
+        :param cls: model class
+        """
+        self.cls = cls
+        self.name = cls.__name__
+        self.kind = cls.serializer_kind
+        self.fields = {}
+        self.defaults = {}
+        for klass in reversed(cls.__mro__):
+            self.fields.update(vars(klass).get('serializer_fields', {}))
+            self.defaults.update(vars(klass).get('serializer_defaults', {}))
+        self.compile()
+
+    @classmethod
+    def for_name(cls, name):
+        """
+        :param name: name of the model class
+        :return: ModelSchema of the class
+        """
+        try:
+            return cls.registry[name]
+        except KeyError:
+            raise ValueError(f'Model {name} is not serializable')
+
+    def compile(self):
+        """
+        Generates and compiles the encoding and decoding functions.
+        """
+        fields = self.fields.items()
+        defaults = [f'obj.{attribute} = defaults[{attribute!r}]()'
+                    for attribute in self.defaults]
+        items = ', '.join(f'{name!r}: {field.json_encode(name)}'
+                          for name, field in fields)
+        lines = [f'def to_dict(obj):',
+                 f'    return {{{items}}}',
+                 '',
+                 'def from_dict(data, references):',
+                 '    obj = new(cls)']
+        lines += [f'    {line}' for line in defaults]
+        lines += [f'    {field.json_decode(name, f"data[{name!r}]")}'
+                  for name, field in fields]
+        lines += ['    return obj', '', 'def pack_object(obj, parts):']
+        for name, field in fields:
+            lines += [f'    {line}' for line in field.pack(name)]
+        lines += ['', 'def unpack_object(buffer, offset, references):',
+                  '    obj = new(cls)']
+        lines += [f'    {line}' for line in defaults]
+        for name, field in fields:
+            lines += [f'    {line}' for line in field.unpack(name)]
+        lines += ['    return obj, offset']
+        namespace = {
+            'new': object.__new__, 'cls': self.cls,
+            'defaults': self.defaults, 'pack': pack,
+            'containers': {name: field.container
+                           for name, field in self.fields.items()
+                           if isinstance(field, ReferenceListField)},
+            'unpack_from': unpack_from, 'NULL_LENGTH': NULL_LENGTH,
+            'pack_q': INT64.pack, 'unpack_q': INT64.unpack_from,
+            'pack_d': DOUBLE.pack, 'unpack_d': DOUBLE.unpack_from,
+            'pack_I': UINT32.pack, 'unpack_I': UINT32.unpack_from,
+        }
+        exec(compile('\n'.join(lines), f'<schema {self.name}>', 'exec'),
+             namespace)
+        self.to_dict = namespace['to_dict']
+        self.from_dict = namespace['from_dict']
+        self.pack = namespace['pack_object']
+        self.unpack = namespace['unpack_object']
+
+
+def serializable(cls):
+    """
+    Class decorator registering the model class for the serialization.
+
+    :param cls: model class with 'serializer_kind' and 'serializer_fields'
+    :return: the same class
+    """
+    ModelSchema.registry[cls.__name__] = ModelSchema(cls)
+    return cls
+
+
+INT64 = Struct('<q')
+DOUBLE = Struct('<d')
+UINT32 = Struct('<I')
+NULL_LENGTH = 0xFFFFFFFF
+BINARY_MAGIC = b'PPSB\x01'
+
+
+def group_objects(objects):
+    """
+    :param objects: list of model objects
+    :return: dict of the lists of the objects by their class names
+    """
+    groups = {}
+    for obj in objects:
+        groups.setdefault(type(obj).__name__, []).append(obj)
+    return groups
+
+
+def resolve_references(objects, indexes, references, resolver=None):
+    """
+    Replaces the ids in the references with the loaded objects and lets
+    the objects rebuild their back-references.
+
+    :param objects: list of the loaded objects
+    :param indexes: dict of the loaded objects by their ids by the
+    serializer kinds
+    :param references: list of (object, attribute, kind, ids,
+    container), the container is None for the single references
+    :param resolver: callable (kind, id) -> object for the references
+    to the objects which weren't serialized, None if omitted
+    :return: the list of objects
+    """
+    for obj, attribute, kind, value, container in references:
+        index = indexes.get(kind, {})
+        if container is not None:
+            targets = map(index.get, value)
+            if resolver is not None:
+                targets = [resolver(kind, obj_id) if target is None
+                           else target
+                           for obj_id, target in zip(value, targets)]
+            setattr(obj, attribute, container(
+                target for target in targets if target is not None))
+        elif value is not None:
+            target = index.get(value)
+            if target is None and resolver is not None:
+                target = resolver(kind, value)
+            setattr(obj, attribute, target)
+        else:
+            setattr(obj, attribute, None)
+    loaded = {id(obj) for obj in objects}
+    for obj in objects:
+        restore_links = getattr(obj, 'restore_links', None)
+        if restore_links is not None:
+            restore_links(loaded)
+    return objects
+
+
+def dump_json(objects):
+    """
+    :param objects: list of model objects
+    :return: JSON string, {"ClassName": [{field: value}, ...], ...}
+    """
+    return encoder.encode({
+        name: [ModelSchema.for_name(name).to_dict(obj) for obj in group]
+        for name, group in group_objects(objects).items()})
+
+
+def load_json(data, resolver=None):
+    """
+    :param data: JSON string written by dump_json
+    :param resolver: see resolve_references
+    :return: list of the model objects
+    """
+    objects = []
+    indexes = {}
+    references = []
+    for name, records in loads(data).items():
+        schema = ModelSchema.for_name(name)
+        index = indexes.setdefault(schema.kind, {})
+        from_dict = schema.from_dict
+        for record in records:
+            obj = from_dict(record, references)
+            index[obj.id] = obj
+            objects.append(obj)
+    return resolve_references(objects, indexes, references, resolver)
+
+
+def dump_binary(objects):
+    """
+    Writes the objects into the compact binary format: the header,
+    then for every class its name, the number of objects and the
+    objects' fields packed with struct, without the field names.
+
+    :param objects: list of model objects
+    :return: bytes
+    """
+    parts = [BINARY_MAGIC]
+    groups = group_objects(objects)
+    parts.append(UINT32.pack(len(groups)))
+    for name, group in groups.items():
+        encoded_name = name.encode('utf-8')
+        parts.append(UINT32.pack(len(encoded_name)))
+        parts.append(encoded_name)
+        parts.append(UINT32.pack(len(group)))
+        pack_object = ModelSchema.for_name(name).pack
+        for obj in group:
+            pack_object(obj, parts)
+    return b''.join(parts)
+
+
+def load_binary(data, resolver=None):
+    """
+    :param data: bytes written by dump_binary
+    :param resolver: see resolve_references
+    :return: list of the model objects
+    """
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError('Not a binary dump of the models')
+    buffer = memoryview(data)
+    offset = len(BINARY_MAGIC)
+    objects = []
+    indexes = {}
+    references = []
+    groups, = UINT32.unpack_from(buffer, offset)
+    offset += 4
+    for _ in range(groups):
+        length, = UINT32.unpack_from(buffer, offset)
+        offset += 4
+        name = str(buffer[offset:offset + length], 'utf-8')
+        offset += length
+        count, = UINT32.unpack_from(buffer, offset)
+        offset += 4
+        schema = ModelSchema.for_name(name)
+        index = indexes.setdefault(schema.kind, {})
+        unpack_object = schema.unpack
+        for _ in range(count):
+            obj, offset = unpack_object(buffer, offset, references)
+            index[obj.id] = obj
+            objects.append(obj)
+    return resolve_references(objects, indexes, references, resolver)
@@ -0,0 +1,162 @@
+"""
+Settings of the framework. Every value can be overridden with an
+environment variable of the same name, e.g.
+
+`APP_ENV=prod gunicorn main:app`
+"""
+import os
+
+
+def env_flag(name, default):
+    """
+    Reads a boolean flag from the environment.
+
+    :param name: name of the environment variable
+    :param default: value used if the variable is not set
+    :return: bool
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+# 'dev' or 'prod'. Development mode favours convenience (templates are
+# re-checked on every render), production mode favours speed.
+APP_ENV = os.environ.get('APP_ENV', 'dev')
+
+# Whether the functions decorated with decos.debug are timed.
+DEBUG = env_flag('DEBUG', APP_ENV == 'dev')
+
+# Interval in seconds of printing the timings summary in the debug mode,
+# 0 disables the periodic summary.
+DEBUG_REPORT_INTERVAL = float(os.environ.get('DEBUG_REPORT_INTERVAL', 60))
+
+# Directory with all the HTML templates of the framework.
+TEMPLATES_DIR = os.environ.get('TEMPLATES_DIR', 'templates')
+
+# Whether the compiled templates are checked against the file's mtime
+# before every render. Enabled in the development mode only by default.
+TEMPLATES_AUTO_RELOAD = env_flag('TEMPLATES_AUTO_RELOAD', APP_ENV == 'dev')
+
+# Whether all the templates get compiled once the App is constructed.
+TEMPLATES_WARM_UP = env_flag('TEMPLATES_WARM_UP', APP_ENV == 'prod')
+
+# Maximum size of a request's body in bytes, larger ones get the 413 response.
+MAX_BODY_SIZE = int(os.environ.get('MAX_BODY_SIZE', 10 * 1024 * 1024))
+
+# Size in bytes after which the uploaded files are spilled to disk.
+MAX_MEMORY_FILE_SIZE = int(os.environ.get('MAX_MEMORY_FILE_SIZE', 512 * 1024))
+
+# Size of the chunks in bytes the request's body is read by.
+READ_CHUNK_SIZE = int(os.environ.get('READ_CHUNK_SIZE', 64 * 1024))
+
+# Byte budget of the cache of the rendered pages.
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.environ.get('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# Default time to live of the cached pages in seconds.
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Buffered file logging: size of the messages' queue, maximum number of
+# messages written at once and maximum delay of a message in seconds.
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 256))
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 1.0))
+
+# Rotation of the log files: by size in bytes and by age in seconds
+# (0 disables either of them), and the number of rotated files kept.
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_INTERVAL = int(os.environ.get('LOG_ROTATE_INTERVAL', 0))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+
+# What happens to a message when the logging queue is full:
+# 'drop' it or 'block' the caller until there is free space.
+LOG_OVERFLOW_POLICY = os.environ.get('LOG_OVERFLOW_POLICY', 'drop')
+
+# Storage backend of the OnlineUniversity: 'memory', 'sqlite' or 'log'.
+STORAGE = os.environ.get('STORAGE', 'memory')
+
+# Path to the SQLite database and the number of ids a worker reserves
+# at once for the new objects.
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'university.sqlite3')
+SQLITE_ID_BLOCK_SIZE = int(os.environ.get('SQLITE_ID_BLOCK_SIZE', 100))
+
+# Path to the shared log file of the 'log' storage, the number of ids
+# a worker reserves at once and the minimal number of bytes the file
+# grows by.
+SHARED_LOG_PATH = os.environ.get('SHARED_LOG_PATH', 'university.log')
+SHARED_LOG_ID_BLOCK_SIZE = int(os.environ.get('SHARED_LOG_ID_BLOCK_SIZE', 100))
+SHARED_LOG_GROWTH = int(os.environ.get('SHARED_LOG_GROWTH', 1024 * 1024))
+
+# Whether the committed records of the shared log are synced to disk
+# (the threads committing together share one sync) and the size of the
+# log in bytes after which it's compacted into a snapshot, 0 never.
+SHARED_LOG_FSYNC = env_flag('SHARED_LOG_FSYNC', True)
+SHARED_LOG_SNAPSHOT_SIZE = int(
+    os.environ.get('SHARED_LOG_SNAPSHOT_SIZE', 16 * 1024 * 1024))
+
+# JSON API: default and maximum number of items on a page and the number
+# of items encoded into one chunk of the streamed response.
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+API_CHUNK_SIZE = int(os.environ.get('API_CHUNK_SIZE', 50))
+
+# Whether the observers of the models get the events in the background
+# threads (the request only queues them) or right away.
+EVENTS_ASYNC = env_flag('EVENTS_ASYNC', True)
+
+# Background delivery of the events: number of the worker threads, size
+# of the queue, maximum number of events delivered at once and maximum
+# time in seconds a worker waits to fill such a batch.
+EVENT_WORKERS = int(os.environ.get('EVENT_WORKERS', 2))
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 10000))
+EVENT_BATCH_SIZE = int(os.environ.get('EVENT_BATCH_SIZE', 100))
+EVENT_FLUSH_INTERVAL = float(os.environ.get('EVENT_FLUSH_INTERVAL', 0.05))
+
+# Retries of a failed delivery and the delay in seconds before the first
+# retry, doubled for every next one.
+EVENT_MAX_RETRIES = int(os.environ.get('EVENT_MAX_RETRIES', 3))
+EVENT_RETRY_BACKOFF = float(os.environ.get('EVENT_RETRY_BACKOFF', 0.1))
+
+# What happens to an event when the queue is full: 'drop' it or 'block'
+# the request until there is free space.
+EVENT_OVERFLOW_POLICY = os.environ.get('EVENT_OVERFLOW_POLICY', 'drop')
+
+# Number of the threads running the synchronous views under AsyncApp.
+ASYNC_VIEW_THREADS = int(os.environ.get('ASYNC_VIEW_THREADS', 16))
+
+# URL prefix of the static files, the directory with their sources and
+# the directory the build (`python -m static`) writes the fingerprinted
+# files into. The built files are served first, then the sources.
+STATIC_URL = os.environ.get('STATIC_URL', '/static/')
+STATIC_DIR = os.environ.get('STATIC_DIR', 'static')
+STATIC_ROOT = os.environ.get('STATIC_ROOT', 'static_build')
+
+# Cache-Control max-age in seconds of the static files which are not
+# fingerprinted, the fingerprinted ones are cached for a year.
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+
+# Smaller static files get no precompressed siblings in the build.
+STATIC_COMPRESS_MIN_SIZE = int(os.environ.get('STATIC_COMPRESS_MIN_SIZE', 1024))
+
+# Compression of the responses: smaller ones (in bytes) are sent as they
+# are, the zlib compression level (1 is the fastest, 9 the smallest) and
+# whether the deflate coding is offered besides gzip.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+COMPRESSION_DEFLATE = env_flag('COMPRESSION_DEFLATE', False)
+
+# Whether the App records the request metrics exported at /metrics/.
+METRICS = env_flag('METRICS', True)
+
+# Directory the workers write their metrics into, so that /metrics/
+# shows the sum of all of them (empty for the metrics of one worker
+# only), and the interval in seconds of writing them.
+METRICS_DIR = os.environ.get('METRICS_DIR', 'logs/metrics')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# Whether the enrollment reports use NumPy (if it's installed) and the
+# number of the most popular courses they show.
+REPORTS_USE_NUMPY = env_flag('REPORTS_USE_NUMPY', True)
+REPORTS_TOP_COURSES = int(os.environ.get('REPORTS_TOP_COURSES', 10))
@@ -0,0 +1,467 @@
+"""
+Static files: the WSGI middleware serving them under settings.STATIC_URL
+and the build step fingerprinting them for long-lived caching. Run from
+the project root:
+
+`python -m static`
+
+The files of settings.STATIC_DIR are copied into settings.STATIC_ROOT
+with the hash of the content in their names ('css/site.css' becomes
+'css/site.1a2b3c4d5e6f.css'), together with their precompressed '.gz'
+(and '.br' if the brotli package is installed) siblings and the
+manifest mapping the original names to the fingerprinted ones. The
+templates refer to the files with `{{ static_url('css/site.css') }}`.
+"""
+import gzip
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+from email.utils import formatdate
+from hashlib import blake2b
+from threading import Lock
+
+import settings
+
+try:
+    import brotli
+except ImportError:  # optional, only the gzip siblings are built then
+    brotli = None
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# extensions of the precompressed siblings by the content codings
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# the precompressed siblings are built for these types only,
+# the images and fonts are compressed already
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/xml', 'image/svg+xml')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_hash(path, chunk_size=settings.READ_CHUNK_SIZE):
+    """
+    :param path: path to the file
+    :param chunk_size: size of the chunks the file is read by
+    :return: hex digest of the file's content
+    """
+    digest = blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_accept_encoding(value):
+    """
+    Parses the Accept-Encoding header, e.g. 'gzip, br;q=0.5, *;q=0'.
+
+    :param value: value of the header
+    :return: set of the accepted content codings
+    """
+    accepted = set()
+    for item in value.split(','):
+        coding, _, parameters = item.strip().partition(';')
+        quality = 1.0
+        name, _, weight = parameters.strip().partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                quality = float(weight)
+            except ValueError:
+                pass
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def parse_range(value, size):
+    """
+    Parses the Range header. Only a single byte range is supported, the
+    rest of the forms are ignored and the whole file is served.
+
+    :param value: value of the header, e.g. 'bytes=0-99' or 'bytes=-100'
+    :param size: size of the file
+    :return: tuple of the first and the last byte position, None if the
+    range is to be ignored, False if it can't be satisfied
+    """
+    match = RANGE_PATTERN.match(value.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if first >= size:
+        return False
+    last = int(last) if last else size - 1
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+class FileIterator:
+    """
+    Iterator over a part of a file, used when the server has no
+    wsgi.file_wrapper or when only a range of the file is sent.
+    """
+
+    def __init__(self, file, start, length,
+                 chunk_size=settings.READ_CHUNK_SIZE):
+        """
+        :param file: file opened in the binary mode
+        :param start: position of the first byte
+        :param length: number of the bytes to send
+        :param chunk_size: size of the chunks
+        """
+        self.file = file
+        self.remaining = length
+        self.chunk_size = chunk_size
+        file.seek(start)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        chunk = self.file.read(min(self.chunk_size, self.remaining))
+        if not chunk:
+            raise StopIteration
+        self.remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self.file.close()
+
+
+class Manifest:
+    """
+    Mapping of the original names of the static files to their
+    fingerprinted names, read from the manifest written by the build.
+    Loaded once per process, an empty mapping if there was no build.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the manifest file
+        """
+        self.path = path
+        self.names = None
+        self.fingerprinted = frozenset()
+        self.lock = Lock()
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                names = json.load(file)
+        except (OSError, ValueError):
+            names = {}
+        self.fingerprinted = frozenset(names.values())
+        self.names = names
+
+    def get(self, name):
+        """
+        :param name: original name of the file, e.g. 'css/site.css'
+        :return: fingerprinted name, the original one if it's unknown
+        """
+        if self.names is None:
+            with self.lock:
+                if self.names is None:
+                    self.load()
+        return self.names.get(name, name)
+
+    def is_fingerprinted(self, name):
+        """
+        :param name: name of the served file
+        :return: whether the name contains the hash of the content
+        """
+        if self.names is None:
+            self.get(name)
+        return name in self.fingerprinted
+
+
+manifest = Manifest(os.path.join(settings.STATIC_ROOT, MANIFEST_NAME))
+
+
+def static_url(name):
+    """
+    Jinja global: URL of a static file, fingerprinted if it was built.
+
+    :param name: name of the file inside settings.STATIC_DIR
+    :return: URL of the file
+    """
+    return settings.STATIC_URL + manifest.get(name.lstrip('/'))
+
+
+class StaticFiles:
+    """
+    WSGI middleware serving the files under the prefix from the given
+    directories (the first one having the file wins), the rest of the
+    requests go to the wrapped app.
+
+    The whole files are sent with the server's wsgi.file_wrapper, so
+    gunicorn sends them with sendfile without copying them through
+    Python. Every response has a strong ETag (hash of the content,
+    cached by the file's size and mtime) and a Cache-Control header,
+    a year long for the fingerprinted files. If the client accepts
+    br or gzip and the file has a precompressed sibling, the sibling
+    is sent instead. Single byte ranges are supported.
+    """
+
+    def __init__(self, app, directories=(settings.STATIC_ROOT,
+                                         settings.STATIC_DIR),
+                 prefix=settings.STATIC_URL, max_age=settings.STATIC_MAX_AGE,
+                 manifest=manifest):
+        """
+        :param app: WSGI application
+        :param directories: directories with the static files
+        :param prefix: URL prefix of the static files, e.g. '/static/'
+        :param max_age: Cache-Control max-age of the files which are
+        not fingerprinted, in seconds
+        :param manifest: Manifest of the fingerprinted files
+        """
+        self.app = app
+        self.directories = [os.path.realpath(directory)
+                            for directory in directories]
+        self.prefix = prefix if prefix.endswith('/') else f'{prefix}/'
+        self.max_age = max_age
+        self.manifest = manifest
+        # the manifest of the build lies among the files, but isn't one
+        self.manifest_path = os.path.realpath(manifest.path)
+        self.etags = {}
+
+    def __call__(self, environment, start_response):
+        path = environment.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.app(environment, start_response)
+        method = environment['REQUEST_METHOD'].upper()
+        if method not in ('GET', 'HEAD'):
+            start_response('405 METHOD NOT ALLOWED',
+                           [('Content-Type', 'text/html'),
+                            ('Allow', 'GET, HEAD')])
+            return [b'METHOD NOT ALLOWED']
+        name = path[len(self.prefix):]
+        found = self.find(name)
+        if found is None:
+            start_response('404 NOT FOUND', [('Content-Type', 'text/html')])
+            return [b'PAGE NOT FOUND']
+        return self.serve(environment, start_response, name, found,
+                          method == 'HEAD')
+
+    def find(self, name):
+        """
+        :param name: path of the file after the prefix
+        :return: full path of the file, None if there's no such file,
+        the path leads outside of the directories or to the manifest
+        """
+        parts = name.split('/')
+        if '\x00' in name or any(part in ('', '.', '..') for part in parts):
+            return None
+        for directory in self.directories:
+            path = os.path.realpath(os.path.join(directory, *parts))
+            if path.startswith(directory + os.sep) and \
+                    path != self.manifest_path and os.path.isfile(path):
+                return path
+        return None
+
+    def get_etag(self, path, stat):
+        """
+        :param path: full path of the file
+        :param stat: os.stat_result of the file
+        :return: strong ETag of the file's content
+        """
+        key = (stat.st_size, stat.st_mtime_ns)
+        cached = self.etags.get(path)
+        if cached is None or cached[0] != key:
+            cached = key, f'"{file_hash(path)}"'
+            self.etags[path] = cached
+        return cached[1]
+
+    def select(self, environment, path):
+        """
+        Chooses the precompressed sibling of the file if the client
+        accepts its coding.
+
+        :param environment: WSGI environment of the request
+        :param path: full path of the file
+        :return: tuple of the path to send, its stat and the content
+        coding (None for the file itself)
+        """
+        accepted = parse_accept_encoding(
+            environment.get('HTTP_ACCEPT_ENCODING', ''))
+        for coding, extension in ENCODINGS:
+            if coding in accepted:
+                try:
+                    return (path + extension, os.stat(path + extension),
+                            coding)
+                except OSError:
+                    continue
+        return path, os.stat(path), None
+
+    def serve(self, environment, start_response, name, path, head=False):
+        """
+        :param environment: WSGI environment of the request
+        :param start_response: WSGI start_response
+        :param name: path of the file after the prefix
+        :param path: full path of the file
+        :param head: whether only the headers are sent
+        :return: body of the response
+        """
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in (
+                'application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        sent_path, stat, coding = self.select(environment, path)
+        etag = self.get_etag(sent_path, stat)
+        if self.manifest.is_fingerprinted(name):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = f'public, max-age={self.max_age}'
+        headers = [('Content-Type', content_type),
+                   ('ETag', etag),
+                   ('Cache-Control', cache_control),
+                   ('Last-Modified', formatdate(stat.st_mtime, usegmt=True)),
+                   ('Accept-Ranges', 'bytes')]
+        if os.path.exists(path + '.gz') or os.path.exists(path + '.br'):
+            headers.append(('Vary', 'Accept-Encoding'))
+        if coding is not None:
+            headers.append(('Content-Encoding', coding))
+
+        if etag in self.parse_etags(environment.get('HTTP_IF_NONE_MATCH')):
+            start_response('304 NOT MODIFIED', headers)
+            return []
+
+        size = stat.st_size
+        byte_range = None
+        if 'HTTP_RANGE' in environment and environment.get(
+                'HTTP_IF_RANGE', etag) == etag:
+            byte_range = parse_range(environment['HTTP_RANGE'], size)
+        if byte_range is False:
+            headers.append(('Content-Range', f'bytes */{size}'))
+            start_response('416 RANGE NOT SATISFIABLE', headers)
+            return []
+
+        if byte_range is None:
+            status, start, length = '200 OK', 0, size
+        else:
+            start, last = byte_range
+            status, length = '206 PARTIAL CONTENT', last - start + 1
+            headers.append(('Content-Range', f'bytes {start}-{last}/{size}'))
+        headers.append(('Content-Length', str(length)))
+        start_response(status, headers)
+        if head:
+            return []
+        file = open(sent_path, 'rb')
+        file_wrapper = environment.get('wsgi.file_wrapper')
+        if byte_range is None and file_wrapper is not None:
+            return file_wrapper(file, settings.READ_CHUNK_SIZE)
+        return FileIterator(file, start, length)
+
+    @staticmethod
+    def parse_etags(value):
+        """
+        :param value: value of the If-None-Match header
+        :return: list of the ETags, weak ones compared as strong
+        """
+        if not value:
+            return []
+        return [etag.strip().removeprefix('W/') for etag in value.split(',')]
+
+
+def fingerprinted_name(name, digest, length=12):
+    """
+    :param name: name of the file, e.g. 'css/site.css'
+    :param digest: hex digest of the file's content
+    :param length: number of the digest's characters in the name
+    :return: name with the hash, e.g. 'css/site.1a2b3c4d5e6f.css'
+    """
+    root, extension = os.path.splitext(name)
+    return f'{root}.{digest[:length]}{extension}'
+
+
+def compress(path, level=9):
+    """
+    Writes the precompressed siblings of the file.
+
+    :param path: path to the file
+    :param level: compression level
+    :return: list of the written paths
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    written = []
+    with gzip.open(path + '.gz', 'wb', compresslevel=level) as file:
+        file.write(data)
+    written.append(path + '.gz')
+    if brotli is not None:
+        with open(path + '.br', 'wb') as file:
+            file.write(brotli.compress(data, quality=11))
+        written.append(path + '.br')
+    return written
+
+
+def is_compressible(name):
+    """
+    :param name: name of the file
+    :return: whether the type of the file is worth compressing
+    """
+    content_type, _ = mimetypes.guess_type(name)
+    return content_type is not None and \
+        content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def build(source=settings.STATIC_DIR, target=settings.STATIC_ROOT,
+          min_compress_size=settings.STATIC_COMPRESS_MIN_SIZE):
+    """
+    Copies the static files into the target directory under their
+    fingerprinted names, precompresses them and writes the manifest.
+    The target directory is recreated from scratch.
+
+    :param source: directory with the original files
+    :param target: directory of the built files
+    :param min_compress_size: smaller files aren't precompressed
+    :return: dict of the fingerprinted names by the original ones
+    """
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    names = {}
+    for root, _, files in os.walk(source):
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+            built_name = fingerprinted_name(name, file_hash(path))
+            built_path = os.path.join(target, *built_name.split('/'))
+            os.makedirs(os.path.dirname(built_path), exist_ok=True)
+            shutil.copy2(path, built_path)
+            if is_compressible(name) and \
+                    os.path.getsize(path) >= min_compress_size:
+                compress(built_path)
+            names[name] = built_name
+    os.makedirs(target, exist_ok=True)
+    with open(os.path.join(target, MANIFEST_NAME), 'w',
+              encoding='utf-8') as file:
+        json.dump(names, file, indent=2, sort_keys=True)
+    return names
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else settings.STATIC_DIR
+    target = sys.argv[2] if len(sys.argv) > 2 else settings.STATIC_ROOT
+    built = build(source, target)
+    for original, fingerprinted in sorted(built.items()):
+        print(f'{original} -> {fingerprinted}')
+    print(f'{len(built)} files built into {target}.')
@@ -0,0 +1,1097 @@
+import mmap
+import os
+import sqlite3
+import struct
+from contextlib import contextmanager
+from threading import local, Lock, Condition
+from zlib import crc32
+
+import settings
+from serializers import dump_binary, load_binary
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, run a single worker there
+    fcntl = None
+
+# fdatasync skips the metadata, not available on macOS and Windows
+fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+
+class InMemoryStorage:
+    """
+    Default storage backend of the OnlineUniversity: the data lives in
+    the process' memory only, the objects keep the ids they were
+    created with. Also the base class of the persistent backends,
+    which hook into the same methods.
+    """
+
+    def load(self, site):
+        """
+        Loads all the stored data into the site.
+
+        :param site: an instance of OnlineUniversity
+        """
+
+    def refresh(self, site):
+        """
+        Applies the changes made by other processes since the last
+        load or refresh.
+
+        :param site: an instance of OnlineUniversity
+        """
+
+    def next_id(self, kind, current_id):
+        """
+        Gives the id to a new object.
+
+        :param kind: 'category', 'course' or 'student'
+        :param current_id: id the object got at its creation
+        :return: id of the object in the storage
+        """
+        return current_id
+
+    def handle(self, event, obj):
+        """
+        Listener of the site's events, persists the change.
+
+        :param event: name of the event, e.g. 'course_created'
+        :param obj: the changed object
+        """
+
+    @contextmanager
+    def unit_of_work(self):
+        """
+        Groups all the changes made inside the block into one batch.
+        """
+        yield
+
+    @staticmethod
+    def restore_category(site, category_id, name, parent_id):
+        parent = site.category_repository.get(parent_id) \
+            if parent_id is not None else None
+        category = site.create_category(name, parent)
+        category.id = category_id
+        site.index_category(category)
+        site.emit('category_created', category)
+
+    @staticmethod
+    def restore_course(site, course_id, name, type_, category_id, address,
+                       number_of_lessons):
+        category = site.category_repository.get(category_id) \
+            if category_id is not None else None
+        course = site.create_course(type_, name, category)
+        course.id = course_id
+        if address is not None:
+            course.address = address
+        if number_of_lessons is not None:
+            course.number_of_lessons = number_of_lessons
+        site.index_course(course)
+        site.emit('course_created', course)
+
+    @staticmethod
+    def restore_student(site, student_id, name):
+        student = site.create_user('student', name)
+        student.id = student_id
+        site.index_student(student)
+        site.emit('student_created', student)
+
+    @staticmethod
+    def restore_enrollment(site, course_id, student_id):
+        course = site.course_repository.get(course_id)
+        student = site.student_repository.get(student_id)
+        if course is None or student is None or student in course.students:
+            return
+        site.index_enrollment(course, student)
+        site.emit('student_enrolled', (course, student))
+
+
+class SqliteStorage(InMemoryStorage):
+    """
+    Storage backend keeping the data in an SQLite database (in the WAL
+    mode, so that the readers don't block the writer), shared by all
+    the workers of the app.
+
+    The site's repositories serve as the identity map: every row is
+    materialized into an object once, all the lookups are answered from
+    memory. The changes made inside a unit of work (e.g. one request)
+    are collected and written in one transaction with executemany.
+
+    Every change is also appended to the 'changes' table, refresh
+    replays the changes made by other workers since the last refresh.
+    The ids are taken from the 'sequences' table in blocks, so that
+    different workers never give the same id to different objects.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            parent_id INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category_id INTEGER,
+            address TEXT,
+            number_of_lessons INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS enrollments (
+            course_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            PRIMARY KEY (course_id, student_id)
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            key_1 INTEGER NOT NULL,
+            key_2 INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS sequences (
+            kind TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS categories_name ON categories (name);
+        CREATE INDEX IF NOT EXISTS courses_name ON courses (name);
+        CREATE INDEX IF NOT EXISTS courses_category ON courses (category_id);
+        CREATE INDEX IF NOT EXISTS students_name ON students (name);
+        CREATE INDEX IF NOT EXISTS enrollments_student
+            ON enrollments (student_id);
+    """
+    insert_statements = {
+        'category': 'INSERT OR REPLACE INTO categories (id, name, parent_id) '
+                    'VALUES (?, ?, ?)',
+        'course': 'INSERT OR REPLACE INTO courses (id, name, type, '
+                  'category_id, address, number_of_lessons) '
+                  'VALUES (?, ?, ?, ?, ?, ?)',
+        'student': 'INSERT OR REPLACE INTO students (id, name) VALUES (?, ?)',
+        'enrollment': 'INSERT OR IGNORE INTO enrollments '
+                      '(course_id, student_id) VALUES (?, ?)',
+    }
+    delete_statements = {
+        'category': 'DELETE FROM categories WHERE id = ?',
+        'course': 'DELETE FROM courses WHERE id = ?',
+        'student': 'DELETE FROM students WHERE id = ?',
+    }
+    change_statement = 'INSERT INTO changes (origin, kind, operation, key_1, ' \
+                       'key_2) VALUES (?, ?, ?, ?, ?)'
+
+    def __init__(self, path=settings.SQLITE_PATH,
+                 id_block_size=settings.SQLITE_ID_BLOCK_SIZE):
+        """
+        :param path: path to the database file
+        :param id_block_size: number of ids a worker takes at once
+        """
+        self.path = path
+        self.id_block_size = id_block_size
+        self.threads = local()
+        self.lock = Lock()
+        self.id_blocks = {}
+        self.last_change = 0
+        self.pid = os.getpid()
+        self.connection().executescript(self.schema)
+
+    @property
+    def origin(self):
+        """
+        Identifies the changes made by this storage object in this process.
+        """
+        return f'{os.getpid()}:{id(self)}'
+
+    def connection(self):
+        """
+        :return: the sqlite3 connection of the current thread
+        """
+        connection = getattr(self.threads, 'connection', None)
+        if connection is None or self.threads.pid != os.getpid():
+            connection = sqlite3.connect(self.path, isolation_level=None,
+                                         timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.threads.connection = connection
+            self.threads.pid = os.getpid()
+            self.threads.pending = None
+            self.threads.restoring = False
+        return connection
+
+    def next_id(self, kind, current_id):
+        with self.lock:
+            if self.pid != os.getpid():
+                # the blocks taken before the fork belong to the parent
+                self.id_blocks = {}
+                self.pid = os.getpid()
+            start, end = self.id_blocks.get(kind, (0, 0))
+            if start >= end:
+                connection = self.connection()
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    row = connection.execute(
+                        'SELECT next_id FROM sequences WHERE kind = ?',
+                        (kind,)).fetchone()
+                    start = row[0] if row else 0
+                    end = start + self.id_block_size
+                    connection.execute(
+                        'INSERT OR REPLACE INTO sequences (kind, next_id) '
+                        'VALUES (?, ?)', (kind, end))
+                    connection.execute('COMMIT')
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+            self.id_blocks[kind] = (start + 1, end)
+            return start
+
+    @staticmethod
+    def course_row(course):
+        return (course.id, course.name, course.type_,
+                course.category.id if course.category is not None else None,
+                getattr(course, 'address', None),
+                getattr(course, 'number_of_lessons', None))
+
+    def get_changes(self, event, obj):
+        """
+        Converts the site's event to the rows to write.
+
+        :param event: name of the event
+        :param obj: the changed object
+        :return: list of tuples (statement, parameters)
+        """
+        origin = self.origin
+        if event == 'category_created':
+            parent = obj.category.id if obj.category is not None else None
+            return [(self.insert_statements['category'],
+                     (obj.id, obj.name, parent)),
+                    (self.change_statement,
+                     (origin, 'category', 'insert', obj.id, None))]
+        if event in ('course_created', 'course_cloned'):
+            rows = [(self.insert_statements['course'], self.course_row(obj)),
+                    (self.change_statement,
+                     (origin, 'course', 'insert', obj.id, None))]
+            for student in obj.students:
+                rows.append((self.insert_statements['enrollment'],
+                             (obj.id, student.id)))
+            return rows
+        if event == 'course_moved':
+            return [(self.insert_statements['course'], self.course_row(obj)),
+                    (self.change_statement,
+                     (origin, 'course', 'update', obj.id, None))]
+        if event == 'student_created':
+            return [(self.insert_statements['student'], (obj.id, obj.name)),
+                    (self.change_statement,
+                     (origin, 'student', 'insert', obj.id, None))]
+        if event == 'student_enrolled':
+            course, student = obj
+            return [(self.insert_statements['enrollment'],
+                     (course.id, student.id)),
+                    (self.change_statement,
+                     (origin, 'enrollment', 'insert', course.id, student.id))]
+        if event.endswith('_removed'):
+            kind = event[:-len('_removed')]
+            rows = [(self.delete_statements[kind], (obj.id,)),
+                    (self.change_statement,
+                     (origin, kind, 'delete', obj.id, None))]
+            if kind in ('course', 'student'):
+                rows.append((f'DELETE FROM enrollments WHERE {kind}_id = ?',
+                             (obj.id,)))
+            return rows
+        return []
+
+    def handle(self, event, obj):
+        connection = self.connection()
+        if self.threads.restoring:
+            return
+        rows = self.get_changes(event, obj)
+        if not rows:
+            return
+        if self.threads.pending is not None:
+            self.threads.pending.extend(rows)
+        else:
+            self.write(connection, rows)
+
+    def write(self, connection, rows):
+        """
+        Writes the rows in one transaction, the consecutive rows with
+        the same statement are written with one executemany.
+
+        :param connection: sqlite3 connection
+        :param rows: list of tuples (statement, parameters)
+        """
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            batch = []
+            statement = None
+            for row_statement, parameters in rows:
+                if row_statement != statement and batch:
+                    connection.executemany(statement, batch)
+                    batch = []
+                statement = row_statement
+                batch.append(parameters)
+            if batch:
+                connection.executemany(statement, batch)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    @contextmanager
+    def unit_of_work(self):
+        connection = self.connection()
+        if self.threads.pending is not None:
+            # nested unit of work joins the outer one
+            yield
+            return
+        self.threads.pending = []
+        try:
+            yield
+            if self.threads.pending:
+                self.write(connection, self.threads.pending)
+        finally:
+            self.threads.pending = None
+
+    def load(self, site):
+        with self.lock:
+            connection = self.connection()
+            self.last_change = connection.execute(
+                'SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+            self.threads.restoring = True
+            try:
+                categories = {row[0]: row for row in connection.execute(
+                    'SELECT id, name, parent_id FROM categories')}
+                for category_id in sorted(categories):
+                    self.restore_category_tree(site, categories, category_id)
+                for row in connection.execute(
+                        'SELECT id, name, type, category_id, address, '
+                        'number_of_lessons FROM courses ORDER BY id'):
+                    self.restore_course(site, *row)
+                for row in connection.execute(
+                        'SELECT id, name FROM students ORDER BY id'):
+                    self.restore_student(site, *row)
+                for row in connection.execute(
+                        'SELECT course_id, student_id FROM enrollments'):
+                    self.restore_enrollment(site, *row)
+            finally:
+                self.threads.restoring = False
+
+    def refresh(self, site):
+        with self.lock:
+            connection = self.connection()
+            changes = connection.execute(
+                'SELECT seq, origin, kind, operation, key_1, key_2 FROM changes '
+                'WHERE seq > ? ORDER BY seq', (self.last_change,)).fetchall()
+            if not changes:
+                return
+            self.last_change = changes[-1][0]
+            self.threads.restoring = True
+            try:
+                for _, origin, kind, operation, key_1, key_2 in changes:
+                    if origin != self.origin:
+                        self.apply_change(site, connection, kind, operation,
+                                          key_1, key_2)
+            finally:
+                self.threads.restoring = False
+
+    def apply_change(self, site, connection, kind, operation, key_1, key_2):
+        """
+        Applies one change made by another worker. The objects already
+        present in the site (the identity map) are not loaded again.
+        """
+        repositories = {'category': site.category_repository,
+                        'course': site.course_repository,
+                        'student': site.student_repository}
+        if operation == 'delete':
+            obj = repositories[kind].get(key_1)
+            if obj is not None:
+                getattr(site, f'remove_{kind}')(obj)
+            return
+        if kind == 'enrollment':
+            self.restore_enrollment(site, key_1, key_2)
+            return
+        if operation == 'update':
+            course = site.course_repository.get(key_1)
+            row = connection.execute(
+                'SELECT category_id FROM courses WHERE id = ?',
+                (key_1,)).fetchone()
+            if course is not None and row is not None:
+                category = site.category_repository.get(row[0]) \
+                    if row[0] is not None else None
+                if category is not course.category:
+                    site.move_course(course, category)
+            return
+        if repositories[kind].get(key_1) is not None:
+            return
+        statements = {
+            'category': 'SELECT id, name, parent_id FROM categories '
+                        'WHERE id = ?',
+            'course': 'SELECT id, name, type, category_id, address, '
+                      'number_of_lessons FROM courses WHERE id = ?',
+            'student': 'SELECT id, name FROM students WHERE id = ?',
+        }
+        row = connection.execute(statements[kind], (key_1,)).fetchone()
+        if row is not None:
+            getattr(self, f'restore_{kind}')(site, *row)
+
+    def restore_category_tree(self, site, categories, category_id):
+        """
+        Restores the category after all of its parents.
+
+        :param site: an instance of OnlineUniversity
+        :param categories: dict of the categories' rows by id
+        :param category_id: id of the category to restore
+        """
+        chain = []
+        while category_id is not None and category_id in categories \
+                and site.category_repository.get(category_id) is None:
+            chain.append(categories[category_id])
+            category_id = categories[category_id][2]
+        for row in reversed(chain):
+            self.restore_category(site, *row)
+
+
+class SharedLogStorage(InMemoryStorage):
+    """
+    Storage backend keeping the data in an append-only log file shared
+    by all the workers of the app, no database needed. Every worker maps
+    the file into memory and keeps its own in-process index: the site's
+    repositories, the same identity map the SQLite backend uses.
+
+    The file starts with a header holding the length of the committed
+    log, its generation and the next free ids, followed by the records
+    of the changes. A writer takes the exclusive file lock, appends the
+    records of the whole unit of work and only then moves the committed
+    length, so the readers never see a half-written record and need no
+    lock at all: refresh compares the committed length in the mapped
+    header with its own position and replays the new records, which
+    costs one memory read if nothing has changed. Every record carries
+    the origin of its writer, the worker skips its own records.
+
+    The log is the write-ahead log of the site: once the records are
+    committed, the file is synced to disk (fsync). The threads committing
+    at the same time share one sync (group commit), so a burst of writes
+    doesn't pay for a sync each. Every record has a checksum, the
+    records torn by a crash are cut off on the next load.
+
+    Once the log grows over snapshot_size, the worker noticing it writes
+    a snapshot of the whole site in the binary format of the serializers
+    and starts a new, empty generation of the log; the other workers
+    switch to it on their next refresh or write. Loading reads the
+    latest snapshot and replays the log written after it.
+
+    The ids are reserved in blocks under the file lock, so different
+    workers never give the same id to different objects.
+    """
+    magic = b'PPLOG\x00\x00\x02'
+    snapshot_magic = b'PPSNAP\x00\x01'
+    # magic, committed length, generation, sealed flag, next ids of the
+    # categories, the courses and the students
+    header = struct.Struct('<8sQQQQQQ')
+    header_size = 64
+    committed_offset = 8
+    # committed length, generation and sealed flag read at once
+    state = struct.Struct('<QQQ')
+    sealed_offset = 24
+    id_offsets = {'category': 32, 'course': 40, 'student': 48}
+    # generation of the log and the position in it the snapshot covers
+    snapshot_header = struct.Struct('<8sQQ')
+    # length of the payload, its crc32, origin, type of the record
+    record_header = struct.Struct('<IIQB')
+    counter = struct.Struct('<Q')
+    string_length = struct.Struct('<I')
+    no_string = 0xFFFFFFFF
+    no_id = -1
+    # type of the record -> (name, struct of the integers, number of
+    # the strings following them)
+    record_types = {
+        1: ('category', struct.Struct('<qq'), 1),
+        2: ('course', struct.Struct('<qqq'), 3),
+        3: ('student', struct.Struct('<q'), 1),
+        4: ('enrollment', struct.Struct('<qq'), 0),
+        5: ('move', struct.Struct('<qq'), 0),
+        6: ('delete', struct.Struct('<qq'), 0),
+    }
+    record_codes = {name: (code, integers, strings) for code, (
+        name, integers, strings) in record_types.items()}
+    kinds = ('category', 'course', 'student')
+
+    def __init__(self, path=settings.SHARED_LOG_PATH,
+                 id_block_size=settings.SHARED_LOG_ID_BLOCK_SIZE,
+                 growth=settings.SHARED_LOG_GROWTH,
+                 fsync=settings.SHARED_LOG_FSYNC,
+                 snapshot_size=settings.SHARED_LOG_SNAPSHOT_SIZE):
+        """
+        :param path: path to the log file, the snapshot is written next
+        to it with the '.snapshot' extension
+        :param id_block_size: number of ids a worker takes at once
+        :param growth: minimal number of bytes the file grows by
+        :param fsync: sync the committed records to disk
+        :param snapshot_size: size of the log in bytes after which
+        a snapshot is taken, 0 disables the snapshots
+        """
+        self.path = path
+        self.snapshot_path = f'{path}.snapshot'
+        self.id_block_size = id_block_size
+        self.growth = growth
+        self.fsync = fsync
+        self.snapshot_size = snapshot_size
+        self.lock = Lock()
+        self.sync_condition = Condition()
+        self.syncing = False
+        self.synced = 0
+        self.threads = local()
+        self.pid = None
+        self.file_descriptor = None
+        self.map = None
+        self.id_blocks = {}
+        self.position = self.header_size
+        self.origin = 0
+        self.open()
+
+    def open(self):
+        """
+        Opens and maps the current generation of the log, creating it
+        if needed. Called again in every forked worker (the file lock
+        belongs to the open file, so the workers can't share it) and
+        once the log has been replaced by a new generation.
+        """
+        if self.file_descriptor is not None:
+            os.close(self.file_descriptor)
+        self.file_descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT,
+                                       0o644)
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.origin = int.from_bytes(os.urandom(8), 'little')
+        self.id_blocks = {}
+        self.synced = 0
+        with self.file_lock():
+            if os.fstat(self.file_descriptor).st_size < self.header_size:
+                os.ftruncate(self.file_descriptor, self.growth)
+                os.pwrite(self.file_descriptor, self.header.pack(
+                    self.magic, self.header_size, 0, 0, 0, 0, 0), 0)
+        # the old map isn't closed, refresh may be reading its header
+        # without the lock
+        self.map = mmap.mmap(self.file_descriptor, 0)
+        if self.map[:len(self.magic)] != self.magic:
+            raise Exception(f'{self.path} is not a log of the storage')
+
+    def check_process(self):
+        """
+        Reopens the file in a forked worker.
+        """
+        if self.pid != os.getpid():
+            self.open()
+
+    @contextmanager
+    def file_lock(self):
+        """
+        Exclusive lock of the file shared with the other workers.
+        """
+        if fcntl is not None:
+            fcntl.flock(self.file_descriptor, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self.file_descriptor, fcntl.LOCK_UN)
+
+    @contextmanager
+    def current_log_lock(self):
+        """
+        File lock of the current generation of the log: if the locked
+        log has been sealed in the meantime, the new one is opened and
+        locked instead.
+        """
+        while True:
+            with self.file_lock():
+                if not self.read_counter(self.sealed_offset):
+                    yield
+                    return
+            self.open()
+            self.position = self.header_size
+
+    def read_counter(self, offset):
+        return self.counter.unpack(
+            os.pread(self.file_descriptor, self.counter.size, offset))[0]
+
+    def write_counter(self, offset, value):
+        os.pwrite(self.file_descriptor, self.counter.pack(value), offset)
+
+    def read_state(self):
+        """
+        :return: tuple of the committed length, the generation and the
+        sealed flag, read from the mapped header without any lock
+        """
+        return self.state.unpack_from(self.map, self.committed_offset)
+
+    def committed_length(self):
+        return self.read_state()[0]
+
+    def next_id(self, kind, current_id):
+        with self.lock:
+            self.check_process()
+            start, end = self.id_blocks.get(kind, (0, 0))
+            if start >= end:
+                with self.current_log_lock():
+                    start = self.read_counter(self.id_offsets[kind])
+                    end = start + self.id_block_size
+                    self.write_counter(self.id_offsets[kind], end)
+            self.id_blocks[kind] = (start + 1, end)
+            return start
+
+    def encode(self, name, *values):
+        """
+        Encodes one record.
+
+        :param name: type of the record, e.g. 'course'
+        :param values: the integers of the record followed by its
+        strings, None for a missing value
+        :return: the record in bytes
+        """
+        code, integers, strings = self.record_codes[name]
+        count = len(values) - strings
+        payload = [integers.pack(*(self.no_id if value is None else value
+                                   for value in values[:count]))]
+        for value in values[count:]:
+            if value is None:
+                payload.append(self.string_length.pack(self.no_string))
+            else:
+                data = value.encode('utf-8')
+                payload.append(self.string_length.pack(len(data)))
+                payload.append(data)
+        payload = b''.join(payload)
+        return self.record_header.pack(len(payload), crc32(payload),
+                                       self.origin, code) + payload
+
+    def decode(self, data, offset, length, code):
+        """
+        Decodes the payload of one record.
+
+        :param data: the mapped log
+        :param offset: position of the payload
+        :param length: length of the payload
+        :param code: type of the record
+        :return: tuple of the record's name and its values
+        """
+        name, integers, strings = self.record_types[code]
+        values = [None if value == self.no_id else value
+                  for value in integers.unpack_from(data, offset)]
+        position = offset + integers.size
+        for _ in range(strings):
+            size = self.string_length.unpack_from(data, position)[0]
+            position += self.string_length.size
+            if size == self.no_string:
+                values.append(None)
+            else:
+                values.append(bytes(data[position:position + size])
+                              .decode('utf-8'))
+                position += size
+        return name, values
+
+    def get_records(self, event, obj):
+        """
+        Converts the site's event to the records to append.
+
+        :param event: name of the event
+        :param obj: the changed object
+        :return: list of the encoded records
+        """
+        if event == 'category_created':
+            parent = obj.category.id if obj.category is not None else None
+            return [self.encode('category', obj.id, parent, obj.name)]
+        if event in ('course_created', 'course_cloned'):
+            category = obj.category.id if obj.category is not None else None
+            records = [self.encode(
+                'course', obj.id, category,
+                getattr(obj, 'number_of_lessons', None), obj.type_,
+                obj.name, getattr(obj, 'address', None))]
+            for student in obj.students:
+                records.append(self.encode('enrollment', obj.id, student.id))
+            return records
+        if event == 'course_moved':
+            category = obj.category.id if obj.category is not None else None
+            return [self.encode('move', obj.id, category)]
+        if event == 'student_created':
+            return [self.encode('student', obj.id, obj.name)]
+        if event == 'student_enrolled':
+            course, student = obj
+            return [self.encode('enrollment', course.id, student.id)]
+        if event.endswith('_removed'):
+            kind = event[:-len('_removed')]
+            return [self.encode('delete', self.kinds.index(kind), obj.id)]
+        return []
+
+    def handle(self, event, obj):
+        if getattr(self.threads, 'restoring', False):
+            return
+        records = self.get_records(event, obj)
+        if not records:
+            return
+        pending = getattr(self.threads, 'pending', None)
+        if pending is not None:
+            pending.extend(records)
+        else:
+            self.append(records)
+
+    def append(self, records):
+        """
+        Appends the records to the log at once, commits them and waits
+        until they are synced to disk.
+
+        :param records: list of the encoded records
+        """
+        data = b''.join(records)
+        with self.lock:
+            self.check_process()
+            with self.current_log_lock():
+                end = self.read_counter(self.committed_offset)
+                size = os.fstat(self.file_descriptor).st_size
+                if end + len(data) > size:
+                    os.ftruncate(self.file_descriptor, max(
+                        end + len(data), size + self.growth, size * 2))
+                os.pwrite(self.file_descriptor, data, end)
+                end += len(data)
+                self.write_counter(self.committed_offset, end)
+                file_descriptor = self.file_descriptor
+        if self.fsync:
+            self.sync(file_descriptor, end)
+
+    def sync(self, file_descriptor, end):
+        """
+        Waits until the log is synced to disk up to the given position.
+        One of the waiting threads syncs the file, the sync covers all
+        the records committed before it started, so the threads which
+        committed meanwhile are released by the same sync.
+
+        :param file_descriptor: descriptor of the written log
+        :param end: position the caller's records end at
+        """
+        with self.sync_condition:
+            while True:
+                if file_descriptor != self.file_descriptor or \
+                        self.synced >= end:
+                    # a new generation starts from the synced snapshot
+                    return
+                if not self.syncing:
+                    self.syncing = True
+                    break
+                self.sync_condition.wait()
+        try:
+            target = self.read_counter(self.committed_offset)
+            fdatasync(file_descriptor)
+        finally:
+            with self.sync_condition:
+                self.syncing = False
+                self.synced = max(self.synced, target)
+                self.sync_condition.notify_all()
+
+    @contextmanager
+    def unit_of_work(self):
+        if getattr(self.threads, 'pending', None) is not None:
+            # nested unit of work joins the outer one
+            yield
+            return
+        self.threads.pending = []
+        try:
+            yield
+            if self.threads.pending:
+                self.append(self.threads.pending)
+        finally:
+            self.threads.pending = None
+
+    def load(self, site):
+        with self.lock:
+            self.check_process()
+            self.position = self.header_size
+            self.load_snapshot(site)
+            self.replay(site, recover=True)
+
+    def refresh(self, site):
+        if self.pid == os.getpid():
+            committed, _, sealed = self.read_state()
+            if committed == self.position and not sealed and not (
+                    self.snapshot_size and
+                    committed - self.header_size >= self.snapshot_size):
+                return
+        with self.lock:
+            self.check_process()
+            self.replay(site)
+            if self.snapshot_size and self.committed_length() - \
+                    self.header_size >= self.snapshot_size:
+                self.take_snapshot(site)
+
+    def replay(self, site, recover=False):
+        """
+        Applies the records committed by other workers since the last
+        replay, switching to the new generation of the log if the
+        current one has been sealed.
+
+        :param site: an instance of OnlineUniversity
+        :param recover: cut off the torn records instead of failing
+        """
+        self.threads.restoring = True
+        try:
+            while True:
+                end, _, sealed = self.read_state()
+                if end > len(self.map):
+                    # the file has grown since it was mapped
+                    self.map = mmap.mmap(self.file_descriptor, 0)
+                self.replay_records(site, end, recover)
+                if not sealed:
+                    return
+                self.open()
+                self.position = self.header_size
+        finally:
+            self.threads.restoring = False
+
+    def replay_records(self, site, end, recover=False, own=False):
+        """
+        :param site: an instance of OnlineUniversity
+        :param end: committed length of the log
+        :param recover: cut off the torn records instead of failing
+        :param own: apply the records of this worker as well
+        """
+        data = self.map
+        position = self.position
+        try:
+            while position < end:
+                if position + self.record_header.size > end:
+                    raise ValueError('torn record header')
+                length, checksum, origin, code = \
+                    self.record_header.unpack_from(data, position)
+                start = position + self.record_header.size
+                if start + length > end or code not in self.record_types \
+                        or crc32(data[start:start + length]) != checksum:
+                    raise ValueError('torn record')
+                if own or origin != self.origin:
+                    name, values = self.decode(data, start, length, code)
+                    self.apply_record(site, name, values)
+                position = start + length
+        except ValueError as error:
+            if not recover:
+                raise Exception(f'{self.path} is corrupted at {position}: '
+                                f'{error}')
+            print(f'{self.path}: {error} at {position}, the log is cut '
+                  f'off there.')
+            with self.file_lock():
+                self.write_counter(self.committed_offset, position)
+        finally:
+            self.position = position
+
+    def apply_record(self, site, name, values):
+        """
+        Applies one record. The objects already present in the site
+        (the identity map) are not created again.
+
+        :param site: an instance of OnlineUniversity
+        :param name: type of the record
+        :param values: values of the record
+        """
+        if name == 'category':
+            category_id, parent_id, category_name = values
+            if site.category_repository.get(category_id) is None:
+                self.restore_category(site, category_id, category_name,
+                                      parent_id)
+        elif name == 'course':
+            course_id, category_id, lessons, type_, course_name, address = \
+                values
+            if site.course_repository.get(course_id) is None:
+                self.restore_course(site, course_id, course_name, type_,
+                                    category_id, address, lessons)
+        elif name == 'student':
+            student_id, student_name = values
+            if site.student_repository.get(student_id) is None:
+                self.restore_student(site, student_id, student_name)
+        elif name == 'enrollment':
+            self.restore_enrollment(site, *values)
+        elif name == 'move':
+            course_id, category_id = values
+            course = site.course_repository.get(course_id)
+            category = site.category_repository.get(category_id) \
+                if category_id is not None else None
+            if course is not None and category is not course.category:
+                site.move_course(course, category)
+        elif name == 'delete':
+            kind_index, object_id = values
+            kind = self.kinds[kind_index]
+            obj = getattr(site, f'{kind}_repository').get(object_id)
+            if obj is not None:
+                getattr(site, f'remove_{kind}')(obj)
+
+    def take_snapshot(self, site):
+        """
+        Writes the snapshot of the site and replaces the log with a new,
+        empty generation. The log is locked meanwhile, the other workers
+        wait with their writes and then switch to the new log.
+
+        The snapshot holds the committed state only: it is rebuilt from
+        the previous snapshot and the log rather than taken from the
+        site, which may have the changes of the units of work still in
+        progress in other threads.
+
+        :param site: an instance of OnlineUniversity, up to date with
+        the log
+        :return: whether the snapshot has been taken, False if another
+        worker has just taken it
+        """
+        with self.file_lock():
+            end, generation, sealed = self.state.unpack(os.pread(
+                self.file_descriptor, self.state.size, self.committed_offset))
+            if sealed:
+                return False
+            self.replay(site)
+            objects = self.committed_objects(type(site)(), end)
+            self.write_file(self.snapshot_path, self.snapshot_header.pack(
+                self.snapshot_magic, generation, end) + dump_binary(objects))
+            ids = [self.read_counter(self.id_offsets[kind])
+                   for kind in self.kinds]
+            new_log = bytearray(self.growth)
+            self.header.pack_into(new_log, 0, self.magic, self.header_size,
+                                  generation + 1, 0, *ids)
+            self.write_file(f'{self.path}.next', new_log)
+            os.replace(f'{self.path}.next', self.path)
+            self.sync_directory()
+            self.write_counter(self.sealed_offset, 1)
+        self.open()
+        self.position = self.header_size
+        return True
+
+    def committed_objects(self, committed, end):
+        """
+        Loads the latest snapshot and all the records committed after it
+        (the own ones included) into a new site.
+
+        :param committed: an empty instance of OnlineUniversity
+        :param end: committed length of the log
+        :return: list of the categories, the courses and the students
+        """
+        position = self.position
+        self.position = self.header_size
+        try:
+            self.load_snapshot(committed)
+            self.replay_records(committed, end, own=True)
+        finally:
+            self.position = position
+        return list(committed.course_categories) + \
+            list(committed.courses) + list(committed.students)
+
+    def load_snapshot(self, site):
+        """
+        Loads the latest snapshot into the site and moves the position
+        to the first record written after it.
+
+        :param site: an instance of OnlineUniversity
+        """
+        _, generation, _ = self.read_state()
+        try:
+            with open(self.snapshot_path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            if generation:
+                raise Exception(f'The snapshot of {self.path} is missing')
+            return
+        magic, snapshot_generation, position = \
+            self.snapshot_header.unpack_from(data)
+        if magic != self.snapshot_magic:
+            raise Exception(f'{self.snapshot_path} is not a snapshot')
+        if snapshot_generation == generation:
+            self.position = position
+        elif snapshot_generation + 1 == generation:
+            # the snapshot was taken right before the log was replaced
+            self.position = self.header_size
+        else:
+            raise Exception(f'The snapshot of {self.path} doesn\'t match '
+                            f'the log')
+        objects = load_binary(data[self.snapshot_header.size:])
+        self.threads.restoring = True
+        try:
+            # the categories first, the courses are indexed by them
+            for kind in self.kinds:
+                index = getattr(site, f'index_{kind}')
+                for obj in objects:
+                    if obj.serializer_kind == kind:
+                        index(obj)
+                        site.emit(f'{kind}_created', obj)
+        finally:
+            self.threads.restoring = False
+
+    @staticmethod
+    def write_file(path, data):
+        """
+        Writes the file durably: into a temporary file first, synced,
+        then renamed over the target.
+
+        :param path: path to the file
+        :param data: content of the file
+        """
+        with open(f'{path}.tmp', 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f'{path}.tmp', path)
+
+    def sync_directory(self):
+        """
+        Syncs the directory of the log, so that the renames survive
+        a crash.
+        """
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)),
+                            os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+storages = {
+    'memory': InMemoryStorage,
+    'sqlite': SqliteStorage,
+    'log': SharedLogStorage,
+}
+
+
+def get_storage(name=settings.STORAGE):
+    """
+    Creates the storage backend by its name.
+
+    :param name: name of the backend, e.g. 'sqlite'
+    :return: a new storage backend
+    """
+    return storages[name]()
+
+
+class UnitOfWorkMiddleware:
+    """
+    WSGI middleware around the App: applies the changes made by other
+    workers before the request and writes all the changes made while
+    handling the request in one batch after it.
+    """
+
+    def __init__(self, app, site):
+        """
+        :param app: WSGI application
+        :param site: an instance of OnlineUniversity
+        """
+        self.app = app
+        self.site = site
+
+    def __call__(self, environment, start_response):
+        with request_unit_of_work(self.site):
+            return self.app(environment, start_response)
+
+
+@contextmanager
+def request_unit_of_work(site):
+    """
+    Applies the changes made by other workers, then writes all the
+    changes made inside the block in one batch.
+
+    :param site: an instance of OnlineUniversity
+    """
+    site.refresh()
+    with site.storage.unit_of_work():
+        yield
@@ -1,16 +1,98 @@
+import os
+
 from jinja2 import Environment, FileSystemLoader
 
+import settings
+from instrumentation import phase
+from static import static_url
+
+
+class TemplateEngine:
+    """
+    Process-wide template engine. Holds a single Jinja2 environment,
+    which keeps the compiled templates cached by their names. In the
+    development mode (auto_reload) the cached template gets recompiled
+    once its file has been modified, in the production mode the cache
+    is never checked against the filesystem.
+    """
+
+    def __init__(self, directory, auto_reload=True, cache_size=400):
+        """
+        :param directory: directory with the templates
+        :param auto_reload: check the templates' mtime before rendering
+        :param cache_size: number of compiled templates kept in memory,
+        -1 for no limit
+        """
+        self.directory = os.path.normpath(directory)
+        self.environment = Environment(
+            loader=FileSystemLoader(self.directory),
+            auto_reload=auto_reload,
+            cache_size=cache_size)
+        self.environment.globals['static_url'] = static_url
+
+    def normalize_name(self, template_name):
+        """
+        Views refer to the templates by their path from the project root
+        (e.g. 'templates/index.html'), while the loader looks them up
+        inside the templates' directory. The prefix is stripped, so that
+        both spellings share the same cache entry.
+
+        :param template_name: name or path of the template
+        :return: name of the template inside the templates' directory
+        """
+        prefix = f'{self.directory}/'
+        if template_name.startswith(prefix):
+            return template_name[len(prefix):]
+        return template_name
+
+    def get_template(self, template_name):
+        """
+        Returns the compiled template, compiling it on the first call.
+
+        :param template_name: name of html-file
+        :return: jinja2 Template object
+        """
+        return self.environment.get_template(
+            self.normalize_name(template_name))
+
+    def render(self, template_name, **kwargs):
+        """
+        Renders the template with the given context.
+
+        :param template_name: name of html-file
+        :param kwargs: any data passed into template
+        :return: rendered HTML template
+        """
+        with phase('render'):
+            return self.get_template(template_name).render(**kwargs)
+
+    def warm_up(self):
+        """
+        Precompiles every file in the templates' directory, so that
+        the first requests don't have to pay for it.
+
+        :return: number of compiled templates
+        """
+        compiled = 0
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory)
+                self.get_template(name.replace(os.sep, '/'))
+                compiled += 1
+        return compiled
+
+
+engine = TemplateEngine(settings.TEMPLATES_DIR,
+                        auto_reload=settings.TEMPLATES_AUTO_RELOAD)
+
 
 def render_template(template_name, **kwargs):
     """
-    Function that renders the templates using Jinja2.
+    Function that renders the templates using the shared template engine.
 
     :param template_name: name of html-file
     :param kwargs: any data passed into template
     :return: rendered HTML template
     """
-    with open(template_name, encoding='utf-8') as temp:
-        template = temp.read()
-        template = Environment(loader=FileSystemLoader(
-            'templates/')).from_string(template)
-    return template.render(**kwargs)
+    return engine.render(template_name, **kwargs)
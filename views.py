@@ -1,26 +1,142 @@
-from datetime import datetime
+from datetime import datetime, timezone
 
-from bases import BaseSerializer
+import settings
+from exceptions import BadRequest, NotFound
+from serializers import CourseSchema, encoder
 from template_renderer import render_template
-from core_views import TemplateView, ListView, CreateView
-from core import App
+from core_views import TemplateView, ListView, CreateView, response_cache
 from logs.config import Logger
+from bases import Subject
 from models import OnlineUniversity, EmailNotifier, TextMessageNotifier
+from events import dispatcher
 from decos import UrlPaths, debug
-
-site = OnlineUniversity()
+from storage import get_storage
+from instrumentation import timings, metrics
+from enrollments import EnrollmentStore
+
+site = OnlineUniversity(get_storage())
+if settings.EVENTS_ASYNC:
+    # the enrollment requests only queue the notifications
+    Subject.dispatcher = dispatcher
+enrollment_store = EnrollmentStore()
 email_notifier = EmailNotifier()
 text_notifier = TextMessageNotifier()
-logger = Logger('file', 'main')
+logger = Logger('views', 'file')
 routes = UrlPaths()
 
+# names of the cached data changed by every event of the site
+INVALIDATED_BY_EVENT = {
+    'category_created': ('categories',),
+    'category_removed': ('categories',),
+    'course_created': ('courses', 'categories'),
+    'course_cloned': ('courses', 'categories'),
+    'course_moved': ('courses', 'categories'),
+    'course_removed': ('courses', 'categories', 'students'),
+    'student_created': ('students',),
+    'student_removed': ('students',),
+    'student_enrolled': ('students',),
+}
+
+
+def invalidate_cache(event, obj):
+    """
+    Drops the cached pages depending on the data changed by the event.
+    :param event: name of the site's event
+    :param obj: changed object
+    """
+    response_cache.invalidate(*INVALIDATED_BY_EVENT.get(event, ()))
+
+
+def attach_notifiers(event, obj):
+    """
+    Subscribes the notifiers to every new course, including the ones
+    created by other workers and loaded from the storage.
+    :param event: name of the site's event
+    :param obj: changed object
+    """
+    if event == 'course_created':
+        obj.attach(email_notifier)
+        obj.attach(text_notifier)
+
+
+site.listeners.append(invalidate_cache)
+site.listeners.append(attach_notifiers)
+site.listeners.append(enrollment_store.handle)
+site.load()
+
 
 @routes.add_route('/api/')
 class CoursesApiView:
-    def __call__(self, request: dict):
+    """
+    JSON API with the list of courses. Supports the offset-based
+    pagination (?offset=0&limit=100) and the selection of the fields
+    (?fields=id,name,students). The body is generated in chunks, so the
+    server can start sending it before all the courses are encoded.
+    """
+    content_type = 'application/json; charset=utf-8'
+
+    @staticmethod
+    def get_int_param(params, name, default, minimum, maximum):
+        """
+        Reads an integer query parameter.
+        :param params: query parameters
+        :param name: name of the parameter
+        :param default: value used if the parameter is missing
+        :param minimum: minimal allowed value
+        :param maximum: maximal allowed value
+        :return: the value of the parameter
+        """
+        try:
+            value = int(params.get(name, default))
+        except ValueError:
+            raise BadRequest(f'{name} must be an integer')
+        if not minimum <= value <= maximum:
+            raise BadRequest(f'{name} must be between {minimum} '
+                             f'and {maximum}')
+        return value
+
+    @staticmethod
+    def stream(header, courses, schema, chunk_size):
+        """
+        Generates the JSON body chunk by chunk.
+        :param header: encoded fields of the response preceding the items
+        :param courses: courses of the page
+        :param schema: CourseSchema with the selected fields
+        :param chunk_size: number of courses encoded into one chunk
+        """
+        yield f'{header[:-1]},"items":['.encode('utf-8')
+        for start in range(0, len(courses), chunk_size):
+            chunk = ','.join(schema.encode(course) for course
+                             in courses[start:start + chunk_size])
+            if start:
+                chunk = f',{chunk}'
+            yield chunk.encode('utf-8')
+        yield b']}'
+
+    def __call__(self, request):
         logger.logger(f'{__name__}.py; CoursesApiView; sending the list of'
                       f'courses via API.')
-        return '200 Ok', [BaseSerializer(site.courses).save().encode('utf-8')]
+        params = request['req_params']
+        offset = self.get_int_param(params, 'offset', 0, 0, len(site.courses))
+        limit = self.get_int_param(params, 'limit', settings.API_PAGE_SIZE,
+                                   1, settings.API_MAX_PAGE_SIZE)
+        fields = [name for name in params.get('fields', '').split(',')
+                  if name]
+        schema = CourseSchema(fields)
+        total = len(site.courses)
+        courses = site.courses[offset:offset + limit]
+        next_offset = offset + limit
+        next_page = None
+        if next_offset < total:
+            next_page = f'{request.path}?offset={next_offset}&limit={limit}'
+            if fields:
+                next_page += f'&fields={",".join(fields)}'
+        header = encoder.encode({
+            'count': total, 'offset': offset, 'limit': limit,
+            'next': next_page})
+        return '200 Ok', \
+            self.stream(header, courses, schema, settings.API_CHUNK_SIZE), \
+            [('Content-Type', self.content_type)]
 
 
 @routes.add_route('/')
@@ -30,6 +146,7 @@ class IndexView(TemplateView):
     Main functionality is realized in the parent class.
     """
     template_name = 'templates/index.html'
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
 
 
 @routes.add_route('/about/')
@@ -39,6 +156,7 @@ class AboutView(TemplateView):
     Main functionality is realized in the parent class.
     """
     template_name = 'templates/about.html'
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
 
 
 @routes.add_route('/contacts/')
@@ -48,7 +166,7 @@ class ContactsView(TemplateView):
     Since it needs to be able to handle the POST-requests, the __call__
     method has been overridden here.
     """
-    template_name = 'templates/contacts.html'
+    template_name = 'templates/contact.html'
 
     @staticmethod
     @debug
@@ -81,10 +199,10 @@ class ContactsView(TemplateView):
         if request['method'] == 'POST':
             self.save_to_file(request)
             return '200 Ok', [render_template(
-                'templates/contacts.html').encode('utf-8')]
+                'templates/contact.html').encode('utf-8')]
         else:
             return '200 Ok', [render_template(
-                'templates/contacts.html').encode('utf-8')]
+                'templates/contact.html').encode('utf-8')]
 
 
 @routes.add_route('/all_courses/')
@@ -96,6 +214,8 @@ class CoursesListView(ListView):
     """
     template_name = 'templates/courses_list.html'
     queryset = site.courses
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
+    cache_tags = ('courses',)
 
 
 @routes.add_route('/create_course/')
@@ -126,15 +246,16 @@ class CreateCourseView(CreateView):
         if cat_id:
             category = site.find_category(int(cat_id))
         new_course = site.create_course('online', name, category)
-        new_course.observers.append(email_notifier)
-        new_course.observers.append(text_notifier)
-        site.courses.append(new_course)
+        site.add_course(new_course)
 
 
 @routes.add_route('/copy_course/')
+@routes.add_route('/course/<int:id>/copy/')
 class CopyCourseView:
     """
-    Class-based view to handle the copying of a course.
+    Class-based view to handle the copying of a course. The course is
+    looked up either by the id from the path or by the name from the
+    query string.
     """
 
     @debug
@@ -145,18 +266,20 @@ class CopyCourseView:
         :param request: HTTP-requests
         :return: tuple, first element is string, second HTML code
         """
-        params = request['request_params']
-        name = params['name']
-        logger.logger(
-            f'{__name__}.py; CopyCourseView; copying course {name}.')
-        old_course = site.get_course(name)
-        if old_course:
-            new_name = f'{name}_copy'
-            new_course = old_course.clone()
-            new_course.name = new_name
-            site.courses.append(new_course)
+        if 'id' in request['path_params']:
+            old_course = site.get_course_by_id(request['path_params']['id'])
+        else:
+            name = request['req_params'].get('name')
+            if not name:
+                raise BadRequest('The name of the course is required')
+            old_course = site.get_course(name)
+        if old_course is None:
+            raise NotFound('No such course')
+        logger.logger(f'{__name__}.py; CopyCourseView; '
+                      f'copying course {old_course.name}.')
+        site.clone_course(old_course, f'{old_course.name}_copy')
         return '200 Ok', [render_template(
-            'templates/course_list.html',
+            'templates/courses_list.html',
             objects_list=site.courses).encode('utf-8')]
 
 
@@ -169,6 +292,8 @@ class CategoryListView(ListView):
     """
     template_name = 'templates/categories_list.html'
     queryset = site.course_categories
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
+    cache_tags = ('categories',)
 
 
 @routes.add_route('/create_category/')
@@ -199,7 +324,7 @@ class CreateCategoryView(CreateView):
         if cat_id:
             category = site.find_category(int(cat_id))
         new_category = site.create_category(name, category)
-        site.course_categories.append(new_category)
+        site.add_category(new_category)
 
 
 @routes.add_route('/all_students/')
@@ -209,6 +334,8 @@ class StudentsListView(ListView):
     """
     template_name = 'templates/students_list.html'
     queryset = site.students
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
+    cache_tags = ('students', 'courses')
 
 
 @routes.add_route('/create_student/')
@@ -226,7 +353,7 @@ class StudentCreateView(CreateView):
         """
         name = data['name']
         new_student = site.create_user('student', name)
-        site.students.append(new_student)
+        site.add_student(new_student)
 
 
 @routes.add_route('/enlist_student/')
@@ -248,13 +375,96 @@ class EnlistStudentView(CreateView):
 
     def create_object(self, data):
         """
-        Retrieves the course and student's name from the POST-request
-        data. Then retrieves the objects for the two. And finally
-        enlists the student in the course.
+        Retrieves the course and students' names from the POST-request
+        data. Then retrieves the objects for them. And finally
+        enlists all the students in the course at once.
         :param data: POST-request data
         """
-        course_name = data['course_name']
+        course_name = data.get('course_name')
+        if not course_name:
+            raise BadRequest('The name of the course is required')
         course = site.get_course(course_name)
-        student_name = data['student_name']
-        student = site.get_student(student_name)
-        course.add_student(student)
+        if course is None:
+            raise BadRequest('No such course')
+        students = [site.get_student(student_name)
+                    for student_name in data.getlist('student_name')]
+        site.enroll_many(course, [student for student in students
+                                  if student is not None])
+
+
+@routes.add_route('/reports/')
+class ReportsView(TemplateView):
+    """
+    Class-based view for the reports on the enrollments, computed by
+    the columnar enrollment store instead of walking the courses and
+    the students.
+    """
+    template_name = 'templates/reports.html'
+    cache_timeout = settings.RESPONSE_CACHE_TIMEOUT
+    cache_tags = ('students', 'courses', 'categories')
+
+    def get_context_data(self):
+        """
+        Retrieves the context data for the template and updates it
+        with the aggregates of the enrollments.
+        """
+        context = super().get_context_data()
+        top_courses = [(site.course_repository.get(course_id), count)
+                       for course_id, count in enrollment_store.top_courses()]
+        categories = [
+            (site.category_repository.get(category_id), courses, enrollments)
+            for category_id, (courses, enrollments)
+            in enrollment_store.category_counts().items()]
+        categories.sort(key=lambda row: row[2], reverse=True)
+        courses_per_student = enrollment_store.courses_per_student()
+        # the periods are the UTC days, see enrollments_per_period
+        per_day = [(datetime.fromtimestamp(start, timezone.utc).date(), count)
+                   for start, count
+                   in enrollment_store.enrollments_per_period()]
+        context.update(
+            total_enrollments=len(enrollment_store),
+            top_courses=[row for row in top_courses if row[0] is not None],
+            categories=[row for row in categories if row[0] is not None],
+            courses_per_student=list(enumerate(courses_per_student, 1)),
+            max_students=max(courses_per_student, default=0),
+            enrollments_per_day=per_day)
+        return context
+
+
+class DebugTimingsView:
+    """
+    Class-based view showing the summary of the timings collected by
+    the debug decorator. Registered in the debug mode only.
+    """
+
+    def __call__(self, request):
+        """
+        :param request: HTTP-request
+        :return: tuple of the status, the body and the headers
+        """
+        return '200 Ok', [timings.format_summary().encode('utf-8')], \
+            [('Content-Type', 'text/plain; charset=utf-8')]
+
+
+class MetricsView:
+    """
+    Class-based view exporting the request metrics of all the workers
+    in the Prometheus text format. Registered if settings.METRICS is on.
+    """
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __call__(self, request):
+        """
+        :param request: HTTP-request
+        :return: tuple of the status, the body and the headers
+        """
+        return '200 Ok', [metrics.format_prometheus().encode('utf-8')], \
+            [('Content-Type', self.content_type)]
+
+
+if settings.DEBUG:
+    routes.add_route('/debug/timings/')(DebugTimingsView)
+
+if settings.METRICS:
+    routes.add_route('/metrics/', methods=['GET', 'HEAD'])(MetricsView)
+    metrics.add_collector('events', dispatcher.stats)